@@ -0,0 +1,546 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Cache of BibTeX for DOIs, in a single SQLite database
+
+It replaces the cache of a file per DOI under CACHE_DIR, which got imported
+into the database when it is created.
+
+BibTeX is used for DUECREDIT_DOI_CACHE_TTL since it was fetched, after which
+it gets revalidated (fetched again).  Failures to fetch it (e.g. for a wrong
+DOI) are cached too, but only for DUECREDIT_DOI_CACHE_NEGATIVE_TTL, and
+failures to reach the resolver only for DUECREDIT_DOI_CACHE_OFFLINE_TTL.  Up to
+DUECREDIT_DOI_CACHE_SIZE DOIs are kept, and the least recently used ones get
+evicted beyond that.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Any, NamedTuple, TypeVar
+
+from .config import (
+    CACHE_DIR,
+    DOI_CACHE_FILE,
+    DUECREDIT_DOI_CACHE_NEGATIVE_TTL,
+    DUECREDIT_DOI_CACHE_OFFLINE_TTL,
+    DUECREDIT_DOI_CACHE_SIZE,
+    DUECREDIT_DOI_CACHE_TTL,
+)
+from .log import lgr
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Mapping
+    from types import TracebackType
+
+__all__ = ["Cached", "DoiCache"]
+
+_T = TypeVar("_T")
+
+# Version of the schema, to be incremented whenever it changes
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bibtex (
+    doi TEXT PRIMARY KEY,
+    bibtex TEXT,
+    error TEXT,
+    offline INTEGER NOT NULL DEFAULT 0,
+    fetched REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS bibtex_accessed ON bibtex(accessed);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Counters of lookups kept in the stats table
+STATS = ("hits", "negative_hits", "stale_hits", "misses", "evicted")
+
+# Max number of DOIs to look up by a single query, within the limit on
+# the number of parameters of (older) SQLite
+_CHUNK = 500
+
+# Attempts at a query while the database is locked by another process, and
+# the wait before the first retry, in seconds (doubled with every retry)
+_BUSY_ATTEMPTS = 5
+_BUSY_WAIT = 0.05
+
+_DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _parse_duration(value: str) -> float:
+    """Seconds from e.g. "3600", "90m", "12h" or "30d"
+
+    Raises ValueError if it is not understood.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*([smhd]?)\s*", value.lower())
+    if not match:
+        raise ValueError(f"Misunderstood duration {value!r}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def _get_limits() -> tuple[float, float, float, int]:
+    """TTL, negative and offline TTLs, and max size as configured, or defaults"""
+    limits: list = []
+    for var, value, parse, default in (
+        ("DUECREDIT_DOI_CACHE_TTL", DUECREDIT_DOI_CACHE_TTL, _parse_duration, "90d"),
+        (
+            "DUECREDIT_DOI_CACHE_NEGATIVE_TTL",
+            DUECREDIT_DOI_CACHE_NEGATIVE_TTL,
+            _parse_duration,
+            "1d",
+        ),
+        (
+            "DUECREDIT_DOI_CACHE_OFFLINE_TTL",
+            DUECREDIT_DOI_CACHE_OFFLINE_TTL,
+            _parse_duration,
+            "10m",
+        ),
+        ("DUECREDIT_DOI_CACHE_SIZE", DUECREDIT_DOI_CACHE_SIZE, int, "10000"),
+    ):
+        try:
+            limit = parse(value)
+            if limit < 0:
+                raise ValueError
+        except ValueError:
+            lgr.warning(f"Misunderstood value {value!r} for {var}. Using {default}")
+            limit = parse(default)
+        limits.append(limit)
+    return limits[0], limits[1], limits[2], limits[3]
+
+
+def _is_busy(e: sqlite3.Error) -> bool:
+    return isinstance(e, sqlite3.OperationalError) and (
+        "locked" in str(e) or "busy" in str(e)
+    )
+
+
+def _retry_busy(func: Callable[..., _T], *args: Any) -> _T:
+    """Call func, retrying with a backoff while the database is locked
+
+    The connection waits for the lock already, but SQLite gives up right away
+    when waiting could deadlock (e.g. two readers upgrading to writers).
+    """
+    wait = _BUSY_WAIT
+    for attempt in range(1, _BUSY_ATTEMPTS + 1):
+        try:
+            return func(*args)
+        except sqlite3.Error as e:
+            if attempt == _BUSY_ATTEMPTS or not _is_busy(e):
+                raise
+            lgr.debug("Database is locked (%s), retrying in %.2f sec", e, wait)
+        time.sleep(wait)
+        wait *= 2
+    raise AssertionError("not reached")
+
+
+class Cached(NamedTuple):
+    """What is cached for a DOI, see `DoiCache.lookup`"""
+
+    bibtex: str | None
+    """BibTeX, unless it never was fetched"""
+    error: str | None
+    """Why fetching it has failed the last time, if it did"""
+    fetched: float
+    """When it was fetched (or failed to be) the last time"""
+    fresh: bool
+    """If it is not to be fetched again yet"""
+
+
+class DoiCache:
+    """BibTeX for DOIs, cached in an SQLite database
+
+    Writes are done in transactions, so many processes could share the
+    cache.  It could be used by many threads as well.
+
+    Parameters
+    ----------
+    filename : str, optional
+      Database to use, which gets created if it does not exist
+    legacy_dir : str, optional
+      Directory with the cache of a file per DOI, to import (once) into the
+      database as it gets created
+    ttl, negative_ttl, offline_ttl : float, optional
+      For how many seconds fetched BibTeX, a failure to fetch it, or a failure
+      to reach the resolver stays fresh.  Default is as configured by
+      DUECREDIT_DOI_CACHE_TTL (90 days), DUECREDIT_DOI_CACHE_NEGATIVE_TTL
+      (1 day) and DUECREDIT_DOI_CACHE_OFFLINE_TTL (10 minutes)
+    max_size : int, optional
+      Max number of DOIs to keep, 0 for no limit.  Default is as configured
+      by DUECREDIT_DOI_CACHE_SIZE (10000)
+    """
+
+    def __init__(
+        self,
+        filename: str = DOI_CACHE_FILE,
+        legacy_dir: str | None = CACHE_DIR,
+        ttl: float | None = None,
+        negative_ttl: float | None = None,
+        offline_ttl: float | None = None,
+        max_size: int | None = None,
+    ) -> None:
+        self.filename = filename
+        (
+            default_ttl,
+            default_negative_ttl,
+            default_offline_ttl,
+            default_max_size,
+        ) = _get_limits()
+        self.ttl = default_ttl if ttl is None else ttl
+        self.negative_ttl = (
+            default_negative_ttl if negative_ttl is None else negative_ttl
+        )
+        self.offline_ttl = default_offline_ttl if offline_ttl is None else offline_ttl
+        self.max_size = default_max_size if max_size is None else max_size
+        dirpath = os.path.dirname(filename)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath, exist_ok=True)
+        # concurrent processes wait for each other's transactions to finish.
+        # Journal stays in the default mode, since WAL needs shared memory,
+        # which is not there on NFS
+        self._db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self._lock = threading.Lock()
+        try:
+            self._setup(legacy_dir)
+        except BaseException:
+            self._db.close()
+            raise
+
+    def _setup(self, legacy_dir: str | None) -> None:
+        db = self._db
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ValueError(
+                f"Unsupported version {version} of the schema of {self.filename}. "
+                f"Supported is {SCHEMA_VERSION}. Upgrade duecredit?"
+            )
+        if version < SCHEMA_VERSION:
+            # exclusively, so only one of the processes gets to create it
+            db.isolation_level = None
+            db.execute("BEGIN EXCLUSIVE")
+            try:
+                version = db.execute("PRAGMA user_version").fetchone()[0]
+                if not version:
+                    self._execute_script(_SCHEMA)
+                    if legacy_dir and os.path.isdir(legacy_dir):
+                        self._import_dir(legacy_dir)
+                    db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            finally:
+                db.isolation_level = ""
+
+    def _execute_script(self, script: str) -> None:
+        # not by executescript, which would commit
+        for statement in script.split(";"):
+            if statement.strip():
+                self._db.execute(statement)
+
+    def _import_dir(self, legacy_dir: str) -> int:
+        dois = []
+        for dirpath, _, filenames in os.walk(legacy_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    with open(path) as f:
+                        bibtex = f.read()
+                    fetched = os.path.getmtime(path)
+                except (OSError, UnicodeDecodeError) as e:
+                    lgr.warning(f"Failed to import cached BibTeX from {path}: {e}")
+                    continue
+                doi = os.path.relpath(path, legacy_dir).replace(os.sep, "/")
+                dois.append((doi, bibtex, fetched, fetched))
+        self._db.executemany(
+            "INSERT OR IGNORE INTO bibtex (doi, bibtex, fetched, accessed) "
+            "VALUES (?, ?, ?, ?)",
+            dois,
+        )
+        if dois:
+            lgr.info(
+                "Imported BibTeX for %d DOIs cached under %s into %s, so the "
+                "former could be removed",
+                len(dois),
+                legacy_dir,
+                self.filename,
+            )
+        self._evict()
+        return len(dois)
+
+    def migrate(self, legacy_dir: str = CACHE_DIR) -> int:
+        """Import the cache of a file per DOI, keeping BibTeX cached already
+
+        Returns
+        -------
+        int
+          Number of the files imported
+        """
+        with self._lock, self._db:
+            return self._import_dir(legacy_dir)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> DoiCache:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def _select(self, columns: str, dois: list[str]) -> list[tuple]:
+        rows = []
+        for i in range(0, len(dois), _CHUNK):
+            chunk = dois[i : i + _CHUNK]
+            rows.extend(
+                self._db.execute(
+                    f"SELECT doi, {columns} FROM bibtex WHERE doi IN "
+                    f"({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+            )
+        return rows
+
+    def get(self, doi: str) -> str | None:
+        """BibTeX for the DOI, or None if it is not cached"""
+        return self.get_many([doi]).get(doi)
+
+    def get_many(self, dois: Iterable[str]) -> dict[str, str]:
+        """BibTeX for those of the DOIs which are cached, fresh or not
+
+        Unlike `lookup`, it does not count as their use.
+        """
+        with self._lock:
+            rows = _retry_busy(self._select, "bibtex", list(dois))
+        return {doi: bibtex for doi, bibtex in rows if bibtex is not None}
+
+    def lookup(self, dois: Iterable[str], count: bool = True) -> dict[str, Cached]:
+        """What is cached for those of the DOIs which are, by few queries
+
+        They are marked as used now (for the eviction), and unless `count` is
+        False (e.g. for maintenance of the cache), the lookups are counted
+        into the stats.  That is done by a single write, which is only best
+        effort: if it fails (e.g. the database stays locked by another
+        process), what was read is returned regardless.
+        """
+        dois = list(dict.fromkeys(dois))
+        now = time.time()
+        found = {}
+        with self._lock:
+            rows = _retry_busy(self._select, "bibtex, error, offline, fetched", dois)
+        for doi, bibtex, error, offline, fetched in rows:
+            fresh = now - fetched < self._get_ttl(error, offline)
+            found[doi] = Cached(bibtex, error, fetched, fresh)
+        counts = {}
+        if count:
+            fresh = [c for c in found.values() if c.fresh]
+            counts = {
+                "hits": sum(c.error is None for c in fresh),
+                "negative_hits": sum(c.error is not None for c in fresh),
+                "stale_hits": len(found) - len(fresh),
+                "misses": len(dois) - len(found),
+            }
+        try:
+            with self._lock:
+                _retry_busy(self._record_use, list(found), now, counts)
+        except sqlite3.Error as e:
+            lgr.debug("Failed to record the use of %s: %s", self.filename, e)
+        return found
+
+    def _get_ttl(self, error: str | None, offline: int) -> float:
+        if error is None:
+            return self.ttl
+        return self.offline_ttl if offline else self.negative_ttl
+
+    def _record_use(self, dois: list[str], now: float, counts: dict[str, int]) -> None:
+        if not dois and not any(counts.values()):
+            return
+        with self._db:
+            self._db.executemany(
+                "UPDATE bibtex SET accessed = ? WHERE doi = ?",
+                [(now, doi) for doi in dois],
+            )
+            self._count(**counts)
+
+    def set(self, doi: str, bibtex: str) -> None:
+        """Cache BibTeX for the DOI"""
+        self.set_many({doi: bibtex})
+
+    def set_many(self, bibtexs: Mapping[str, str]) -> None:
+        """Cache BibTeX for many DOIs, in a single transaction"""
+        if not bibtexs:
+            return
+        now = time.time()
+        with self._lock:
+            _retry_busy(
+                self._write,
+                "INSERT OR REPLACE INTO bibtex (doi, bibtex, fetched, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                [(doi, bibtex, now, now) for doi, bibtex in bibtexs.items()],
+            )
+
+    def set_failed(self, errors: Mapping[str, str], offline: bool = False) -> None:
+        """Cache failures to fetch BibTeX for the DOIs, keeping their BibTeX
+
+        So the (stale) BibTeX which was fetched before, if any, is still
+        there while the DOIs are not fetched again for the negative TTL, or
+        for the offline TTL if the resolver could not be reached (`offline`).
+        """
+        if not errors:
+            return
+        now = time.time()
+        with self._lock:
+            _retry_busy(
+                self._write,
+                "INSERT INTO bibtex (doi, error, offline, fetched, accessed) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (doi) DO UPDATE SET error = excluded.error, "
+                "offline = excluded.offline, fetched = excluded.fetched, "
+                "accessed = excluded.accessed",
+                [(doi, error, offline, now, now) for doi, error in errors.items()],
+            )
+
+    def _write(self, statement: str, rows: list[tuple]) -> None:
+        """Write the rows and evict what is beyond the max size, in a transaction"""
+        with self._db:
+            self._db.executemany(statement, rows)
+            self._evict()
+
+    def _count(self, **counts: int) -> None:
+        self._db.executemany(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            [(name, n) for name, n in counts.items() if n],
+        )
+
+    def _evict(self, max_size: int | None = None) -> int:
+        """Remove the least recently used DOIs beyond the max size"""
+        max_size = self.max_size if max_size is None else max_size
+        if not max_size:
+            return 0
+        (size,) = self._db.execute("SELECT COUNT(*) FROM bibtex").fetchone()
+        if size <= max_size:
+            return 0
+        evicted = self._db.execute(
+            "DELETE FROM bibtex WHERE doi IN "
+            "(SELECT doi FROM bibtex ORDER BY accessed LIMIT ?)",
+            (size - max_size,),
+        ).rowcount
+        self._count(evicted=evicted)
+        lgr.debug("Evicted %d DOIs from %s", evicted, self.filename)
+        return evicted
+
+    def prune(
+        self,
+        failed: bool = False,
+        stale: bool = False,
+        everything: bool = False,
+        max_size: int | None = None,
+    ) -> int:
+        """Remove DOIs from the cache
+
+        Failures, for which the negative (or offline) TTL has passed, are
+        always removed, and so are the least recently used DOIs beyond the max size.
+
+        Parameters
+        ----------
+        failed : bool, optional
+          Remove all the failures, so those DOIs get fetched again.  The
+          (stale) BibTeX fetched for them before, if any, is kept until then
+        stale : bool, optional
+          Remove BibTeX for which the TTL has passed
+        everything : bool, optional
+          Remove all the DOIs
+        max_size : int, optional
+          Max number of DOIs to keep, instead of the configured one
+
+        Returns
+        -------
+        int
+          Number of the DOIs removed
+        """
+        now = time.time()
+        with self._lock, self._db:
+            db = self._db
+            if everything:
+                return db.execute("DELETE FROM bibtex").rowcount
+            removed = db.execute(
+                "DELETE FROM bibtex WHERE bibtex IS NULL AND "
+                + (
+                    "1"
+                    if failed
+                    else "fetched <= ? - CASE offline WHEN 0 THEN ? ELSE ? END"
+                ),
+                () if failed else (now, self.negative_ttl, self.offline_ttl),
+            ).rowcount
+            if failed:
+                # revalidated the next time
+                db.execute(
+                    "UPDATE bibtex SET error = NULL, offline = 0, fetched = 0 "
+                    "WHERE error IS NOT NULL"
+                )
+            if stale:
+                removed += db.execute(
+                    "DELETE FROM bibtex WHERE error IS NULL AND fetched <= ?",
+                    (now - self.ttl,),
+                ).rowcount
+            return removed + self._evict(max_size)
+
+    def stats(self) -> dict[str, int]:
+        """Counts of the lookups (see STATS) since the stats were reset, and
+        numbers of the cached DOIs: "size" (all), "failed" and "stale"
+        """
+        now = time.time()
+        with self._lock:
+            db = self._db
+            stats = dict.fromkeys(STATS, 0)
+            stats.update(db.execute("SELECT name, value FROM stats"))
+            stats["size"], stats["failed"], stats["stale"] = db.execute(
+                "SELECT COUNT(*), COUNT(error), "
+                "COALESCE(SUM(error IS NULL AND fetched <= ?), 0) FROM bibtex",
+                (now - self.ttl,),
+            ).fetchone()
+        return stats
+
+    def reset_stats(self) -> None:
+        """Reset the counts of the lookups"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM stats")
+
+    def entries(self) -> list[tuple[str, Cached, float]]:
+        """All the cached DOIs, with what is cached and when it was last used
+
+        The most recently used come first.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT doi, bibtex, error, offline, fetched, accessed FROM bibtex "
+                "ORDER BY accessed DESC, doi"
+            ).fetchall()
+        entries = []
+        for doi, bibtex, error, offline, fetched, accessed in rows:
+            fresh = now - fetched < self._get_ttl(error, offline)
+            entries.append((doi, Cached(bibtex, error, fetched, fresh), accessed))
+        return entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM bibtex").fetchone()[0]
@@ -10,6 +10,6 @@
 
 __docformat__ = "restructuredtext"
 
-from . import cmd_summary, cmd_test
+from . import cmd_cache, cmd_summary, cmd_test
 
-__all__ = ["cmd_summary", "cmd_test"]
+__all__ = ["cmd_cache", "cmd_summary", "cmd_test"]
@@ -0,0 +1,235 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Inspect, prune or warm up the cache of BibTeX for DOIs, and report its statistics."""
+
+from __future__ import annotations
+
+import argparse
+from datetime import datetime
+import os
+import re
+import time
+from typing import TYPE_CHECKING
+
+from ..config import DOI_CACHE_FILE
+
+if TYPE_CHECKING:
+    from ..cache import DoiCache
+
+__docformat__ = "restructuredtext"
+
+# magic line for manpage summary
+# man: -*- % cache of BibTeX for DOIs
+
+
+def setup_parser(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "action",
+        nargs="?",
+        choices=("stats", "show", "prune", "warm"),
+        default="stats",
+        help="What to do: report statistics of the cache and its lookups "
+        "(default), show the cached DOIs (or BibTeX for the DOIs), prune "
+        "the cache, or warm it up by fetching BibTeX for the DOIs cited by "
+        "the injections and in the FILEs",
+    )
+
+    parser.add_argument(
+        "items",
+        nargs="*",
+        metavar="DOI|FILE",
+        help="DOIs to show cached BibTeX for, or files to warm the cache up "
+        "with the DOIs from: collected citations (e.g. .duecredit.p) or "
+        ".bib files",
+    )
+
+    parser.add_argument(
+        "-f",
+        "--filename",
+        default=DOI_CACHE_FILE,
+        help="Database with the cache. Default: %(default)s",
+    )
+
+    parser.add_argument(
+        "--failed",
+        action="store_true",
+        help="Prune all the failures to fetch BibTeX, so those DOIs get "
+        "fetched again",
+    )
+
+    parser.add_argument(
+        "--stale",
+        action="store_true",
+        help="Prune BibTeX which is due to be fetched again",
+    )
+
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Prune all the DOIs",
+    )
+
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        help="Prune the least recently used DOIs beyond this number "
+        "(instead of DUECREDIT_DOI_CACHE_SIZE)",
+    )
+
+    parser.add_argument(
+        "--no-injections",
+        dest="injections",
+        action="store_false",
+        help="Do not warm the cache up with the DOIs cited by the injections",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of concurrent queries to warm the cache up by. "
+        "Default: DUECREDIT_DOI_WORKERS, or 8",
+    )
+
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="Reset the statistics of the lookups, after reporting them",
+    )
+
+
+def _format_time(timestamp: float) -> str:
+    if not timestamp:
+        return "-"
+    return datetime.fromtimestamp(timestamp).isoformat(sep=" ", timespec="seconds")
+
+
+def run(args: argparse.Namespace) -> int:
+    from ..cache import DoiCache
+
+    if args.action == "warm":
+        with DoiCache(args.filename) as cache:
+            return _warm(cache, args)
+    if not os.path.exists(args.filename):
+        print(f"Cache {args.filename} does not exist")
+        return 1
+    with DoiCache(args.filename, legacy_dir=None) as cache:
+        if args.action == "stats":
+            _print_stats(cache.stats(), cache.filename)
+            if args.reset:
+                cache.reset_stats()
+        elif args.action == "show":
+            _show(cache, args.items)
+        elif args.action == "prune":
+            removed = cache.prune(
+                failed=args.failed,
+                stale=args.stale,
+                everything=args.all,
+                max_size=args.max_size,
+            )
+            print(f"Pruned {removed} DOIs, {len(cache)} remain")
+    return 0
+
+
+def _print_stats(stats: dict[str, int], filename: str) -> None:
+    print(f"Cache: {filename} ({os.path.getsize(filename)} bytes)")
+    print(
+        f"DOIs: {stats['size']} ({stats['failed']} failed, {stats['stale']} stale)"
+    )
+    lookups = (
+        stats["hits"] + stats["negative_hits"] + stats["stale_hits"] + stats["misses"]
+    )
+    ratio = f" ({stats['hits'] / lookups:.1%})" if lookups else ""
+    print(f"Lookups: {lookups}")
+    print(f"  hits: {stats['hits']}{ratio}")
+    print(f"  failures: {stats['negative_hits']}")
+    print(f"  stale: {stats['stale_hits']}")
+    print(f"  misses: {stats['misses']}")
+    print(f"Evicted: {stats['evicted']}")
+
+
+def _show(cache: DoiCache, dois: list[str]) -> None:
+    if dois:
+        bibtexs = cache.get_many(dois)
+        for doi in dois:
+            print(bibtexs.get(doi, f"% {doi} is not cached"))
+        return
+    for doi, cached, accessed in cache.entries():
+        if cached.error is not None:
+            state = "failed" if cached.fresh else "failed, expired"
+        else:
+            state = "ok" if cached.fresh else "stale"
+        print(
+            f"{doi}  {state}  fetched {_format_time(cached.fetched)}  "
+            f"used {_format_time(accessed)}"
+        )
+
+
+# "doi" fields of BibTeX entries
+_BIB_DOI_RE = re.compile(r"""\bdoi\s*=\s*[{"]\s*([^}"]+?)\s*[}"]""", re.IGNORECASE)
+
+
+def _get_file_dois(filename: str) -> list[str]:
+    """DOIs cited in a file with collected citations, or in a .bib file"""
+    if filename.endswith(".bib"):
+        with open(filename, encoding="utf-8") as f:
+            return _BIB_DOI_RE.findall(f.read())
+    from ..entries import Doi
+    from ..io import PickleOutput
+    from ..journal import load_journals
+
+    collectors = [PickleOutput.load(filename)]
+    # citations of forked or crashed processes, which were not merged (yet)
+    collectors.extend(due for _, due in PickleOutput.load_shards(filename))
+    collectors.extend(due for _, due in load_journals(filename))
+    return [
+        citation.entry.doi
+        for due in collectors
+        for citation in due.citations.values()
+        if isinstance(citation.entry, Doi)
+    ]
+
+
+def _warm(cache: DoiCache, args: argparse.Namespace) -> int:
+    from ..io import _fetch_dois, _get_answered
+    from ..snapshot import get_injection_dois, get_snapshot
+
+    dois: list[str] = []
+    if args.injections:
+        dois.extend(get_injection_dois())
+    for filename in args.items:
+        dois.extend(_get_file_dois(filename))
+    dois = list(dict.fromkeys(dois))
+    # those in the snapshot are never looked up in the cache
+    snapshot = get_snapshot()
+    to_lookup = [doi for doi in dois if doi not in snapshot]
+    # not counted, so the stats reflect the use of the cache by reports
+    cached = cache.lookup(to_lookup, count=False)
+    missing = [
+        doi for doi in to_lookup if doi not in cached or not cached[doi].fresh
+    ]
+    print(
+        f"{len(dois)} DOIs: {len(dois) - len(to_lookup)} in the snapshot, "
+        f"{len(to_lookup) - len(missing)} cached, {len(missing)} to fetch"
+    )
+    if not missing:
+        return 0
+
+    start = time.time()
+    fetched, failures = _fetch_dois(missing, args.workers, 0.5, 10)
+    duration = time.time() - start
+    cache.set_many(fetched)
+    cache.set_failed(_get_answered(failures))
+    print(
+        f"Fetched BibTeX for {len(fetched)} DOIs in {duration:.1f} sec "
+        f"({len(missing) / max(duration, 1e-3):.1f} DOIs/sec)"
+    )
+    for doi, e in sorted(failures.items()):
+        print(f"Failed to fetch BibTeX for {doi}: {e}")
+    return 1 if failures else 0
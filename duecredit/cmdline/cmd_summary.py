@@ -11,13 +11,18 @@
 from __future__ import annotations
 
 import argparse
+from datetime import datetime
 import os
 import sys
+from typing import TYPE_CHECKING
 
-from ..config import DUECREDIT_FILE
+from ..config import DUECREDIT_DB, DUECREDIT_FILE
 from ..io import BibTeXOutput, TextOutput
 from ..log import lgr
 
+if TYPE_CHECKING:
+    from ..collector import DueCreditCollector
+
 __docformat__ = "restructuredtext"
 
 # magic line for manpage summary
@@ -46,17 +51,89 @@ def setup_parser(parser: argparse.ArgumentParser) -> None:
         help="Way to present the summary",
     )
 
+    parser.add_argument(
+        "--db",
+        nargs="?",
+        const=DUECREDIT_DB,
+        help="Report citations of all the runs recorded into the SQLite "
+        "database (see DUECREDIT_OUTPUTS=sqlite), instead of FILENAME. "
+        "Default: %(const)s",
+    )
+
+    parser.add_argument(
+        "--by",
+        choices=("package", "module", "path", "entry", "tag"),
+        help="Only report the number of runs and the total count of the "
+        "citations from --db, aggregated by that",
+    )
+
+    parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        help="Only consider runs from --db started since then "
+        "(e.g. 2024-01-31 or 2024-01-31T12:00)",
+    )
+
+    parser.add_argument(
+        "--tag",
+        help="Only consider citations from --db with that tag "
+        "(e.g. implementation)",
+    )
+
+
+def _print_aggregates(rows: list, by: str) -> None:
+    if not rows:
+        print("No citations found")
+        return
+    names = [str(name) for name, *_ in rows]
+    width = max(len(by), *map(len, names))
+    print(f"{by:<{width}}  {'runs':>6}  {'count':>10}  last run")
+    for name, (_, n_runs, count, last) in zip(names, rows):
+        last_ = datetime.fromtimestamp(last).isoformat(sep=" ", timespec="seconds")
+        print(f"{name:<{width}}  {n_runs:>6}  {count:>10}  {last_}")
+
 
 def run(args: argparse.Namespace) -> int:
+    from ..collector import DueCreditCollector
     from ..io import PickleOutput
+    from ..journal import load_journals
 
-    if not os.path.exists(args.filename):
+    if args.db or args.by:
+        from ..store import SQLiteStore
+
+        db = args.db or DUECREDIT_DB
+        if not os.path.exists(db):
+            lgr.debug(f"Database {db} doesn't exist.  No summary available")
+            return 1
+        with SQLiteStore(db) as store:
+            if args.by:
+                _print_aggregates(
+                    store.aggregate(args.by, since=args.since, tag=args.tag), args.by
+                )
+                return 0
+            due = store.load(since=args.since, tag=args.tag)
+        return _dump(due, args)
+
+    # journaled by processes which are still running, or crashed
+    journals = load_journals(args.filename)
+    if os.path.exists(args.filename):
+        due = PickleOutput.load(args.filename)
+    elif journals:
+        due = DueCreditCollector()
+    else:
         lgr.debug(f"File {args.filename} doesn't exist.  No summary available")
         return 1
 
-    due = PickleOutput.load(args.filename)
+    # citations dumped by forked processes, which were not merged (yet)
+    for _, shard_due in PickleOutput.load_shards(args.filename):
+        due._merge(shard_due)
+    for _, journal_due in journals:
+        due._merge(journal_due)
     # CollectorSummary(due).dump()
+    return _dump(due, args)
+
 
+def _dump(due: DueCreditCollector, args: argparse.Namespace) -> int:
     out: TextOutput | BibTeXOutput
     if args.format == "text":
         out = TextOutput(sys.stdout, due, args.style)
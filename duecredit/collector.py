@@ -10,24 +10,205 @@
 
 from __future__ import annotations
 
-from functools import wraps
+from contextlib import nullcontext
+from functools import lru_cache, wraps
 import logging
 import os
 import sys
+from threading import Lock, get_ident
 from typing import TYPE_CHECKING, Any, NamedTuple
 
-from .config import DUECREDIT_FILE
+from .config import DUECREDIT_COUNTING, DUECREDIT_FILE
 from .entries import DueCreditEntry
 from .io import PickleOutput, TextOutput
 from .utils import borrowdoc, never_fail
-from .versions import external_versions
+from .versions import external_versions, metadata_versions
 
 lgr = logging.getLogger("duecredit.collector")
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from .counters import SharedCounters
+    from .journal import CitationsJournal
+    from .store import SQLiteOutput
+
     from typing_extensions import Self
 
 
+COUNTING_MODES = ("exact", "first", "sampled")
+
+
+def _parse_counting(counting: str) -> tuple[str, int]:
+    """Parse specification of the counting mode into (mode, every) pair
+
+    "exact", "first" or "sampled:N" with N >= 1 are understood.
+    """
+    mode, _, every = counting.strip().lower().partition(":")
+    if mode not in COUNTING_MODES or bool(every) != (mode == "sampled"):
+        raise ValueError(
+            f"Unknown counting mode {counting!r}. "
+            "Use 'exact', 'first', or 'sampled:N'"
+        )
+    if mode != "sampled":
+        return mode, 1
+    try:
+        n = int(every)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise ValueError(f"Sampling rate must be a positive integer, got {every!r}")
+    return mode, n
+
+
+def _retire_wrapper(wrapper) -> None:
+    """Rebind the original object on the parent the dcite wrapper was injected into
+
+    Consecutive retired wrappers (e.g. multiple injections for the same
+    function) are skipped as well.
+    """
+    rebind = getattr(wrapper, "__duecredit_parent__", None)
+    if not rebind:
+        return
+    parent, obj_name = rebind
+    if getattr(parent, obj_name, None) is not wrapper:
+        # was rebound by someone else already -- leave it be
+        return
+    orig = wrapper.__duecredited__
+    while getattr(orig, "__duecredit_retired__", False):
+        orig = orig.__duecredited__
+    lgr.log(3, "Rebinding %s of %s to %s", obj_name, parent, orig)
+    setattr(parent, obj_name, orig)
+
+
+# Max number of distinct argument values combinations for which results of
+# matching conditions are memoized per decorated function
+CONDITIONS_CACHE_SIZE = 128
+
+# Marker for an argument which was not provided in the call
+_NOT_PROVIDED = object()
+
+# Types of the values for which matching conditions gets memoized.  Others
+# could be arbitrarily large, and should not be kept alive by the memo
+_MEMOIZED_TYPES = frozenset({str, bytes, int, float, bool, type(None)})
+
+
+def _compile_conditions(
+    conditions: dict[Any, Any], func: Any = None
+) -> Callable[[tuple[Any, ...], dict[str, Any]], bool]:
+    """Compile `conditions` of dcite into a predicate on (args, kwargs) of a call
+
+    If `func` is provided, its signature is consulted so that the argument
+    could also be matched when passed as a keyword under the name it has in
+    the signature (or not matched by name if it is positional-only).
+    """
+    params = None
+    if func is not None:
+        import inspect
+
+        try:
+            params = list(inspect.signature(func).parameters.values())
+        except (TypeError, ValueError):
+            pass
+
+    compiled = []
+    for (argpos, kwarg), values in conditions.items():
+        name, *attrs = kwarg.split(".")
+        names: tuple[str, ...] = (name,)
+        if params is not None and argpos < len(params):
+            param = params[argpos]
+            if param.kind is param.POSITIONAL_ONLY:
+                names = ()
+            elif param.kind is param.POSITIONAL_OR_KEYWORD and param.name != name:
+                names = (name, param.name)
+        compiled.append(
+            (argpos, names, tuple(attrs), frozenset(values), "DC_DEFAULT" in values)
+        )
+
+    if len(compiled) == 1 and len(compiled[0][1]) == 1 and not compiled[0][2]:
+        # The most common case -- a single argument checked for its value
+        argpos, (name,), _, values, default_ok = compiled[0]
+
+        def match_single(fargs: tuple[Any, ...], fkwargs: dict[str, Any]) -> bool:
+            if name in fkwargs:
+                value = fkwargs[name]
+            elif len(fargs) > argpos:
+                value = fargs[argpos]
+            else:
+                return default_ok
+            try:
+                return value in values
+            except TypeError:  # unhashable, thus cannot be among values
+                return False
+
+        return match_single
+
+    compiled_ = tuple(compiled)
+
+    def check(values_: tuple[Any, ...]) -> bool:
+        for value, (_, _, _, values, default_ok) in zip(values_, compiled_):
+            if value is _NOT_PROVIDED:
+                if not default_ok:
+                    # value was specified but not provided and not default
+                    return False
+                continue
+            try:
+                if value not in values:
+                    return False
+            except TypeError:  # unhashable, thus cannot be among values
+                return False
+        return True
+
+    # The same values tend to recur, so results are memoized given the
+    # extracted values, if those are all primitive
+    check_cached = lru_cache(maxsize=CONDITIONS_CACHE_SIZE)(check)
+
+    def match(fargs: tuple[Any, ...], fkwargs: dict[str, Any]) -> bool:
+        values_ = []
+        for argpos, names, attrs, _, _ in compiled_:
+            for name in names:
+                if name in fkwargs:
+                    value = fkwargs[name]
+                    break
+            else:
+                if len(fargs) > argpos:
+                    value = fargs[argpos]
+                else:
+                    values_.append(_NOT_PROVIDED)
+                    continue
+            # condition could be on the value of the attribute(s) of the value
+            for attr in attrs:
+                value = getattr(value, attr)
+            values_.append(value)
+        if all(v is _NOT_PROVIDED or type(v) in _MEMOIZED_TYPES for v in values_):
+            return check_cached(tuple(values_))
+        return check(tuple(values_))
+
+    match.cache_info = check_cached.cache_info  # type: ignore[attr-defined]
+    return match
+
+
+@lru_cache(maxsize=CONDITIONS_CACHE_SIZE)
+def _compile_frozen_conditions(
+    conditions: tuple[tuple[Any, frozenset[Any]], ...]
+) -> Callable[[tuple[Any, ...], dict[str, Any]], bool]:
+    """`_compile_conditions` for conditions frozen into a tuple, memoized"""
+    return _compile_conditions(dict(conditions))
+
+
+# guards assignment of new citation ids
+_citation_ids_lock = Lock()
+
+
+def _get_entry(entry: Any) -> Any:
+    """Create the entry if a factory for it (e.g. `BibTeX.lazy`) was provided"""
+    if callable(entry):
+        entry = entry()
+        if not isinstance(entry, DueCreditEntry):
+            raise TypeError(f"Entry factory returned {entry!r}, not an entry")
+    return entry
+
+
 class CitationKey(NamedTuple):
     path: str
     entry_key: str
@@ -91,7 +272,11 @@ class Citation:
             tags = ["implementation"]
         self.tags = tags or []
         self.version = version
-        self.count = 0
+        self._count = 0
+        # per-thread shards of the count, see _increment
+        self._shards: dict[int, list[int]] = {}
+        # (SharedCounters, id) if counted in shared memory instead
+        self._shared: tuple[SharedCounters, int] | None = None
 
     def __repr__(self) -> str:
         argl = [repr(self._entry)]
@@ -108,6 +293,50 @@ class Citation:
             args = ""
         return self.__class__.__name__ + f"({args})"
 
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_count"] = self.count
+        state["_shards"] = {}
+        state["_shared"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        if "count" in state:  # pickled by older versions of duecredit
+            state["_count"] = state.pop("count")
+        state.setdefault("_shards", {})
+        state.setdefault("_shared", None)
+        self.__dict__.update(state)
+
+    @property
+    def count(self) -> int:
+        """How many times it was cited, across all the threads (and processes)"""
+        count = self._count + sum(shard[0] for shard in list(self._shards.values()))
+        if self._shared is not None:
+            count += self._shared[0].total(self._shared[1])
+        return count
+
+    @count.setter
+    def count(self, count: int) -> None:
+        self._shards = {}
+        self._count = count
+        if self._shared is not None:
+            self._count -= self._shared[0].total(self._shared[1])
+
+    def _increment(self, n: int = 1) -> None:
+        """Increment the count, safely for concurrent use from multiple threads
+
+        Every thread increments only its own shard of the count, so no count
+        is lost without any lock taken.  Shards get summed by `count`.
+        If counted in shared memory, the shards are not used at all.
+        """
+        shared = self._shared
+        if shared is not None and shared[0].increment(shared[1], n):
+            return
+        try:
+            self._shards[get_ident()][0] += n
+        except KeyError:
+            self._shards.setdefault(get_ident(), [0])[0] += n
+
     @property
     def path(self) -> str:
         return self._path
@@ -203,6 +432,13 @@ class DueCreditCollector:
     citations : list of Citation, optional
       List of citations -- associations between references and particular
       code, with a description for its use, tags etc
+    counting : str, optional
+      How functions decorated with `dcite` count their citations: "exact"
+      (every call), "first" (only the first call, after which the wrapper
+      becomes a pass-through or gets replaced with the original function
+      where it was injected), or "sampled:N" (every N-th call, counted with
+      the weight of N).  Default is taken from DUECREDIT_COUNTING
+      environment variable, or "exact"
     """
 
     # TODO?  rename "entries" to "references"?  or "references" is closer to "citations"
@@ -210,17 +446,52 @@ class DueCreditCollector:
         self,
         entries: dict[str, DueCreditEntry] | None = None,
         citations: dict[CitationKey, Citation] | None = None,
+        counting: str | None = None,
     ) -> None:
         self._entries = entries or {}
         self.citations = citations or {}
+        # stable ids of the citations, e.g. for SharedCounters
+        self._citation_ids: dict[CitationKey, int] = {}
+        self._shared_counters: SharedCounters | None = None
+        # ids starting from which are not known to the process we forked from
+        self._shared_ids_limit: int | None = None
+        self._journal: CitationsJournal | None = None
+        # counts which were already stored, per store (e.g. DUECREDIT_FILE)
+        self._stored: dict[str, dict[CitationKey, int]] = {}
+        if counting is None:
+            try:
+                counting_ = _parse_counting(DUECREDIT_COUNTING)
+            except ValueError as e:
+                lgr.warning(f"{e}. Falling back to 'exact' counting")
+                counting_ = ("exact", 1)
+        else:
+            counting_ = _parse_counting(counting)
+        self._counting = counting_
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_shared_counters"] = None
+        state["_shared_ids_limit"] = None
+        state["_journal"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        # pickled by older versions of duecredit might lack some
+        state.setdefault("_citation_ids", {})
+        state.setdefault("_shared_counters", None)
+        state.setdefault("_shared_ids_limit", None)
+        state.setdefault("_journal", None)
+        state.setdefault("_stored", {})
+        self.__dict__.update(state)
 
     @never_fail
     def add(self, entry: DueCreditEntry | list[DueCreditEntry]) -> None:
-        """entry should be a DueCreditEntry object"""
+        """entry should be a DueCreditEntry object (or a factory returning one)"""
         if isinstance(entry, list):
             for e in entry:
                 self.add(e)
         else:
+            entry = _get_entry(entry)
             key = entry.get_key()
             self._entries[key] = entry
             lgr.log(1, "Collector added entry %s", key)
@@ -262,6 +533,7 @@ class DueCreditCollector:
         if path is None:
             raise ValueError("path must be provided")
 
+        entry = _get_entry(entry)
         if isinstance(entry, DueCreditEntry):
             # new one -- add it
             self.add(entry)
@@ -271,37 +543,213 @@ class DueCreditCollector:
 
         entry_key = entry_.get_key()
         citation_key = Citation.get_key(path=path, entry_key=entry_key)
+        new = None
         try:
             citation = self.citations[citation_key]
         except KeyError:
-            self.citations[citation_key] = citation = Citation(entry_, **kwargs)
+            # setdefault, so concurrent threads end up with the same Citation
+            new = Citation(entry_, **kwargs)
+            citation = self.citations.setdefault(citation_key, new)
+            if self._shared_counters is not None:
+                self._share_citation(citation)
         assert isinstance(citation, Citation)
         assert citation.key == citation_key
         # update citation count
-        citation.count += 1
+        citation._increment()
+        if citation is new and self._journal is not None:
+            self._journal.record(citation)
 
-        # TODO: theoretically version shouldn't differ if we don't preload previous results
-        if not citation.version:
-            version = kwargs.get("version")
+        # Versions of the packages are not resolved here, to not slow down
+        # the cited code, but all at once by _resolve_versions before dumping
+        if not citation.version and kwargs.get("version"):
+            citation.version = kwargs["version"]
 
-            if not version and citation.path:
-                modname = citation.path.split(".", 1)[0]
+        return citation
 
-                if "." in modname:
-                    package = modname.split(".", 1)[0]
-                else:
-                    package = modname
+    def _resolve_versions(self, metadata_only: bool = False) -> None:
+        """Resolve versions of the packages for citations which have none yet
 
-                # package_loaded = sys.modules.get(package)
-                # if package_loaded:
-                #     # find the citation for that module
-                #     for citation in self.citations.values():
-                #         if citation.package == package \
-                #                 and not citation.version:
-                version = external_versions[package]
-            citation.version = version
+        It should be called while those packages are still loaded, e.g. before
+        the citations are dumped.
 
-        return citation
+        Parameters
+        ----------
+        metadata_only : bool, optional
+          Do not import packages which are not loaded, but consult only
+          metadata of the installed distributions
+        """
+        unresolved = [
+            c for c in self.citations.values() if not c.version and c.package
+        ]
+        if not unresolved:
+            return
+        packages = sorted({c.package for c in unresolved})  # type: ignore[misc]
+        lgr.debug("Resolving versions for %d packages", len(packages))
+        ev = metadata_versions if metadata_only else external_versions
+        versions = {package: ev[package] for package in packages}
+        for citation in unresolved:
+            citation.version = versions[citation.package]  # type: ignore[index]
+
+    def _get_citation_id(self, key: CitationKey) -> int:
+        """Stable id of the citation, to index SharedCounters with"""
+        ids = self._citation_ids
+        try:
+            return ids[key]
+        except KeyError:
+            with _citation_ids_lock:
+                return ids.setdefault(key, len(ids))
+
+    def _enable_shared_counters(self, **kwargs: Any) -> None:
+        """Count citations in shared memory, also by the processes forked later
+
+        Parameters
+        ----------
+        **kwargs
+          Passed to `SharedCounters`
+        """
+        from .counters import SharedCounters
+
+        self._shared_counters = SharedCounters(**kwargs)
+        for citation in list(self.citations.values()):
+            self._share_citation(citation)
+
+    def _share_citation(self, citation: Citation) -> None:
+        counters = self._shared_counters
+        if counters is None or citation._shared is not None:
+            return
+        id_ = self._get_citation_id(citation.key)
+        limit = self._shared_ids_limit
+        if id_ >= counters.max_ids or (limit is not None and id_ >= limit):
+            # would not fit, or other processes do not know it -- count locally
+            return
+        citation._shared = (counters, id_)
+
+    def _release_shared_counters(self, fold: bool = True) -> None:
+        """Stop counting in shared memory
+
+        Parameters
+        ----------
+        fold : bool, optional
+          Either to add the totals from shared memory into the counts.  Should
+          be False in forked processes, for which the parent accounts.
+        """
+        counters, self._shared_counters = self._shared_counters, None
+        if counters is None:
+            return
+        for citation in list(self.citations.values()):
+            shared, citation._shared = citation._shared, None
+            if shared is not None and fold:
+                citation._increment(shared[0].total(shared[1]))
+        counters.close()
+
+    def _start_journal(
+        self, filename: str = DUECREDIT_FILE, interval: float = 0
+    ) -> None:
+        """Record citations into a journal, so they survive crashes
+
+        See `duecredit.journal.CitationsJournal` for the parameters.
+        """
+        from .journal import CitationsJournal
+
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = CitationsJournal(self, filename, interval=interval)
+
+    def _after_fork(self) -> None:
+        """Account in the forked process only for the citations made by it"""
+        # not journaled -- our citations reach the parent via a shard
+        self._journal = None
+        self.citations = {}
+        self._stored = {}
+        if self._shared_ids_limit is None:
+            # ids assigned from now on are not known to the other processes
+            self._shared_ids_limit = len(self._citation_ids)
+
+    def _pop_citations(self) -> DueCreditCollector:
+        """Return a collector with the citations collected so far, and reset them
+
+        Only the cited entries are included, so it is compact to be passed
+        around, e.g. from a worker process to its parent to `_merge` there.
+        """
+        citations, self.citations = self.citations, {}
+        self._stored = {}
+        entries = {c.entry.key: c.entry for c in citations.values()}
+        return DueCreditCollector(entries=entries, citations=citations)
+
+    def _get_unstored(self, store: str) -> DueCreditCollector:
+        """Return a collector with the citations made since they were stored
+
+        Counts are only of the citations made since then, so the returned
+        collector could be merged into the `store` (e.g. a file name), and
+        passed to `_mark_stored` afterwards.
+        """
+        stored = self._stored.get(store, {})
+        citations = {}
+        for key, citation in list(self.citations.items()):
+            count = citation.count - stored.get(key, 0)
+            if not count:
+                continue
+            unstored = Citation(
+                citation.entry,
+                description=citation.description,
+                path=citation.path,
+                version=citation.version,
+                cite_module=citation.cite_module,
+                tags=citation.tags,
+            )
+            unstored.count = count
+            citations[key] = unstored
+        entries = {c.entry.key: c.entry for c in citations.values()}
+        return DueCreditCollector(entries=entries, citations=citations)
+
+    def _mark_stored(self, store: str, unstored: DueCreditCollector) -> None:
+        """Account for citations (from `_get_unstored`) as stored in `store`"""
+        stored = self._stored.setdefault(store, {})
+        for key, citation in unstored.citations.items():
+            stored[key] = stored.get(key, 0) + citation.count
+
+    def _merge(self, other: DueCreditCollector, journal: bool = True) -> int:
+        """Merge entries and citations collected by another collector
+
+        Counts of the citations known to both get added up, so it could be
+        used to combine citations collected by multiple processes.
+
+        Parameters
+        ----------
+        journal : bool, optional
+          Either to record merged citations in our journal (if any).  Should
+          be False if they are kept elsewhere until dumped (e.g. in a shard)
+
+        Returns
+        -------
+        int
+          Number of the citations which were new to us
+        """
+        for key, entry in other._entries.items():
+            self._entries.setdefault(key, entry)
+        n_new = 0
+        journal_ = self._journal
+        with journal_.lock if journal_ is not None else nullcontext():
+            for key, citation in other.citations.items():
+                ours = self.citations.setdefault(key, citation)
+                if ours is citation:
+                    n_new += 1
+                    if self._shared_counters is not None:
+                        self._share_citation(citation)
+                    if journal_ is None:
+                        continue
+                    if journal:
+                        journal_.record(citation)
+                    else:
+                        journal_.exclude(citation, citation.count, increment=False)
+                    continue
+                if journal_ is not None and not journal:
+                    journal_.exclude(ours, citation.count)
+                else:
+                    ours._increment(citation.count)
+                if not ours.version and citation.version:
+                    ours.version = citation.version
+        return n_new
 
     def _citations_fromentrykey(self) -> dict[str, Citation]:
         """Return a dictionary with the current citations indexed by the entry key"""
@@ -317,36 +765,8 @@ class DueCreditCollector:
         conditions: dict[Any, Any], *fargs: Any, **fkwargs: Any
     ) -> bool:
         """Helper to identify when to trigger citation given parameters to the function call"""
-        for (argpos, kwarg), values in conditions.items():
-            # main logic -- assess default and if get to the next one if
-            # given argument is not present
-            if not ((len(fargs) > argpos) or (kwarg in fkwargs)):
-                if "DC_DEFAULT" not in values:
-                    # if value was specified but not provided and not default
-                    # conditions are not satisfied
-                    return False
-                continue
-
-            # "extract" the value.  Must be defined here
-            value = "__duecredit_magical_undefined__"
-            if len(fargs) > argpos:
-                value = fargs[argpos]
-            if kwarg in fkwargs:
-                value = fkwargs[kwarg]
-            assert value != "__duecredit_magical_undefined__"
-
-            if "." in kwarg:
-                # we were requested to condition based on the value of the attribute
-                # of the value.  So get to the attribute(s) value
-                for attr in kwarg.split(".")[1:]:
-                    value = getattr(value, attr)
-
-            # Value is present but not matching
-            if value not in values:
-                return False
-
-        # if checks passed -- we must have matched conditions
-        return True
+        frozen = tuple((cond, frozenset(values)) for cond, values in conditions.items())
+        return _compile_frozen_conditions(frozen)(fargs, fkwargs)
 
     @never_fail
     @borrowdoc(Citation, "__init__", replace="PLUGDOCSTRING")
@@ -401,8 +821,12 @@ class DueCreditCollector:
         3
         """
 
+        conditions = kwargs.pop("conditions", {})
+
         def func_wrapper(func):
-            conditions = kwargs.pop("conditions", {})
+            # compiled once per decorated function, for all its calls
+            if conditions:
+                match_conditions = _compile_conditions(conditions, func)
             path = kwargs.get("path")
             if not path:
                 # deduce path from the actual function which was decorated
@@ -423,22 +847,99 @@ class DueCreditCollector:
             # see e.g.
             # http://stackoverflow.com/questions/961048/get-class-that-defined-method
             lgr.debug(f"Decorating func {func.__name__} within module {modname}")
+            entry = args[0] if args else kwargs.get("entry")
+            if isinstance(entry, (str, DueCreditEntry)):
+                # assign the id already, so processes forked before the first
+                # citation would share it
+                entry_key = entry if isinstance(entry, str) else entry.get_key()
+                self._get_citation_id(Citation.get_key(path, entry_key))
             # TODO: unittest for all the __version__ madness
 
-            # TODO: check if we better use wrapt module which provides superior "correctness"
-            #       of decorating.  vcrpy uses wrapt, and that thing seems to wrap
-            @wraps(func)
-            def cite_wrapper(*fargs, **fkwargs):
+            # Citation resolved upon the first citation along with the
+            # citations dict it belongs to, so later citations are just an
+            # increment of its count.  If collector's citations get replaced
+            # we go through cite() again.  The pair is replaced as a whole, so
+            # concurrent threads could not see a mix of two
+            cache: tuple[Any, Any] = (None, None)
+
+            def cite_matching(fargs, fkwargs) -> Citation | None:
+                nonlocal cache
                 try:
-                    if not conditions or self._args_match_conditions(
-                        conditions, *fargs, **fkwargs
-                    ):
-                        self.cite(*args, **kwargs)
+                    if not conditions or match_conditions(fargs, fkwargs):
+                        citations, citation = cache
+                        if citations is self.citations:
+                            citation._increment()
+                            return citation
+                        citations = self.citations
+                        citation = self.cite(*args, **kwargs)
+                        if citation is not None:
+                            cache = (citations, citation)
+                        return citation
                 except Exception as e:
                     lgr.warning(f"Failed to cite due to {e}")
-                return func(*fargs, **fkwargs)
+                return None
+
+            # collectors loaded from older pickles might lack _counting
+            counting, every = getattr(self, "_counting", ("exact", 1))
+
+            # TODO: check if we better use wrapt module which provides superior "correctness"
+            #       of decorating.  vcrpy uses wrapt, and that thing seems to wrap
+            if counting == "first":
+                retired = False
+
+                @wraps(func)
+                def cite_wrapper(*fargs, **fkwargs):
+                    nonlocal retired
+                    if not retired and cite_matching(fargs, fkwargs) is not None:
+                        # cited once -- nothing else to do for us
+                        retired = True
+                        cite_wrapper.__duecredit_retired__ = True
+                        _retire_wrapper(cite_wrapper)
+                    return func(*fargs, **fkwargs)
+
+            elif counting == "sampled":
+                ncalls = 0
+
+                @wraps(func)
+                def cite_wrapper(*fargs, **fkwargs):
+                    nonlocal ncalls
+                    if not ncalls % every:
+                        citation = cite_matching(fargs, fkwargs)
+                        if citation is not None and ncalls:
+                            # account for the calls we have skipped
+                            citation._increment(every - 1)
+                    ncalls += 1
+                    return func(*fargs, **fkwargs)
+
+            elif conditions:
+
+                @wraps(func)
+                def cite_wrapper(*fargs, **fkwargs):
+                    cite_matching(fargs, fkwargs)
+                    return func(*fargs, **fkwargs)
+
+            else:
+
+                @wraps(func)
+                def cite_wrapper(*fargs, **fkwargs):
+                    citations, citation = cache
+                    if citations is self.citations and citation._shared is None:
+                        # inlined Citation._increment
+                        try:
+                            citation._shards[get_ident()][0] += 1
+                        except KeyError:
+                            citation._increment()
+                    elif citations is self.citations:
+                        # counted in shared memory
+                        citation._increment()
+                    else:
+                        cite_matching(fargs, fkwargs)
+                    return func(*fargs, **fkwargs)
 
             cite_wrapper.__duecredited__ = func
+            cite_wrapper.__duecredit_retired__ = False
+            # where it was injected, so it could be rebound upon retirement
+            cite_wrapper.__duecredit_parent__ = None
             return cite_wrapper
 
         return func_wrapper
@@ -471,9 +972,22 @@ class CollectorSummary:
         collector: DueCreditCollector,
         outputs: str = "stdout,pickle",
         fn: str = DUECREDIT_FILE,
+        shard: bool = False,
     ) -> None:
+        """
+        Parameters
+        ----------
+        shard : bool, optional
+          Either the collector is of a forked process, which then only dumps
+          its citations into a shard next to `fn`, for the parent process
+          to merge them
+        """
         self._due = collector
         self.fn = fn
+        self.shard = shard
+        if shard:
+            self._outputs = [PickleOutput(collector, fn=fn, shard=True)]
+            return
         # for now decide on output "format" right here
         self._outputs = [
             self._get_output_handler(type_.lower().strip(), collector, fn=fn)
@@ -484,18 +998,62 @@ class CollectorSummary:
     @staticmethod
     def _get_output_handler(
         type_: str, collector: DueCreditCollector, fn: str | None = None
-    ) -> TextOutput | PickleOutput:
+    ) -> TextOutput | PickleOutput | SQLiteOutput:
         # just a little factory
         if type_ in ("stdout", "stderr"):
             return TextOutput(getattr(sys, type_), collector)
         elif type_ == "pickle":
             return PickleOutput(collector, fn=fn)
+        elif type_ == "sqlite":
+            from .store import SQLiteOutput
+
+            return SQLiteOutput(collector)
         else:
             raise NotImplementedError()
 
     def dump(self) -> None:
+        self._due._resolve_versions()
+        # shards of forked processes, and journals of crashed ones
+        merged = [] if self.shard else self._merge_shards() + self._merge_journals()
+        # totals of forked processes are accounted for by the parent
+        self._due._release_shared_counters(fold=not self.shard)
         for output in self._outputs:
             output.dump()
+        if not self.shard and self._due._journal is not None:
+            self._due._journal.checkpoint()
+        # all merged into the dumped collector
+        for merged_fn in merged:
+            try:
+                os.unlink(merged_fn)
+            except OSError as e:
+                lgr.debug("Failed to remove %s: %s", merged_fn, e)
+        if merged:
+            try:
+                os.rmdir(os.path.dirname(merged[0]))
+            except OSError:  # e.g. some other process dumped its shard meanwhile
+                pass
+
+    def _merge_shards(self) -> list[str]:
+        """Merge citations dumped by forked processes, return merged shards"""
+        merged = []
+        for shard_fn, due in PickleOutput.load_shards(self.fn):
+            self._due._merge(due, journal=False)
+            merged.append(shard_fn)
+        if merged:
+            lgr.debug("Merged citations from %d forked processes", len(merged))
+        return merged
+
+    def _merge_journals(self) -> list[str]:
+        """Merge journals left by crashed processes, return merged journals"""
+        from .journal import load_journals
+
+        merged = []
+        for journal_fn, due in load_journals(self.fn, claim=True):
+            self._due._merge(due, journal=False)
+            merged.append(journal_fn)
+        if merged:
+            lgr.info("Merged citations journaled by %d crashed processes", len(merged))
+        return merged
 
 
 # TODO:  provide HTML, MD, RST etc output formats
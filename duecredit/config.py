@@ -13,6 +13,44 @@ import os
 # For now just hardcoded variables
 
 CACHE_DIR = os.path.expanduser(os.path.join("~", ".cache", "duecredit", "bibtex"))
+# database with BibTeX cached for DOIs, which supersedes a file per DOI under
+# CACHE_DIR
+DOI_CACHE_FILE = os.getenv("DUECREDIT_DOI_CACHE") or os.path.expanduser(
+    os.path.join("~", ".cache", "duecredit", "bibtex.db")
+)
+# For how long BibTeX cached for a DOI is used before it gets fetched again, for
+# how long a failure to fetch it is remembered (and a failure to reach the
+# resolver at all), and how many DOIs to keep cached at most (0 for no limit).
+# Durations are in seconds, or e.g. 90m, 12h or 30d
+DUECREDIT_DOI_CACHE_TTL = os.getenv("DUECREDIT_DOI_CACHE_TTL") or "90d"
+DUECREDIT_DOI_CACHE_NEGATIVE_TTL = os.getenv("DUECREDIT_DOI_CACHE_NEGATIVE_TTL") or "1d"
+DUECREDIT_DOI_CACHE_OFFLINE_TTL = os.getenv("DUECREDIT_DOI_CACHE_OFFLINE_TTL") or "10m"
+DUECREDIT_DOI_CACHE_SIZE = os.getenv("DUECREDIT_DOI_CACHE_SIZE") or "10000"
+# index of versions of installed distributions
+VERSIONS_CACHE_FILE = os.path.expanduser(
+    os.path.join("~", ".cache", "duecredit", "versions.json")
+)
 DUECREDIT_FILE = os.getenv("DUECREDIT_FILE") or ".duecredit.p"
 # NB: `or` catches empty env var. TODO: Add file name/ext check for the env
 # variable?
+# How dcite'd functions count their citations: "exact" (every call), "first"
+# (only the first call, after which wrappers retire), or "sampled:N" (every
+# N-th call, counted with the weight of N)
+DUECREDIT_COUNTING = os.getenv("DUECREDIT_COUNTING") or "exact"
+# Either to count citations in shared memory, so the counts of the processes
+# forked from the collecting one are available live and survive their crashes
+DUECREDIT_SHARED_COUNTERS = os.getenv("DUECREDIT_SHARED_COUNTERS", "no").lower() in (
+    "1",
+    "yes",
+    "true",
+)
+# Either to journal citations as they are made, so they survive crashes of the
+# process: "no", "yes" (only new citations), or the interval in seconds to also
+# record changed counts at
+DUECREDIT_JOURNAL = os.getenv("DUECREDIT_JOURNAL") or "no"
+# SQLite database to record citations of the runs into, with "sqlite" among
+# DUECREDIT_OUTPUTS
+DUECREDIT_DB = os.getenv("DUECREDIT_DB") or ".duecredit.db"
+# Where to resolve DOIs into BibTeX at, and by how many concurrent queries
+DOI_RESOLVER_URL = os.getenv("DUECREDIT_DOI_RESOLVER") or "https://doi.org/"
+DUECREDIT_DOI_WORKERS = os.getenv("DUECREDIT_DOI_WORKERS") or "8"
@@ -0,0 +1,137 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Citation counters in shared memory, for processes forked from the collecting one
+
+Counts of the citations (identified by their ids assigned by the collector)
+are kept in a table in shared memory.  Every thread of every process claims
+its own row of the table upon its first increment, so increments are plain
+writes into memory nobody else writes to -- no locking or IPC is involved,
+and counts of crashed processes are not lost.  Totals are sums over the rows,
+so they are available live to all the processes.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import threading
+import weakref
+
+from .log import lgr
+
+__all__ = ["SharedCounters"]
+
+# Defaults for the size of the table: 1024 citations by 64 threads/processes,
+# which takes 512KB
+MAX_IDS = 1024
+MAX_ROWS = 64
+
+# all the tables, to forget rows of the forking thread in the forked processes
+_tables: weakref.WeakSet[SharedCounters] = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for table in list(_tables):
+        table._local = threading.local()
+
+
+if hasattr(os, "register_at_fork"):  # not on Windows
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class SharedCounters:
+    """Table of counters in shared memory
+
+    Parameters
+    ----------
+    max_ids : int, optional
+      Number of counters (citation ids) in the table
+    max_rows : int, optional
+      Number of threads (across all the processes) which could increment the
+      counters.  Threads coming after should count on their own.
+    """
+
+    def __init__(self, max_ids: int = MAX_IDS, max_rows: int = MAX_ROWS) -> None:
+        self.max_ids = max_ids
+        self.max_rows = max_rows
+        # 8 bytes per counter, and the number of claimed rows in front
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=8 * (1 + max_rows * max_ids)
+        )
+        self._counts = self._shm.buf.cast("q")
+        # only to claim the rows, shared with the forked processes
+        self._lock = multiprocessing.Lock()
+        self._local = threading.local()
+        self._owner = os.getpid()
+        self._closed = False
+        _tables.add(self)
+        lgr.debug(
+            "Created shared counters %s for %d ids by %d rows",
+            self._shm.name,
+            max_ids,
+            max_rows,
+        )
+
+    def _claim_row(self) -> int | None:
+        with self._lock:
+            row = self._counts[0]
+            if row < self.max_rows:
+                self._counts[0] = row + 1
+        if row >= self.max_rows:
+            lgr.debug("No rows left in shared counters for the thread")
+            offset = None
+        else:
+            offset = 1 + row * self.max_ids
+        self._local.offset = offset
+        return offset
+
+    def increment(self, id_: int, n: int = 1) -> bool:
+        """Increment counter `id_` in the row of the current thread
+
+        Returns
+        -------
+        bool
+          False if it could not be done (no rows left, or the table was
+          closed), so the caller should count on its own
+        """
+        try:
+            offset = self._local.offset
+        except AttributeError:
+            if self._closed:
+                return False
+            offset = self._claim_row()
+        if offset is None:
+            return False
+        try:
+            self._counts[offset + id_] += n
+        except ValueError:  # closed meanwhile
+            return False
+        return True
+
+    def total(self, id_: int) -> int:
+        """Sum of counter `id_` across all the rows"""
+        if self._closed:
+            return 0
+        counts, max_ids = self._counts, self.max_ids
+        return sum(
+            counts[1 + row * max_ids + id_]
+            for row in range(min(counts[0], self.max_rows))
+        )
+
+    def close(self) -> None:
+        """Stop using the table, and remove it if we have created it"""
+        if self._closed:
+            return
+        self._closed = True
+        self._local = threading.local()
+        self._counts.release()
+        self._shm.close()
+        if os.getpid() == self._owner:
+            self._shm.unlink()
@@ -12,12 +12,15 @@ from __future__ import annotations
 
 import atexit
 import os
+import sys
 from typing import TYPE_CHECKING, Any
 
 from .log import lgr
 from .utils import never_fail
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+
     from duecredit.collector import DueCreditCollector
 
     from .stub import InactiveDueCreditCollector
@@ -41,28 +44,12 @@ def _get_inactive_due() -> InactiveDueCreditCollector:
 
 
 @never_fail
-def _get_active_due() -> DueCreditCollector | InactiveDueCreditCollector:
+def _get_active_due() -> DueCreditCollector:
     from duecredit.collector import DueCreditCollector
 
-    from .config import DUECREDIT_FILE
-    from .io import load_due
-
-    # TODO:  this needs to move to atexit handling, that we load previous
-    # one and them merge with new ones.  Informative bits could be -- how
-    # many new citations we got
-    if os.path.exists(DUECREDIT_FILE):
-        try:
-            due_ = load_due(DUECREDIT_FILE)
-        except Exception:
-            lgr.warning(
-                f"Failed to load previously collected {DUECREDIT_FILE}. "
-                "DueCredit will not be active for this session."
-            )
-            return _get_inactive_due()
-    else:
-        due_ = DueCreditCollector()
-
-    return due_
+    # Start afresh: citations of the previous sessions (in DUECREDIT_FILE) are
+    # not needed until exit, when ours get merged into them (see PickleOutput)
+    return DueCreditCollector()
 
 
 class DueSwitch:
@@ -70,12 +57,21 @@ class DueSwitch:
 
     Once activated though, cannot be fully deactivated since it would inject
     duecredit decorators and register an event atexit.
+
+    `active` could also be provided as a callable (e.g. `_get_active_due`)
+    returning the active collector.  It is then called only upon the first
+    activation, so that a mere import of duecredit with DUECREDIT_ENABLE off
+    does not pay for importing the collector, io, versions etc.
     """
 
     def __init__(self, inactive, active, activate: bool = False) -> None:
         self.__active: bool | None = None
         self.__collectors = {False: inactive, True: active}
         self.__activations_done = False
+        # either we are in a process forked after activation
+        self.__forked = False
+        # where to send citations if we are in a worker, see _activate_worker
+        self.__send: Callable[[DueCreditCollector], None] | None = None
         if not (inactive and active):
             raise ValueError(
                 "Both inactive and active collectors should be provided. "
@@ -87,6 +83,19 @@ class DueSwitch:
     def active(self):
         return self.__active
 
+    def __get_active_collector(self):
+        active = self.__collectors[True]
+        if callable(active) and not hasattr(active, "cite"):
+            # a factory was provided -- create the collector only now
+            active = active()
+            if not active:
+                raise ValueError(
+                    "Failed to create active collector. "
+                    "DueCredit will not be active for this session."
+                )
+            self.__collectors[True] = active
+        return active
+
     @never_fail
     def dump(self, **kwargs: Any) -> None:
         """Dumps summary of the citations
@@ -98,14 +107,89 @@ class DueSwitch:
         """
         from duecredit.collector import CollectorSummary
 
-        due_summary = CollectorSummary(self.__collectors[True], **kwargs)
+        if self.__send is not None:
+            collector = self.__get_active_collector()
+            # versions could be known only while the packages are still around
+            collector._resolve_versions()
+            if collector.citations:
+                self.__send(collector._pop_citations())
+            return
+        if self.__forked:
+            # only dump our citations for the parent process to merge them
+            kwargs["shard"] = True
+        due_summary = CollectorSummary(self.__get_active_collector(), **kwargs)
         due_summary.dump()
 
+    def __after_fork_in_child(self) -> None:
+        # Collect only citations made by this process, since those made before
+        # the fork are accounted for by the parent
+        self.__forked = True
+        self.__collectors[True]._after_fork()
+        mp_util = sys.modules.get("multiprocessing.util")
+        if mp_util is not None:
+            # multiprocessing exits its processes without running atexit
+            # handlers, but with finalizers which it registered after the fork
+            mp_util.register_after_fork(self, DueSwitch.__register_mp_finalizer)
+
+    def __register_mp_finalizer(self) -> None:
+        from multiprocessing.util import Finalize
+
+        Finalize(None, self.dump, exitpriority=0)
+
+    def _activate_worker(self, send: Callable[[DueCreditCollector], None]) -> None:
+        """Activate in a worker process, which sends its citations to the parent
+
+        Citations collected by the worker are passed to `send` (as a collector
+        to be merged by the parent) upon the worker exit, instead of being
+        dumped.  See `duecredit.parallel`.
+        """
+        from multiprocessing.util import Finalize
+
+        from .collector import DueCreditCollector
+
+        self.__send = send
+        active = self.__collectors[True]
+        if callable(active) and not hasattr(active, "cite"):
+            # not created yet -- start afresh
+            self.__collectors[True] = DueCreditCollector()
+        else:
+            # e.g. forked from the parent -- those are accounted for by it.
+            # Our citations are sent to the parent, so not counted in shared memory
+            active._after_fork()
+            active._release_shared_counters(fold=False)
+        self.activate()
+        # multiprocessing exits its processes without running atexit handlers
+        Finalize(None, self.dump, exitpriority=10)
+
+    def _merge(self, collector: DueCreditCollector) -> int:
+        """Merge citations collected elsewhere (e.g. by a worker process)"""
+        return self.__get_active_collector()._merge(collector)
+
     def __prepare_exit_and_injections(self) -> None:
         # Wrapper to create and dump summary... passing method doesn't work:
         #  probably removes instance too early
 
         atexit.register(self.dump)
+        from .config import DUECREDIT_FILE, DUECREDIT_JOURNAL, DUECREDIT_SHARED_COUNTERS
+
+        if DUECREDIT_SHARED_COUNTERS:
+            try:
+                self.__collectors[True]._enable_shared_counters()
+            except Exception as e:
+                lgr.warning(f"Failed to set up counters in shared memory: {e}")
+        if self.__send is None:  # workers send their citations instead
+            try:
+                from .journal import _parse_journal
+
+                interval = _parse_journal(DUECREDIT_JOURNAL)
+                if interval is not None:
+                    self.__collectors[True]._start_journal(
+                        DUECREDIT_FILE, interval=interval
+                    )
+            except Exception as e:
+                lgr.warning(f"Failed to set up journal of citations: {e}")
+        if hasattr(os, "register_at_fork"):  # not on Windows
+            os.register_at_fork(after_in_child=self.__after_fork_in_child)
 
         # Deal with injector
         from .injections import DueCreditInjector
@@ -124,11 +208,21 @@ class DueSwitch:
             def is_public_or_special(x):
                 return not (x.startswith("_") or x in ("activate", "active", "dump"))
 
-            # Clean up current bindings first
+            if activate:
+                try:
+                    new_due = self.__get_active_collector()
+                except Exception:
+                    # keep (or get) the inactive bindings, so that due.cite
+                    # etc still do nothing instead of failing
+                    if self.__active is None:
+                        self.activate(False)
+                    raise
+            else:
+                new_due = self.__collectors[False]
+
+            # Clean up current bindings only now, once we know what to bind
             for k in filter(is_public_or_special, dir(self)):
                 delattr(self, k)
-
-            new_due = self.__collectors[activate]
             for k in filter(is_public_or_special, dir(new_due)):
                 setattr(self, k, getattr(new_due, k))
 
@@ -144,4 +238,4 @@ class DueSwitch:
                 self.__activations_done = True
 
 
-due = DueSwitch(_get_inactive_due(), _get_active_due(), _get_duecredit_enable())
+due = DueSwitch(_get_inactive_due(), _get_active_due, _get_duecredit_enable())
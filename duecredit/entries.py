@@ -11,6 +11,7 @@ from __future__ import annotations
 
 import logging
 import re
+from typing import Any
 
 lgr = logging.getLogger("duecredit.entries")
 
@@ -50,6 +51,41 @@ class DueCreditEntry:
         # TODO: return nice formatting of the entry
         return str(self._rawentry)
 
+    @classmethod
+    def lazy(cls, *args: Any, **kwargs: Any) -> _EntryFactory:
+        """Declare an entry to be created only when the collector needs it
+
+        Entries are typically provided to `due.dcite` at import time of the
+        module, while e.g. `BibTeX` needs to parse its entry to figure out the
+        key.  The returned factory is accepted by the collector in place of the
+        entry, so that cost is paid only upon the first citation, and never if
+        duecredit is not active.
+
+        >>> BibTeX.lazy("@article{XXX00, title={...}}")
+        BibTeX.lazy('@article{XXX00, title={...}}')
+        """
+        return _EntryFactory(cls, *args, **kwargs)
+
+
+class _EntryFactory:
+    """Creates (once) an entry of the given class upon the first call"""
+
+    def __init__(self, cls: type[DueCreditEntry], *args: Any, **kwargs: Any) -> None:
+        self._cls = cls
+        self._args = args
+        self._kwargs = kwargs
+        self._entry: DueCreditEntry | None = None
+
+    def __call__(self) -> DueCreditEntry:
+        if self._entry is None:
+            self._entry = self._cls(*self._args, **self._kwargs)
+        return self._entry
+
+    def __repr__(self) -> str:
+        argl = [repr(a) for a in self._args]
+        argl += [f"{k}={v!r}" for k, v in self._kwargs.items()]
+        return f"{self._cls.__name__}.lazy({', '.join(argl)})"
+
 
 class BibTeX(DueCreditEntry):
     def __init__(self, bibtex: str, key: str | None = None) -> None:
@@ -15,16 +15,22 @@ __docformat__ = "restructuredtext"
 import builtins as __builtin__
 from functools import wraps
 from glob import glob
+from importlib.abc import MetaPathFinder
 import logging
 import os
 from os.path import basename, dirname
 from os.path import join as pathjoin
 import sys
+import threading
 from typing import TYPE_CHECKING, Any
 
 from ..log import lgr
+from ..utils import never_fail
 
 if TYPE_CHECKING:
+    from importlib.machinery import ModuleSpec
+    from types import ModuleType
+
     from ..entries import BibTeX, Doi, Url
 
 __all__ = ["DueCreditInjector", "find_object"]
@@ -69,6 +75,98 @@ def find_object(mod: Any, path: str) -> tuple[Any, str, Any]:
 # stay friendly to anyone else who might decorate __import__ as well
 _very_orig_import = __builtin__.__import__
 
+# Engines to hook into the import machinery.  "meta_path" (default) installs a
+# finder into sys.meta_path which only wraps loaders of the modules we have
+# injections for, so imports of any other (or already loaded) module do not
+# go through duecredit at all.  "import" is the original engine which wraps
+# builtins.__import__ and kept as a fallback.
+INJECTOR_ENGINES = ("meta_path", "import")
+
+
+def _get_injector_engine() -> str:
+    engine = os.environ.get("DUECREDIT_INJECTOR", "meta_path").lower()
+    if engine not in INJECTOR_ENGINES:
+        lgr.warning(
+            "Misunderstood value %s for DUECREDIT_INJECTOR. Use one of %s. "
+            "Falling back to 'meta_path'",
+            engine,
+            ", ".join(INJECTOR_ENGINES),
+        )
+        engine = "meta_path"
+    return engine
+
+
+class _ImportState(threading.local):
+    """Per-thread state of the imports handled by the "import" engine"""
+
+    # depth of nested imports within the thread
+    level = 0
+    # either the thread is processing the queue of imported modules
+    processing_queue = False
+
+
+def _is_initializing(mod_name: str) -> bool:
+    """Either the module is still being executed (e.g. by another thread)"""
+    spec = getattr(sys.modules.get(mod_name), "__spec__", None)
+    return bool(getattr(spec, "_initializing", False))
+
+
+class _DueCreditLoader:
+    """Loader proxy which runs injector hooks around the actual module execution
+
+    All the attributes but exec_module are looked up in the original loader.
+    """
+
+    def __init__(self, loader: Any, injector: DueCreditInjector) -> None:
+        self._loader = loader
+        self._injector = injector
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._loader, name)
+
+    def create_module(self, spec: ModuleSpec) -> ModuleType | None:
+        if not hasattr(self._loader, "create_module"):
+            return None
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module: ModuleType) -> None:
+        # Hide our presence -- the module should see its genuine loader
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        name = module.__name__
+        self._injector._pre_exec_module(name)
+        self._loader.exec_module(module)
+        self._injector._post_exec_module(name)
+
+
+class _DueCreditMetaPathFinder(MetaPathFinder):
+    """Finder which wraps loaders only for the modules known to the injector"""
+
+    def __init__(self, injector: DueCreditInjector) -> None:
+        self._injector = injector
+
+    def find_spec(
+        self, fullname: str, path: Any = None, target: ModuleType | None = None
+    ) -> ModuleSpec | None:
+        if not self._injector._needs_processing(fullname):
+            return None
+        # Delegate to the rest of the finders to get the genuine spec
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            lgr.debug("Cannot hook into loader %r of %s", spec.loader, fullname)
+            return spec
+        lgr.log(2, "Wrapping loader of %s", fullname)
+        spec.loader = _DueCreditLoader(spec.loader, self._injector)
+        return spec
+
 
 class DueCreditInjector:
     """Takes care about "injecting" duecredit references into 3rd party modules upon their import
@@ -98,12 +196,21 @@ class DueCreditInjector:
         )
         DueCreditInjector.__orig_import = value
 
-    def __init__(self, collector=None) -> None:
+    def __init__(self, collector=None, engine: str | None = None) -> None:
         if collector is None:
             from duecredit import due
 
             collector = due
+        if engine is None:
+            engine = _get_injector_engine()
+        elif engine not in INJECTOR_ENGINES:
+            raise ValueError(
+                f"Unknown injector engine {engine!r}. "
+                f"Known are: {', '.join(INJECTOR_ENGINES)}"
+            )
         self._collector = collector
+        self._engine = engine
+        self._finder: _DueCreditMetaPathFinder | None = None
         self._delayed_injections: dict[str, str] = {}
         self._entry_records: dict[
             str, dict[str | None, Any]
@@ -111,11 +218,18 @@ class DueCreditInjector:
         self._processed_modules: set[str] = set()
         # We need to process modules only after we are done with all nested imports, otherwise we
         # might be trying to process them too early -- whenever they are not yet linked to their
-        # parent's namespace. So we will keep track of import level and set of modules which
-        # would need to be processed whenever we are back at __import_level == 1
-        self.__import_level = 0
+        # parent's namespace. So we will keep track of import level (per thread, since
+        # threads import concurrently) and set of modules which would need to be processed
+        # whenever we are back at level 0.  The queue (and the sys.modules watermark below)
+        # are shared among threads and modified only while holding the lock
+        self.__state = _ImportState()
+        self.__lock = threading.RLock()
         self.__queue_to_process: set[str] = set()
-        self.__processing_queue = False
+        # Names in sys.modules as of the last check for freshly imported
+        # modules, and the last (most recently added) of them.  sys.modules is
+        # insertion ordered, so new modules are at its tail
+        self.__seen_modules: set[str] = set()
+        self.__last_seen_module: str | None = None
         self._active = False
         lgr.debug("Created injector %r", self)
 
@@ -172,7 +286,7 @@ class DueCreditInjector:
 
     @property
     def _import_level_prefix(self) -> str:
-        return "." * self.__import_level
+        return "." * self.__state.level
 
     def _process_delayed_injection(self, mod_name: str) -> None:
         lgr.debug(
@@ -185,7 +299,7 @@ class DueCreditInjector:
             lgr.log(3, "Importing %s", inj_mod_name_full)
             # Mark it is a processed already, to avoid its processing etc
             self._processed_modules.add(inj_mod_name_full)
-            inj_mod = self._orig_import(
+            inj_mod = (self._orig_import or _very_orig_import)(
                 inj_mod_name_full, fromlist=["duecredit.injections"]
             )
         except Exception as e:
@@ -197,16 +311,25 @@ class DueCreditInjector:
         lgr.log(3, "Calling injector of %s", inj_mod_name_full)
         inj_mod.inject(self)
 
-    def process(self, mod_name: str) -> None:
-        """Process import of the module, possibly decorating some methods with duecredit entries"""
+    def process(self, mod_name: str, delayed: bool = True) -> None:
+        """Process import of the module, possibly decorating some methods with duecredit entries
+
+        Parameters
+        ----------
+        mod_name : str
+          Name of the (already imported) module
+        delayed : bool, optional
+          Either to also process delayed injection for the module.  The
+          meta_path engine does that before the module gets executed
+        """
         assert (
-            self.__import_level == 0
+            self.__state.level == 0
         )  # we should never process while nested within imports
         # We need to mark that module as processed EARLY, so we don't try to re-process it
         # while doing _process_delayed_injection
         self._processed_modules.add(mod_name)
 
-        if mod_name in self._delayed_injections:
+        if delayed and mod_name in self._delayed_injections:
             # should be hit only once, "theoretically" unless I guess reimport is used etc
             self._process_delayed_injection(mod_name)
 
@@ -263,6 +386,8 @@ class DueCreditInjector:
                     lgr.debug("Decorating %s:%s with %s", parent, obj_name, decorator)
                     obj_decorated = decorator(obj)
                     setattr(parent, obj_name, obj_decorated)
+                    if getattr(obj_decorated, "__duecredited__", None) is obj:
+                        obj_decorated.__duecredit_parent__ = (parent, obj_name)
                     # override previous obj with the decorated one if there are multiple decorators
                     obj = obj_decorated
                 else:
@@ -284,6 +409,25 @@ class DueCreditInjector:
         self._orig_import = _very_orig_import
         return _very_orig_import(name, *args, **kwargs)
 
+    def _needs_processing(self, mod_name: str) -> bool:
+        """Either a module about to be imported has any injections for it"""
+        return mod_name not in self._processed_modules and (
+            mod_name in self._delayed_injections or mod_name in self._entry_records
+        )
+
+    @never_fail
+    def _pre_exec_module(self, mod_name: str) -> None:
+        # Delayed injections must be processed before the body of the package
+        # gets executed, so records for its submodules, which might be imported
+        # from within, are known by the time they are looked up
+        if mod_name in self._delayed_injections:
+            self._processed_modules.add(mod_name)
+            self._process_delayed_injection(mod_name)
+
+    @never_fail
+    def _post_exec_module(self, mod_name: str) -> None:
+        self.process(mod_name, delayed=False)
+
     def activate(self, retrospect=True):
         """
         Parameters
@@ -291,7 +435,38 @@ class DueCreditInjector:
         retrospect : bool, optional
           Either consider already loaded modules
         """
+        if self._engine == "meta_path":
+            self._activate_meta_path(retrospect=retrospect)
+        else:
+            self._activate_import(retrospect=retrospect)
 
+    def _activate_meta_path(self, retrospect: bool = True) -> None:
+        if self._finder is not None:
+            lgr.warning(
+                "Seems that we are activating injector twice."
+                " No harm is done but shouldn't happen"
+            )
+            return
+
+        self._populate_delayed_injections()
+        # snapshot since processing might import our injection modules
+        loaded_modules = sorted(sys.modules, key=lambda m: (m.count("."), m))
+        if retrospect:
+            lgr.debug("Considering previously loaded %d modules", len(loaded_modules))
+            for mod_name in loaded_modules:
+                if mod_name not in self._processed_modules:
+                    self.process(mod_name)
+        else:
+            # we were asked to not consider those modules which were already loaded
+            # so let's assume that they were all processed already
+            self._processed_modules.update(loaded_modules)
+
+        lgr.debug("Inserting our finder into sys.meta_path")
+        self._finder = _DueCreditMetaPathFinder(self)
+        sys.meta_path.insert(0, self._finder)
+        self._active = True
+
+    def _activate_import(self, retrospect: bool = True) -> None:
         if not self._orig_import:
             # for paranoid Yarik so we have assurance we are not somehow
             # overriding our decorator
@@ -302,8 +477,9 @@ class DueCreditInjector:
 
             @wraps(__builtin__.__import__)
             def __import(name, *args, **kwargs):
+                state = self.__state
                 if (
-                    self.__processing_queue
+                    state.processing_queue
                     or name in self._processed_modules
                     or name in self.__queue_to_process
                 ):
@@ -333,7 +509,7 @@ class DueCreditInjector:
 
                 mod = None
                 try:
-                    self.__import_level += 1
+                    state.level += 1
                     # TODO: safe-guard all our logic so
                     # if anything goes wrong post-import -- we still return imported module
                     if self._orig_import:
@@ -343,9 +519,9 @@ class DueCreditInjector:
 
                     self._handle_fresh_imports(name, import_level_prefix, level)
                 finally:
-                    self.__import_level -= 1
+                    state.level -= 1
 
-                if self.__import_level == 0 and self.__queue_to_process:
+                if state.level == 0 and self.__queue_to_process:
                     self._process_queue()
 
                 lgr.log(1, "%sReturning %s", import_level_prefix, mod)
@@ -373,9 +549,15 @@ class DueCreditInjector:
 
     def _handle_fresh_imports(self, name: str, import_level_prefix: str, level) -> None:
         """Check which modules were imported since last point we checked and add them to the queue"""
-        new_imported_modules = (
-            set(sys.modules.keys()) - self._processed_modules - self.__queue_to_process
-        )
+        with self.__lock:
+            self.__queue_fresh_imports(name, import_level_prefix, level)
+
+    def __queue_fresh_imports(self, name: str, import_level_prefix: str, level) -> None:
+        new_imported_modules = [
+            m
+            for m in self._get_fresh_imports()
+            if m not in self._processed_modules and m not in self.__queue_to_process
+        ]
         if new_imported_modules:
             lgr.log(
                 4,
@@ -411,27 +593,98 @@ class DueCreditInjector:
                 self.__queue_to_process.add(package)
             self.__queue_to_process.add(imported_mod)
 
+    def _get_fresh_imports(self) -> list[str]:
+        """Return names of modules added to sys.modules since the last call
+
+        Only the tail of sys.modules past the last seen module is considered,
+        so the cost is proportional to the number of freshly imported modules,
+        not to the total number of loaded ones.  Modules seen already are
+        skipped there, since importlib moves a module to the tail once it is
+        done importing it.  If the tail cannot be trusted (e.g. modules were
+        removed from sys.modules), all the modules are diffed against those
+        seen.
+        """
+        modules = sys.modules
+        seen = self.__seen_modules
+        last_seen = self.__last_seen_module
+        fresh: list[str] | None = None
+        if last_seen is not None:
+            fresh = []
+            try:
+                for mod_name in reversed(modules):
+                    if mod_name == last_seen:
+                        break
+                    if mod_name not in seen:
+                        fresh.append(mod_name)
+            except RuntimeError:  # changed by another thread meanwhile
+                fresh = None
+            if fresh is not None and len(seen) + len(fresh) != len(modules):
+                lgr.log(2, "sys.modules changed past its tail, diffing all modules")
+                fresh = None
+        if fresh is None:
+            fresh = [mod_name for mod_name in list(modules) if mod_name not in seen]
+            seen.intersection_update(modules)
+        seen.update(fresh)
+        self.__last_seen_module = next(reversed(modules)) if modules else None
+        return fresh
+
     def _process_queue(self) -> None:
-        """Process the queue of collected imported modules"""
-        # process the queue
-        lgr.debug(
-            "Processing queue of imported %d modules", len(self.__queue_to_process)
-        )
-        # We need first to process top-level modules etc, so delayed injections get picked up,
-        # let's sort by the level
-        queue_with_levels = sorted((m.count("."), m) for m in self.__queue_to_process)
-        self.__processing_queue = True
+        """Process the queue of collected imported modules
+
+        Modules which are still being imported by other threads (and those
+        within them) are left in the queue, to be processed by whichever
+        thread gets back to level 0 after they are done.
+        """
+        with self.__lock:
+            # process the queue
+            lgr.debug(
+                "Processing queue of imported %d modules", len(self.__queue_to_process)
+            )
+            # We need first to process top-level modules etc, so delayed injections get
+            # picked up, let's sort by the level
+            queue_with_levels = sorted(
+                (m.count("."), m) for m in self.__queue_to_process
+            )
+            sorted_queue: list[str] = []
+            deferred: set[str] = set()
+            for _, mod_name in queue_with_levels:
+                parent = mod_name.rpartition(".")[0]
+                if parent in deferred or _is_initializing(mod_name):
+                    deferred.add(mod_name)
+                else:
+                    sorted_queue.append(mod_name)
+            # claim them, so no other thread processes them as well
+            self.__queue_to_process.difference_update(sorted_queue)
+        if deferred:
+            lgr.log(3, "Deferring processing of %d modules", len(deferred))
+        # processing might import (injection) modules, so must not hold the lock
+        # while waiting on import locks possibly held by other threads importing
+        self.__state.processing_queue = True
         try:
-            sorted_queue = [x[1] for x in queue_with_levels]
-            while sorted_queue:
-                mod_name = sorted_queue.pop(0)
+            for mod_name in sorted_queue:
                 self.process(mod_name)
-                self.__queue_to_process.remove(mod_name)
-            assert not len(self.__queue_to_process)
         finally:
-            self.__processing_queue = False
+            self.__state.processing_queue = False
 
     def deactivate(self) -> None:
+        if self._engine == "meta_path":
+            self._deactivate_meta_path()
+        else:
+            self._deactivate_import()
+
+    def _deactivate_meta_path(self) -> None:
+        if self._finder is None:
+            lgr.warning("Our finder was not installed yet. Nothing TODO")
+            return
+        lgr.debug("Removing our finder from sys.meta_path")
+        try:
+            sys.meta_path.remove(self._finder)
+        except ValueError:
+            lgr.warning("Our finder was already removed from sys.meta_path")
+        self._finder = None
+        self._active = False
+
+    def _deactivate_import(self) -> None:
         if not self._orig_import:
             lgr.warning(
                 "_orig_import is not yet known, so we haven't decorated default importer yet."
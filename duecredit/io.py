@@ -15,73 +15,425 @@ if "DUECREDIT_TEST_EARLY_IMPORT_ERROR" in os.environ:
     raise ImportError("DUECREDIT_TEST_EARLY_IMPORT_ERROR")
 
 from collections import defaultdict
+from contextlib import contextmanager
+import io
+import json
 import locale
 from os.path import dirname, exists
 import pickle
 import re
+import sys
 import tempfile
+import threading
 import time
 from typing import TYPE_CHECKING, Any
 import warnings
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
 from packaging.version import Version
 
-from .config import CACHE_DIR, DUECREDIT_FILE
+from .config import (
+    CACHE_DIR,
+    DOI_CACHE_FILE,
+    DOI_RESOLVER_URL,
+    DUECREDIT_DOI_WORKERS,
+    DUECREDIT_FILE,
+)
 from .entries import BibTeX, Doi, DueCreditEntry, Text, Url
 from .log import lgr
 from .versions import external_versions
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    from .cache import Cached, DoiCache
     from .collector import Citation
 
 _PREFERRED_ENCODING = locale.getpreferredencoding()
 
 
 def get_doi_cache_file(doi: str) -> str:
-    # where to cache bibtex entries
+    # where bibtex entries were cached before DOI_CACHE_FILE, see DoiCache
     if not os.path.exists(CACHE_DIR):
         os.makedirs(CACHE_DIR)
     return os.path.join(CACHE_DIR, doi)
 
 
-def import_doi(doi: str, sleep: float = 0.5, retries: int = 10) -> str:
+# (cache or None if it failed to open, its filename, pid which opened it)
+_doi_cache: tuple[DoiCache | None, str, int] | None = None
+_doi_cache_lock = threading.Lock()
+
+
+def _get_doi_cache() -> DoiCache | None:
+    """DoiCache of DOI_CACHE_FILE, opened once per process
+
+    None if it could not be opened (e.g. on a read-only file system), so
+    BibTeX is then just not cached.
+    """
+    global _doi_cache
+    with _doi_cache_lock:
+        if (
+            _doi_cache is None
+            or _doi_cache[1] != DOI_CACHE_FILE
+            or _doi_cache[2] != os.getpid()
+        ):
+            from .cache import DoiCache
+
+            if _doi_cache and _doi_cache[0] and _doi_cache[2] == os.getpid():
+                _doi_cache[0].close()
+            try:
+                cache = DoiCache(DOI_CACHE_FILE, legacy_dir=CACHE_DIR)
+            except Exception as e:
+                lgr.warning(f"Failed to open cache of BibTeX {DOI_CACHE_FILE}: {e}")
+                cache = None
+            # connection of the parent process is not to be used after a fork
+            _doi_cache = (cache, DOI_CACHE_FILE, os.getpid())
+        return _doi_cache[0]
+
+
+def _lookup_cached(dois: Iterable[str]) -> dict[str, Cached]:
+    cache = _get_doi_cache()
+    if cache is not None:
+        import sqlite3
+
+        try:
+            return cache.lookup(dois)
+        except sqlite3.Error as e:
+            lgr.warning(f"Failed to read cached BibTeX from {cache.filename}: {e}")
+    return {}
+
+
+def _cache_bibtexs(
+    bibtexs: dict[str, str], errors: dict[str, str], offline: dict[str, str]
+) -> None:
+    cache = _get_doi_cache()
+    if cache is not None:
+        import sqlite3
+
+        try:
+            cache.set_many(bibtexs)
+            cache.set_failed(errors)
+            cache.set_failed(offline, offline=True)
+        except sqlite3.Error as e:
+            lgr.warning(f"Failed to cache BibTeX in {cache.filename}: {e}")
+
+
+class _FetchError(ValueError):
+    """Failed to fetch BibTeX for a DOI
+
+    `answered` is if the resolver did answer (e.g. with 404 for a wrong DOI),
+    so the failure is worth caching for long, unlike a failure of the network.
+    """
+
+    def __init__(self, msg: str, answered: bool) -> None:
+        super().__init__(msg)
+        self.answered = answered
+
+
+# Responses to retry the query upon, besides those which are not BibTeX while
+# they should be
+_RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# Longest to wait before retrying, and longest to wait in total for all the
+# retries of the queries made at once, in seconds
+MAX_RETRY_WAIT = 120
+MAX_TOTAL_RETRY_WAIT = 120
+
+
+class _RetryBudget:
+    """Time left to wait for retries, shared by the queries made at once
+
+    Also remembers why the resolver could not be reached, if it could not,
+    so the queries yet to be made fail right away instead of waiting for
+    the network each.
+    """
+
+    def __init__(self, seconds: float | None = None) -> None:
+        self.remaining = MAX_TOTAL_RETRY_WAIT if seconds is None else seconds
+        self.unreachable: str | None = None
+        self._lock = threading.Lock()
+
+    def take(self, seconds: float) -> bool:
+        """Whether it is still fine to wait for `seconds`, which are taken then"""
+        with self._lock:
+            if seconds > self.remaining:
+                return False
+            self.remaining -= seconds
+            return True
+
+
+def _get_doi_workers() -> int:
+    try:
+        workers = int(DUECREDIT_DOI_WORKERS)
+        if workers < 1:
+            raise ValueError
+    except ValueError:
+        lgr.warning(
+            f"Misunderstood value {DUECREDIT_DOI_WORKERS!r} for "
+            "DUECREDIT_DOI_WORKERS. Using 8"
+        )
+        workers = 8
+    return workers
+
+
+def _get_doi_session(pool_size: int = 1) -> Any:
+    """requests.Session keeping up to `pool_size` connections to the resolver"""
     import requests
+    from requests.adapters import HTTPAdapter
 
-    cached = get_doi_cache_file(doi)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept"] = "application/x-bibtex; charset=utf-8"
+    return session
 
-    if exists(cached):
-        with open(cached) as f:
-            doi = f.read()
-            return doi
 
-    # else -- fetch it
-    headers = {"Accept": "application/x-bibtex; charset=utf-8"}
-    url = "https://doi.org/" + doi
-    while retries > 0:
-        lgr.debug("Submitting GET to %s with headers %s", url, headers)
-        r = requests.get(url, headers=headers)
+def _get_retry_after(response: Any) -> float | None:
+    """Seconds to wait as requested by the Retry-After header, if any"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _fetch_doi(
+    session: Any,
+    doi: str,
+    sleep: float = 0.5,
+    retries: int = 10,
+    budget: _RetryBudget | None = None,
+) -> str:
+    """Fetch BibTeX for the DOI from the resolver, retrying with a backoff
+
+    Waits start from `sleep` seconds and double with every retry, unless the
+    server asks (with Retry-After) to wait for some other time.  Up to
+    `retries` queries are made, but only if the server answered with a
+    failure which could be transient, and only while waits fit into the
+    `budget` shared with the other queries.  If the resolver could not be
+    reached at all, it fails right away.
+    """
+    import requests
+
+    if budget is None:
+        budget = _RetryBudget()
+    url = DOI_RESOLVER_URL + doi
+    wait = sleep
+    for attempt in range(1, retries + 1):
+        if budget.unreachable is not None:
+            raise _FetchError(
+                f"Query {url} for BibTeX for a DOI {doi} was not made, since "
+                f"{DOI_RESOLVER_URL} could not be reached. {budget.unreachable}",
+                answered=False,
+            )
+        lgr.debug("Submitting GET to %s", url)
+        try:
+            r = session.get(url, timeout=(5, 30))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # e.g. offline -- retrying would only make it wait longer
+            budget.unreachable = str(e)
+            raise _FetchError(
+                f"Query {url} for BibTeX for a DOI {doi} has failed. {e}. ",
+                answered=False,
+            ) from e
         r.encoding = "UTF-8"
         bibtex = r.text.strip()
         if bibtex.startswith("@"):
-            # no more retries necessary
+            return bibtex
+        status = f"Response code {r.status_code}"
+        if r.status_code >= 400 and r.status_code not in _RETRY_STATUSES:
+            break  # e.g. 404 for a wrong DOI -- no point to retry
+        if attempt == retries:
             break
-        lgr.warning("Failed to obtain bibtex from doi.org, retrying...")
-        time.sleep(sleep)  # give some time to the server
-        retries -= 1
-    status_code = r.status_code
-    if not bibtex.startswith("@"):
-        raise ValueError(
-            "Query %(url)s for BibTeX for a DOI %(doi)s (wrong doi?) has failed. "
-            "Response code %(status_code)d. " % locals()
-            # 'BibTeX response was: %(bibtex)s'
+        retry_after = _get_retry_after(r)
+        delay = min(wait if retry_after is None else retry_after, MAX_RETRY_WAIT)
+        if not budget.take(delay):
+            status += f", and it is too long to wait {delay:.1f} sec to retry"
+            break
+        lgr.warning(
+            "Failed to obtain BibTeX for %s from %s (%s), retrying in %.1f sec...",
+            doi,
+            DOI_RESOLVER_URL,
+            status,
+            delay,
         )
-    if not exists(cached):
-        cache_dir = dirname(cached)
-        if not exists(cache_dir):
-            os.makedirs(cache_dir)
-        with open(cached, "w") as f:
-            f.write(bibtex)
-    return bibtex
+        time.sleep(delay)  # give some time to the server
+        wait *= 2
+    raise _FetchError(
+        f"Query {url} for BibTeX for a DOI {doi} (wrong doi?) has failed. {status}. ",
+        answered=True,
+    )
+
+
+def import_doi(doi: str, sleep: float = 0.5, retries: int = 10) -> str:
+    bibtexs, errors = _import_dois([doi], 1, sleep, retries)
+    if doi in errors:
+        raise ValueError(errors[doi])
+    return bibtexs[doi]
+
+
+def import_dois(
+    dois: Iterable[str],
+    max_workers: int | None = None,
+    sleep: float = 0.5,
+    retries: int = 10,
+) -> dict[str, str]:
+    """Import BibTeX for many DOIs, fetching those not cached concurrently
+
+    Queries share connections to the resolver, and are retried as by
+    `import_doi`.
+
+    Parameters
+    ----------
+    dois : iterable of str
+    max_workers : int, optional
+      Maximal number of concurrent queries.  Default is taken from
+      DUECREDIT_DOI_WORKERS environment variable, or 8
+
+    Returns
+    -------
+    dict
+      BibTeX per DOI, for the DOIs it was imported for.  Failures are
+      logged as warnings
+    """
+    bibtexs, errors = _import_dois(dois, max_workers, sleep, retries)
+    for doi, error in errors.items():
+        lgr.warning(f"Failed to import BibTeX for DOI {doi}: {error}")
+    return bibtexs
+
+
+def _import_dois(
+    dois: Iterable[str], max_workers: int | None, sleep: float, retries: int
+) -> tuple[dict[str, str], dict[str, str]]:
+    """BibTeX per DOI, and why it could not be imported for the others
+
+    BibTeX is taken from the snapshot (see duecredit.snapshot), if there is
+    one, first, and otherwise fetched for the DOIs which are not cached, or
+    for which it is not fresh any longer.  Failures to fetch it are cached as
+    well (shortly, if the resolver could not be reached), and if BibTeX was
+    fetched before, it is still used then.
+    """
+    from .snapshot import get_snapshot
+
+    dois = list(dict.fromkeys(dois))
+    snapshot = get_snapshot()
+    bibtexs = {doi: snapshot[doi] for doi in dois if doi in snapshot}
+    found = _lookup_cached([doi for doi in dois if doi not in bibtexs])
+    errors = {}
+    missing = []
+    for doi in dois:
+        if doi in bibtexs:
+            continue
+        entry = found.get(doi)
+        if entry is None or not entry.fresh:
+            missing.append(doi)
+        elif entry.bibtex is not None:
+            bibtexs[doi] = entry.bibtex
+        else:
+            errors[doi] = f"{entry.error} (cached, see 'duecredit cache')"
+    if missing:
+        fetched, failures = _fetch_dois(missing, max_workers, sleep, retries)
+        for doi, e in failures.items():
+            entry = found.get(doi)
+            if entry is not None and entry.bibtex is not None:
+                lgr.warning(
+                    f"Failed to revalidate BibTeX for DOI {doi}, so using "
+                    f"the one fetched before: {e}"
+                )
+                bibtexs[doi] = entry.bibtex
+            else:
+                errors[doi] = str(e)
+        # all at once, in a single transaction
+        _cache_bibtexs(fetched, _get_answered(failures), _get_unreachable(failures))
+        bibtexs.update(fetched)
+    return {doi: bibtexs[doi] for doi in dois if doi in bibtexs}, errors
+
+
+def _can_start_threads() -> bool:
+    """Whether a pool of threads could be used, i.e. it is not at exit yet"""
+    if sys.is_finalizing() or getattr(threading, "_SHUTTING_DOWN", False):
+        return False
+    try:
+        import concurrent.futures.thread
+    except RuntimeError:  # can't register atexit after shutdown
+        return False
+    return not getattr(concurrent.futures.thread, "_shutdown", False)
+
+
+def _fetch_dois(
+    dois: list[str], max_workers: int | None, sleep: float, retries: int
+) -> tuple[dict[str, str], dict[str, Exception]]:
+    """Fetch BibTeX for the DOIs concurrently, sharing connections
+
+    Returns
+    -------
+    dict, dict
+      BibTeX fetched per DOI, and failures to fetch it per DOI
+    """
+    fetched = {}
+    failures = {}
+    budget = _RetryBudget()
+    workers = min(max_workers or _get_doi_workers(), len(dois))
+    if workers > 1 and not _can_start_threads():
+        # e.g. when dumping citations at exit
+        workers = 1
+    lgr.debug("Fetching BibTeX for %d DOIs by %d workers", len(dois), workers)
+    if workers <= 1:
+        with _get_doi_session() as session:
+            for doi in dois:
+                try:
+                    fetched[doi] = _fetch_doi(session, doi, sleep, retries, budget)
+                except Exception as e:
+                    failures[doi] = e
+        return fetched, failures
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    with _get_doi_session(workers) as session, ThreadPoolExecutor(
+        workers, thread_name_prefix="duecredit-doi"
+    ) as executor:
+        futures = {
+            executor.submit(_fetch_doi, session, doi, sleep, retries, budget): doi
+            for doi in dois
+        }
+        for future in as_completed(futures):
+            doi = futures[future]
+            try:
+                fetched[doi] = future.result()
+            except Exception as e:
+                failures[doi] = e
+    return fetched, failures
+
+
+def _get_answered(failures: dict[str, Exception]) -> dict[str, str]:
+    """Failures which the resolver did answer with, worth caching"""
+    return {
+        doi: str(e).strip()
+        for doi, e in failures.items()
+        if getattr(e, "answered", False)
+    }
+
+
+def _get_unreachable(failures: dict[str, Exception]) -> dict[str, str]:
+    """Failures to reach the resolver, worth caching only shortly"""
+    return {
+        doi: str(e).strip()
+        for doi, e in failures.items()
+        if isinstance(e, _FetchError) and not e.answered
+    }
 
 
 def _is_contained(toppath: str, subpath: str) -> bool:
@@ -166,6 +518,12 @@ class Output:
     def dump(self, tags=None) -> None:
         raise NotImplementedError
 
+    @staticmethod
+    def _prefetch_dois(entries: Iterable[DueCreditEntry]) -> dict[str, str]:
+        """Import BibTeX for all the DOIs among entries at once (see import_dois)"""
+        dois = [entry.doi for entry in entries if isinstance(entry, Doi)]
+        return import_dois(dois) if dois else {}
+
 
 class TextOutput(Output):
     def __init__(self, fd, collector, style=None) -> None:
@@ -188,6 +546,9 @@ class TextOutput(Output):
         )
 
     def dump(self, tags=None) -> None:
+        # might have been dumped before versions were known.  Do not import
+        # anything though, since we might be just reporting on loaded citations
+        self.collector._resolve_versions(metadata_only=True)
         # get 'model' of citations
         packages, modules, objects = self._get_collated_citations(tags)
         # put everything into a single dict
@@ -233,13 +594,24 @@ class TextOutput(Output):
         printed_keys = []
         if len(pmo) > 0:
             self.fd.write("\n\nReferences\n" + "-" * 10 + "\n")
+            bibtexs = self._prefetch_dois(c.entry for p in paths for c in pmo[p])
             for path in paths:
                 for cit in pmo[path]:
                     # 'import Citation / assert type(cit) is Citation' would pollute environment
                     ek = cit.entry.key
                     if ek not in printed_keys:
                         self.fd.write(f"\n[{citation_nr[ek]}] ")
-                        self.fd.write(get_text_rendering(cit.entry, style=self.style))
+                        if isinstance(cit.entry, Doi) and cit.entry.doi not in bibtexs:
+                            # failed to import, as was warned about
+                            self.fd.write(f"DOI: {cit.entry.doi}")
+                        elif isinstance(cit.entry, Doi):
+                            # imported already, so not looked up again
+                            bibtex = BibTeX(bibtexs[cit.entry.doi])
+                            self.fd.write(format_bibtex(bibtex, style=self.style))
+                        else:
+                            self.fd.write(
+                                get_text_rendering(cit.entry, style=self.style)
+                            )
                         printed_keys.append(ek)
             self.fd.write("\n")
 
@@ -259,6 +631,7 @@ def get_text_rendering(entry: DueCreditEntry, style: str = "harvard1") -> str:
 
 def get_bibtex_rendering(entry: DueCreditEntry) -> BibTeX:
     if isinstance(entry, Doi):
+        # from the snapshot, or the cache, or the network
         return BibTeX(import_doi(entry.doi))
     elif isinstance(entry, BibTeX):
         return entry
@@ -392,20 +765,256 @@ def format_bibtex(
     return biblio_out  # if biblio_out else str(bibtex_entry)
 
 
+@contextmanager
+def _locked(filename: str) -> Iterator[None]:
+    """Hold an exclusive lock for `filename`, across the processes
+
+    The lock is taken on a separate `<filename>.lock`, since `filename` itself
+    gets replaced.  It is only advisory, i.e. honored only by those who take it.
+    """
+    with open(filename + ".lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            import msvcrt
+
+            # locks a byte at the position, and retries for 10 seconds
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
 # TODO: harmonize order of arguments
+def _get_shards_dir(filename: str) -> str:
+    """Directory for shards of `filename` dumped by forked processes"""
+    return filename + ".d"
+
+
+# Version of the format of the files citations are stored into (see
+# dump_citations), to be incremented whenever it changes incompatibly
+CITATIONS_FORMAT = "duecredit-citations"
+CITATIONS_FORMAT_VERSION = 1
+
+_ENTRY_TYPES = {cls.__name__: cls for cls in (BibTeX, Doi, Text, Url)}
+_ENTRY_FIELDS = ["type", "key", "rawentry"]
+_CITATION_FIELDS = [
+    "path",
+    "entry",
+    "description",
+    "cite_module",
+    "tags",
+    "version",
+    "count",
+]
+
+
+def _entry_row(entry: DueCreditEntry) -> list[Any]:
+    return [entry.__class__.__name__, entry.key, entry.rawentry]
+
+
+def _encode_version(version: Any) -> str | tuple[str, str] | None:
+    """Version as stored, e.g. if it is a packaging Version"""
+    if version is not None and not isinstance(version, tuple):
+        version = str(version)
+    return version
+
+
+def _citation_row(citation: Citation, count: int | None = None) -> list[Any]:
+    return [
+        citation.path,
+        citation.entry.key,
+        citation.description,
+        citation.cite_module,
+        citation.tags,
+        _encode_version(citation.version),
+        citation.count if count is None else count,
+    ]
+
+
+def _entry_from_row(row: list[Any], fields: dict[str, int]) -> DueCreditEntry:
+    key = row[fields["key"]]
+    return _ENTRY_TYPES[row[fields["type"]]](row[fields["rawentry"]], key=key)
+
+
+def _citation_from_row(
+    row: list[Any], fields: dict[str, int], entries: dict[str, DueCreditEntry]
+) -> Citation:
+    from .collector import Citation
+
+    version = row[fields["version"]]
+    citation = Citation(
+        entries[row[fields["entry"]]],
+        description=row[fields["description"]],
+        path=row[fields["path"]],
+        version=tuple(version) if isinstance(version, list) else version,
+        cite_module=row[fields["cite_module"]],
+        tags=row[fields["tags"]],
+    )
+    citation.count = row[fields["count"]]
+    return citation
+
+
+def dump_citations(collector, f) -> None:
+    """Store citations of the collector into a text stream
+
+    The format is a single JSON object, with the format and its version, and
+    the cited entries and the citations (with their counts) as rows of the
+    fields listed along.  Entries which were not cited are not stored::
+
+        {"format": "duecredit-citations", "version": 1,
+         "entry_fields": ["type", "key", "rawentry"],
+         "citation_fields": ["path", "entry", ..., "count"],
+         "entries": [["Doi", "10.1/x", "10.1/x"], ...],
+         "citations": [["module:func", "10.1/x", ..., 3], ...]}
+    """
+    citations = list(collector.citations.values())
+    entries = {c.entry.key: c.entry for c in citations}
+    json.dump(
+        {
+            "format": CITATIONS_FORMAT,
+            "version": CITATIONS_FORMAT_VERSION,
+            "entry_fields": _ENTRY_FIELDS,
+            "citation_fields": _CITATION_FIELDS,
+            "entries": [_entry_row(entry) for entry in entries.values()],
+            "citations": [_citation_row(c) for c in citations],
+        },
+        f,
+        separators=(",", ":"),
+    )
+
+
+def load_citations(f) -> Any:
+    """Load a collector with citations stored by `dump_citations`"""
+    from .collector import DueCreditCollector
+
+    data = json.load(f)
+    if not isinstance(data, dict) or data.get("format") != CITATIONS_FORMAT:
+        raise ValueError("Not a file with duecredit citations")
+    if data.get("version") != CITATIONS_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported version {data.get('version')!r} of the format. "
+            f"Supported is {CITATIONS_FORMAT_VERSION}. Upgrade duecredit?"
+        )
+    # fields are looked up by their names, so could get added compatibly
+    ef = {name: i for i, name in enumerate(data["entry_fields"])}
+    cf = {name: i for i, name in enumerate(data["citation_fields"])}
+    entries: dict[str, DueCreditEntry] = {}
+    for row in data["entries"]:
+        entry = _entry_from_row(row, ef)
+        entries[entry.key] = entry
+    citations = {}
+    for row in data["citations"]:
+        citation = _citation_from_row(row, cf, entries)
+        citations[citation.key] = citation
+    return DueCreditCollector(entries=entries, citations=citations)
+
+
 class PickleOutput:
-    def __init__(self, collector, fn=DUECREDIT_FILE) -> None:
+    """Stores citations of the collector into a file (see `dump_citations`)
+
+    The name is historical: whole collectors were pickled before, and such
+    files could still be loaded.
+
+    Citations are merged into those already stored in the file (with counts
+    added up), under a lock and replacing the file atomically, so concurrent
+    sessions do not overwrite each other.  Only the citations made since the
+    collector was stored last get merged, so it could be dumped repeatedly.
+
+    With `shard=True` it is dumped instead into `<fn>.d/<pid>.p`, so
+    that forked processes do not overwrite the file of their parent (and
+    each other), which merges those shards later on.
+    """
+
+    def __init__(self, collector, fn=DUECREDIT_FILE, shard: bool = False) -> None:
         self.collector = collector
         self.fn = fn
+        self.shard = shard
 
     def dump(self) -> None:
-        with open(self.fn, "wb") as f:
-            pickle.dump(self.collector, f)
+        # versions could be known only while the packages are still around
+        self.collector._resolve_versions()
+        if not self.shard:
+            self._merge_into_file()
+            return
+        shards_dir = _get_shards_dir(self.fn)
+        os.makedirs(shards_dir, exist_ok=True)
+        # write under a temporary name, so it is never read incomplete
+        fd, tmp_fn = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=shards_dir)
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                dump_citations(self.collector, f)
+            os.replace(tmp_fn, os.path.join(shards_dir, f"{os.getpid()}.p"))
+        except BaseException:
+            os.unlink(tmp_fn)
+            raise
+
+    def _merge_into_file(self) -> None:
+        from .collector import DueCreditCollector
+
+        fn = self.fn
+        unstored = self.collector._get_unstored(fn)
+        with _locked(fn):
+            # if it could not be loaded, we better fail than overwrite it
+            stored = self.load(fn) if exists(fn) else DueCreditCollector()
+            n_new = stored._merge(unstored)
+            # same directory, so it could be renamed over atomically
+            tmp_fn = os.path.join(
+                dirname(fn), f".{os.path.basename(fn)}.{os.getpid()}.tmp"
+            )
+            f = open(tmp_fn, "w", encoding="utf-8")
+            try:
+                with f:
+                    dump_citations(stored, f)
+                os.replace(tmp_fn, fn)
+            except BaseException:
+                os.unlink(tmp_fn)
+                raise
+        self.collector._mark_stored(fn, unstored)
+        lgr.info(
+            "Stored %d new citations into %s, which has %d now",
+            n_new,
+            fn,
+            len(stored.citations),
+        )
 
     @classmethod
     def load(cls, filename: str = DUECREDIT_FILE) -> Any:
         with open(filename, "rb") as f:
-            return pickle.load(f)
+            if f.peek(1)[:1] != b"{":
+                # pickled collector, as stored by older versions of duecredit
+                return pickle.load(f)
+            return load_citations(io.TextIOWrapper(f, encoding="utf-8"))
+
+    @classmethod
+    def load_shards(cls, filename: str = DUECREDIT_FILE) -> list[tuple[str, Any]]:
+        """Load collectors dumped as shards of `filename` by forked processes
+
+        Returns
+        -------
+        list of (shard filename, collector)
+        """
+        shards_dir = _get_shards_dir(filename)
+        try:
+            shard_fns = sorted(os.listdir(shards_dir))
+        except OSError:
+            return []
+        shards = []
+        for shard_fn in shard_fns:
+            if not shard_fn.endswith(".p") or shard_fn.startswith("."):
+                continue
+            shard_fn = os.path.join(shards_dir, shard_fn)
+            try:
+                shards.append((shard_fn, cls.load(shard_fn)))
+            except Exception as e:
+                lgr.warning(f"Failed to load citations from {shard_fn}: {e}")
+        return shards
 
 
 class BibTeXOutput(Output):
@@ -429,9 +1038,16 @@ class BibTeXOutput(Output):
                 if c.entry not in entries:
                     entries.append(c.entry)
 
+        bibtexs = self._prefetch_dois(entries)
         for entry in entries:
+            if isinstance(entry, Doi) and entry.doi not in bibtexs:
+                continue  # failed to import, as was warned about
             try:
-                bibtex = get_bibtex_rendering(entry)
+                if isinstance(entry, Doi):
+                    # imported already, so not looked up again
+                    bibtex = BibTeX(bibtexs[entry.doi])
+                else:
+                    bibtex = get_bibtex_rendering(entry)
             except Exception:
                 lgr.warning("Failed to generate BibTeX for %s", entry)
                 continue
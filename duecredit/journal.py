@@ -0,0 +1,423 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Append-only journal of citations, so they survive crashes of the process
+
+Citations are normally stored only upon exit of the process (see
+`CollectorSummary`), so processes which get killed (e.g. by SIGKILL or the
+OOM killer) record nothing.  With DUECREDIT_JOURNAL enabled, the collector
+also appends a small record to `<DUECREDIT_FILE>.d/<pid>@<host>.journal`
+whenever a citation is made for the first time, and (if an interval is given)
+records of the changed counts periodically.  Records are flushed right away,
+so they are lost only if the whole system crashes.
+
+The journal contains only what was cited since the last dump of the process,
+so once the process dumps its citations it gets removed.  Journals left by
+processes which are gone are folded into `DUECREDIT_FILE` upon the next dump
+(of any process on the same host, since only there it could be told that the
+process is gone), and are included by `duecredit summary`.  Journals which
+grew too long are compacted into a record per citation.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Any
+
+from .config import DUECREDIT_FILE
+from .io import (
+    _CITATION_FIELDS,
+    _ENTRY_FIELDS,
+    _citation_from_row,
+    _citation_row,
+    _entry_from_row,
+    _entry_row,
+    _get_shards_dir,
+)
+from .log import lgr
+
+if TYPE_CHECKING:
+    from .collector import Citation, CitationKey, DueCreditCollector
+    from .entries import DueCreditEntry
+
+__all__ = ["CitationsJournal", "load_journal", "load_journals"]
+
+JOURNAL_FORMAT = "duecredit-journal"
+JOURNAL_FORMAT_VERSION = 1
+JOURNAL_SUFFIX = ".journal"
+# Size of the journal after which it gets compacted
+MAX_JOURNAL_SIZE = 1024 * 1024
+
+_HEADER = (
+    json.dumps(
+        {
+            "format": JOURNAL_FORMAT,
+            "version": JOURNAL_FORMAT_VERSION,
+            "entry_fields": _ENTRY_FIELDS,
+            "citation_fields": _CITATION_FIELDS,
+        }
+    )
+    + "\n"
+)
+
+
+def _parse_journal(journal: str) -> float | None:
+    """Parse DUECREDIT_JOURNAL into the interval of recording the counts
+
+    "no" (None is returned), "yes" (0, i.e. only new citations are
+    recorded), or the interval in seconds are understood.
+    """
+    journal = journal.strip().lower()
+    if journal in ("0", "no", "false"):
+        return None
+    if journal in ("1", "yes", "true"):
+        return 0
+    try:
+        interval = float(journal)
+    except ValueError:
+        interval = -1
+    if interval <= 0:
+        raise ValueError(
+            f"Misunderstood value {journal!r} for DUECREDIT_JOURNAL. "
+            "Use 'yes', 'no', or the interval in seconds to record counts at"
+        )
+    return interval
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill would terminate it.  Journals are then only folded by the
+        # process which wrote them
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:  # e.g. of another user
+        pass
+    return True
+
+
+def _get_host_id() -> str:
+    """Identifies the host, within which pids of the journals are meaningful
+
+    The PID namespace (on Linux) is included as well, so containers which
+    share the file system and the hostname are told apart.
+    """
+    host = socket.gethostname()
+    try:
+        # e.g. "pid:[4026531836]"
+        host += "-" + os.readlink("/proc/self/ns/pid").strip("pid:[]")
+    except OSError:
+        pass
+    # "." separates the claimer from the journal it claimed
+    return re.sub(r"[^\w-]", "_", host)
+
+
+class CitationsJournal:
+    """Journal of the citations made by the collector from now on
+
+    Parameters
+    ----------
+    collector : DueCreditCollector
+      Collector to journal citations of.  It should call `record` for each
+      new citation
+    filename : str, optional
+      File the citations are dumped into, next to which the journal is kept
+    interval : float, optional
+      Interval (in seconds) to record changed counts at.  If 0, only the
+      first citation is recorded
+    """
+
+    def __init__(
+        self,
+        collector: DueCreditCollector,
+        filename: str = DUECREDIT_FILE,
+        interval: float = 0,
+    ) -> None:
+        self.collector = collector
+        self.fn = os.path.join(
+            _get_shards_dir(filename),
+            f"{os.getpid()}@{_get_host_id()}{JOURNAL_SUFFIX}",
+        )
+        self.interval = interval
+        # reentrant, so _merge could hold it while recording adopted citations
+        self.lock = threading.RLock()
+        self._f: Any = None
+        self._size = 0
+        # counts accounted for elsewhere (e.g. already dumped), and journaled
+        self._base: dict[CitationKey, int] = {}
+        self._written: dict[CitationKey, int] = {}
+        self._entries_written: set[str] = set()
+        self.checkpoint()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        if interval:
+            self._thread = threading.Thread(
+                target=self._record_periodically, name="duecredit-journal", daemon=True
+            )
+            self._thread.start()
+
+    def _record_periodically(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.record_counts()
+            except Exception as e:
+                lgr.warning(f"Failed to record citations into {self.fn}: {e}")
+                break
+
+    def _open(self) -> Any:
+        os.makedirs(os.path.dirname(self.fn), exist_ok=True)
+        f = open(self.fn, "a", encoding="utf-8")
+        if not f.tell():
+            f.write(_HEADER)
+        return f
+
+    def _write(self, lines: list[str]) -> None:
+        if self._f is None:
+            self._f = self._open()
+        data = "".join(lines)
+        self._f.write(data)
+        # only to the OS, which would still write it if we get killed
+        self._f.flush()
+        self._size += len(data)
+
+    def _citation_lines(self, citation: Citation) -> list[str]:
+        """Lines to record the citation with, if there is anything to record"""
+        key = citation.key
+        written = self._written.get(key)
+        delta = citation.count - self._base.get(key, 0) - (written or 0)
+        if written is not None or not delta:
+            return []
+        lines = []
+        entry = citation.entry
+        if entry.key not in self._entries_written:
+            lines.append(json.dumps({"entry": _entry_row(entry)}) + "\n")
+            self._entries_written.add(entry.key)
+        lines.append(json.dumps({"citation": _citation_row(citation, delta)}) + "\n")
+        self._written[key] = delta
+        return lines
+
+    def record(self, citation: Citation) -> None:
+        """Record a new citation (with its count)"""
+        with self.lock:
+            lines = self._citation_lines(citation)
+            if lines:
+                self._write(lines)
+
+    def exclude(self, citation: Citation, n: int, increment: bool = True) -> None:
+        """Increment the count of citation by `n`, which is accounted elsewhere
+
+        E.g. for citations merged from shards of forked processes, which are
+        removed only after they get dumped.
+        """
+        with self.lock:
+            if increment:
+                citation._increment(n)
+            self._base[citation.key] = self._base.get(citation.key, 0) + n
+
+    def record_counts(self) -> None:
+        """Record the citations and counts which changed since recorded last"""
+        with self.lock:
+            self._record_counts()
+            if self._size > MAX_JOURNAL_SIZE:
+                self._compact()
+
+    def compact(self) -> None:
+        """Rewrite the journal with a single record per citation"""
+        with self.lock:
+            self._record_counts()
+            self._compact()
+
+    def _record_counts(self) -> None:
+        lines = []
+        counts = []
+        for key, citation in list(self.collector.citations.items()):
+            if key not in self._written:
+                lines.extend(self._citation_lines(citation))
+                continue
+            delta = citation.count - self._base.get(key, 0) - self._written[key]
+            if delta:
+                counts.append([key.path, key.entry_key, delta])
+                self._written[key] += delta
+        if counts:
+            lines.append(json.dumps({"counts": counts}) + "\n")
+        if lines:
+            self._write(lines)
+
+    def _compact(self) -> None:
+        if self._f is None:  # nothing recorded
+            return
+        citations = self.collector.citations
+        entries: dict[str, DueCreditEntry] = {}
+        rows = []
+        for key, count in self._written.items():
+            citation = citations[key]
+            entries.setdefault(citation.entry.key, citation.entry)
+            rows.append(_citation_row(citation, count))
+        fd, tmp_fn = tempfile.mkstemp(
+            prefix=".", suffix=".tmp", dir=os.path.dirname(self.fn)
+        )
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                f.write(_HEADER)
+                for entry in entries.values():
+                    f.write(json.dumps({"entry": _entry_row(entry)}) + "\n")
+                for row in rows:
+                    f.write(json.dumps({"citation": row}) + "\n")
+            os.replace(tmp_fn, self.fn)
+        except BaseException:
+            os.unlink(tmp_fn)
+            raise
+        if self._f is not None:
+            self._f.close()
+        self._f = self._open()
+        self._size = self._f.tell()
+        self._entries_written = set(entries)
+        lgr.debug("Compacted journal %s to %d citations", self.fn, len(rows))
+
+    def checkpoint(self) -> None:
+        """Start anew, since everything cited so far got dumped
+
+        The journal file gets removed, and is created again upon the next
+        record.
+        """
+        with self.lock:
+            self._base = {
+                key: citation.count
+                for key, citation in list(self.collector.citations.items())
+            }
+            self._written = {}
+            self._entries_written = set()
+            self._size = 0
+            self._remove()
+
+    def _remove(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        try:
+            os.unlink(self.fn)
+        except FileNotFoundError:
+            return
+        try:
+            os.rmdir(os.path.dirname(self.fn))
+        except OSError:  # not empty
+            pass
+
+    def close(self, remove: bool = False) -> None:
+        """Stop journaling, and remove the journal if `remove`"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        with self.lock:
+            if remove:
+                self._remove()
+            elif self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+def load_journal(fn: str) -> DueCreditCollector:
+    """Load a collector with the citations recorded in the journal
+
+    Records after a truncated one (e.g. if the process got killed while
+    writing it) are ignored.
+    """
+    from .collector import Citation, DueCreditCollector
+
+    entries: dict[str, DueCreditEntry] = {}
+    citations: dict[CitationKey, Citation] = {}
+    with open(fn, encoding="utf-8") as f:
+        header = json.loads(f.readline() or "null")
+        if not isinstance(header, dict) or header.get("format") != JOURNAL_FORMAT:
+            raise ValueError("Not a journal of duecredit citations")
+        if header.get("version") != JOURNAL_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported version {header.get('version')!r} of the journal. "
+                f"Supported is {JOURNAL_FORMAT_VERSION}. Upgrade duecredit?"
+            )
+        ef = {name: i for i, name in enumerate(header["entry_fields"])}
+        cf = {name: i for i, name in enumerate(header["citation_fields"])}
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                lgr.debug("Ignoring truncated records in %s", fn)
+                break
+            if "entry" in record:
+                entry = _entry_from_row(record["entry"], ef)
+                entries[entry.key] = entry
+            elif "citation" in record:
+                citation = _citation_from_row(record["citation"], cf, entries)
+                ours = citations.setdefault(citation.key, citation)
+                if ours is not citation:
+                    ours._increment(citation.count)
+            elif "counts" in record:
+                for path, entry_key, n in record["counts"]:
+                    key = Citation.get_key(path, entry_key)
+                    if key in citations:
+                        citations[key]._increment(n)
+    return DueCreditCollector(entries=entries, citations=citations)
+
+
+def load_journals(
+    filename: str = DUECREDIT_FILE, claim: bool = False
+) -> list[tuple[str, DueCreditCollector]]:
+    """Load collectors from the journals next to `filename`
+
+    Parameters
+    ----------
+    claim : bool, optional
+      Load only journals of the processes on this host which are gone, and
+      claim them (by renaming to carry our pid), so no other process folds
+      them too.  If we get killed as well, they get claimed by somebody else
+      later.  Journals of the processes on other hosts (e.g. nodes of a
+      cluster sharing the file system) are left to those hosts.
+
+    Returns
+    -------
+    list of (journal filename, collector)
+    """
+    journals_dir = _get_shards_dir(filename)
+    try:
+        journal_fns = sorted(os.listdir(journals_dir))
+    except OSError:
+        return []
+    pid = os.getpid()
+    host = _get_host_id()
+    journals = []
+    for journal_fn in journal_fns:
+        if not journal_fn.endswith(JOURNAL_SUFFIX) or journal_fn.startswith("."):
+            continue
+        path = os.path.join(journals_dir, journal_fn)
+        if claim:
+            # of the last claimer, if it was claimed
+            owner_pid, _, owner_host = journal_fn.split(".", 1)[0].partition("@")
+            try:
+                journal_pid = int(owner_pid)
+            except ValueError:
+                continue
+            if owner_host != host or journal_pid == pid or _pid_alive(journal_pid):
+                continue
+            claimed = os.path.join(journals_dir, f"{pid}@{host}.{journal_fn}")
+            try:
+                os.rename(path, claimed)
+            except OSError:  # claimed by somebody else meanwhile
+                continue
+            path = claimed
+        try:
+            journals.append((path, load_journal(path)))
+        except Exception as e:
+            lgr.warning(f"Failed to load citations from {path}: {e}")
+    return journals
@@ -10,7 +10,6 @@
 from __future__ import annotations
 
 import logging
-import logging.handlers
 import os
 from os.path import basename, dirname
 import platform
@@ -221,7 +220,9 @@ class LoggerHelper:
             # must be a simple filename
             # Use RotatingFileHandler for possible future parametrization to keep
             # log succinct and rotating
-            loghandler = logging.handlers.RotatingFileHandler(logtarget_)
+            from logging.handlers import RotatingFileHandler
+
+            loghandler = RotatingFileHandler(logtarget_)
             use_color = False
             # I had decided not to guard this call and just raise exception to go
             # out happen that specified file location is not writable etc.
@@ -0,0 +1,135 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Propagation of citations from worker processes back to the parent
+
+Functions executed in the workers of process pools (e.g. with the "spawn"
+start method) cite into the collectors of those processes, which are never
+dumped.  `WorkersCitations` provides an initializer for the workers, which
+activates duecredit there and sends collected citations back to the parent
+upon the worker exit, where they get merged into its collector::
+
+    from concurrent.futures import ProcessPoolExecutor
+    from duecredit.parallel import WorkersCitations
+
+    with WorkersCitations() as workers:
+        with ProcessPoolExecutor(
+            initializer=workers.initializer, initargs=workers.initargs
+        ) as executor:
+            results = list(executor.map(func, data))
+
+All the citations are merged by the exit from the `with WorkersCitations()`
+block, so the workers must have exited by then (e.g. upon shutdown of the
+executor, or `close()` and `join()` of a `multiprocessing.Pool`).  Workers which get
+terminated (e.g. by `multiprocessing.Pool.terminate()`) do not send their
+citations.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import threading
+from typing import TYPE_CHECKING, Any
+
+from .log import lgr
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from types import TracebackType
+
+    from .collector import DueCreditCollector
+    from .dueswitch import DueSwitch
+
+__all__ = ["WorkersCitations"]
+
+
+def _init_worker(queue: Any) -> None:
+    """Initializer of a worker process: activate duecredit and send to `queue`"""
+    from .dueswitch import due
+
+    due._activate_worker(queue.put)
+
+
+class WorkersCitations:
+    """Collects citations from worker processes into the collector
+
+    Parameters
+    ----------
+    collector : DueSwitch or DueCreditCollector, optional
+      Where to merge citations of the workers.  By default, the `due` of
+      duecredit, in which case (if it is not active) nothing is done for
+      the workers
+    mp_context : multiprocessing context, optional
+      Context to create the queue passing citations with.  Should be the
+      same one as used by the pool
+    """
+
+    def __init__(
+        self,
+        collector: DueSwitch | DueCreditCollector | None = None,
+        mp_context: Any = None,
+    ) -> None:
+        if collector is None:
+            from .dueswitch import due
+
+            collector = due
+        self._collector = collector
+        self._mp_context = mp_context or multiprocessing
+        self._queue: Any = None
+        self._receiver: threading.Thread | None = None
+
+    @property
+    def initializer(self) -> Callable[[Any], None] | None:
+        """Initializer for the worker processes"""
+        return None if self._queue is None else _init_worker
+
+    @property
+    def initargs(self) -> tuple[Any, ...]:
+        """Arguments for the `initializer`"""
+        return () if self._queue is None else (self._queue,)
+
+    def __enter__(self) -> WorkersCitations:
+        if not getattr(self._collector, "active", True):
+            lgr.debug("DueCredit is not active, not collecting from workers")
+            return self
+        self._queue = self._mp_context.Queue()
+        # Receive while the workers run, so they never block on a full queue
+        # while exiting (and thus the pool shutdown waiting for them)
+        self._receiver = threading.Thread(
+            target=self._receive, name="duecredit-workers", daemon=True
+        )
+        self._receiver.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        if self._queue is None:
+            return
+        # the workers have exited, so all they have sent precedes our sentinel
+        self._queue.put(None)
+        self._receiver.join()
+        self._queue.close()
+        self._queue.join_thread()
+        self._queue = self._receiver = None
+
+    def _receive(self) -> None:
+        n = 0
+        while True:
+            collector = self._queue.get()
+            if collector is None:
+                break
+            try:
+                self._collector._merge(collector)
+                n += 1
+            except Exception as e:
+                lgr.warning(f"Failed to merge citations from a worker: {e}")
+        lgr.debug("Merged citations from %d workers", n)
@@ -0,0 +1,173 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Snapshot of BibTeX for the DOIs cited by the injections
+
+So citations by the injections could be rendered without reaching doi.org
+(e.g. on the nodes of a cluster without access to the internet).  If there
+is one, it is consulted before the cache and the network.
+
+It is not included with duecredit, but generated (or regenerated whenever
+DOIs cited by the injections change) in the installed duecredit with::
+
+    python -m duecredit.snapshot
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import os
+import threading
+import time
+
+from .log import lgr
+
+__all__ = ["get_injection_dois", "get_snapshot", "update_snapshot"]
+
+SNAPSHOT_FILE = os.path.join(os.path.dirname(__file__), "injections", "bibtex.json")
+SNAPSHOT_FORMAT = "duecredit-bibtex-snapshot"
+SNAPSHOT_FORMAT_VERSION = 1
+
+# (filename, BibTeX per DOI) as loaded, see get_snapshot
+_snapshot: tuple[str, dict[str, str]] | None = None
+_snapshot_lock = threading.Lock()
+
+
+def _load(filename: str) -> dict[str, str | None]:
+    with open(filename, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"{filename} is not a snapshot of BibTeX")
+    if data.get("version", 0) > SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported version {data.get('version')} of the snapshot "
+            f"{filename}. Supported is {SNAPSHOT_FORMAT_VERSION}. Upgrade duecredit?"
+        )
+    return data["bibtex"]
+
+
+def get_snapshot() -> dict[str, str]:
+    """BibTeX per DOI from the snapshot, loaded once
+
+    DOIs BibTeX could not be obtained for, when it was generated, are not
+    there.  If there is no snapshot, or it could not be loaded, it is empty.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot[0] != SNAPSHOT_FILE:
+            try:
+                bibtexs = {
+                    doi: bibtex
+                    for doi, bibtex in _load(SNAPSHOT_FILE).items()
+                    if bibtex is not None
+                }
+            except FileNotFoundError:
+                # not generated, as it is not included with duecredit
+                lgr.debug("No snapshot of BibTeX %s", SNAPSHOT_FILE)
+                bibtexs = {}
+            except Exception as e:
+                lgr.warning(f"Failed to load snapshot of BibTeX {SNAPSHOT_FILE}: {e}")
+                bibtexs = {}
+            _snapshot = (SNAPSHOT_FILE, bibtexs)
+        return _snapshot[1]
+
+
+def get_injection_dois() -> list[str]:
+    """DOIs cited by all the injections (injections/mod_*.py)"""
+    from .collector import DueCreditCollector
+    from .entries import Doi
+    from .injections.injector import DueCreditInjector, get_modules_for_injection
+
+    # just to collect what they would inject
+    injector = DueCreditInjector(collector=DueCreditCollector())
+    for modname in get_modules_for_injection():
+        importlib.import_module(f"duecredit.injections.{modname}").inject(injector)
+    return sorted(
+        {
+            record["entry"].doi
+            for obj_records in injector._entry_records.values()
+            for records in obj_records.values()
+            for record in records
+            if isinstance(record["entry"], Doi)
+        }
+    )
+
+
+def update_snapshot(
+    filename: str | None = None, max_workers: int | None = None
+) -> dict[str, str]:
+    """Fetch BibTeX for the DOIs cited by the injections into the snapshot
+
+    BibTeX is fetched concurrently (see `import_dois`), bypassing the snapshot
+    and the cache, which it is not stored into either.  DOIs it could not be
+    fetched for stay in the snapshot, without BibTeX, so it is evident they
+    were not forgotten.  If it could not be fetched for any (e.g. without
+    access to the internet), the snapshot is left as it is.
+
+    Returns
+    -------
+    dict
+      Why BibTeX could not be fetched, per DOI
+    """
+    from .io import _fetch_dois
+
+    filename = filename or SNAPSHOT_FILE
+    dois = get_injection_dois()
+    start = time.time()
+    bibtexs, failures = _fetch_dois(dois, max_workers, 0.5, 10)
+    lgr.info(
+        "Fetched BibTeX for %d out of %d DOIs in %.1f sec",
+        len(bibtexs),
+        len(dois),
+        time.time() - start,
+    )
+    if not bibtexs:
+        lgr.warning("Fetched no BibTeX, so not updating the snapshot %s", filename)
+        return {doi: str(e) for doi, e in failures.items()}
+    data = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "bibtex": {doi: bibtexs.get(doi) for doi in dois},
+    }
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+    os.replace(tmp, filename)
+    return {doi: str(e) for doi, e in failures.items()}
+
+
+def main(args: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m duecredit.snapshot",
+        description="Fetch BibTeX for the DOIs cited by the injections into "
+        "the snapshot shipped along",
+    )
+    parser.add_argument(
+        "-o",
+        "--filename",
+        default=SNAPSHOT_FILE,
+        help="Snapshot to write. Default: %(default)s",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Number of concurrent queries. Default: DUECREDIT_DOI_WORKERS, or 8",
+    )
+    parsed = parser.parse_args(args)
+    errors = update_snapshot(parsed.filename, parsed.workers)
+    for doi, error in sorted(errors.items()):
+        print(f"Failed to fetch BibTeX for {doi}: {error}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
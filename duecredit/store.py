@@ -0,0 +1,438 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Store of citations made by many runs, in an SQLite database
+
+With "sqlite" among DUECREDIT_OUTPUTS, citations made by every run are
+recorded into DUECREDIT_DB (`.duecredit.db` by default), along with the run
+they were made by.  Then `duecredit summary --db` could report them, or
+aggregate their counts (e.g. per package, or since some date) right in the
+database.
+
+Tables are:
+
+- `entries`: cited entries (BibTeX, Doi, ...)
+- `citations`: citations of the entries by the modules/functions, with their
+  package and module (indexed)
+- `citation_tags`: tags of the citations (indexed)
+- `runs`: runs which made the citations, with their timestamps (indexed)
+- `counts`: counts of the citations made by the runs
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import TYPE_CHECKING, Any
+import uuid
+
+from .config import DUECREDIT_DB
+from .io import _ENTRY_TYPES, _encode_version
+from .log import lgr
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    from .collector import DueCreditCollector
+
+__all__ = ["SQLiteOutput", "SQLiteStore"]
+
+# Version of the schema, to be incremented whenever it changes
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    type TEXT NOT NULL,
+    rawentry TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS citations (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    entry_id INTEGER NOT NULL REFERENCES entries(id),
+    description TEXT,
+    cite_module INTEGER NOT NULL,
+    package TEXT,
+    module TEXT,
+    UNIQUE (path, entry_id)
+);
+CREATE INDEX IF NOT EXISTS citations_package ON citations(package);
+CREATE INDEX IF NOT EXISTS citations_module ON citations(module);
+CREATE TABLE IF NOT EXISTS citation_tags (
+    citation_id INTEGER NOT NULL REFERENCES citations(id),
+    tag TEXT NOT NULL,
+    PRIMARY KEY (citation_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS citation_tags_tag ON citation_tags(tag);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL UNIQUE,
+    timestamp REAL NOT NULL,
+    pid INTEGER,
+    argv TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs(timestamp);
+CREATE TABLE IF NOT EXISTS counts (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    citation_id INTEGER NOT NULL REFERENCES citations(id),
+    version TEXT,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run_id, citation_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS counts_citation ON counts(citation_id);
+"""
+
+# What counts could be aggregated by, with the column to group by
+AGGREGATES = {
+    "package": "c.package",
+    "module": "c.module",
+    "path": "c.path",
+    "entry": "e.key",
+    "tag": "t.tag",
+}
+
+# Max number of values looked up by a single query, well within the limit on
+# the number of variables of older SQLite (999)
+_CHUNK = 500
+
+# (uuid, timestamp, pid) of the current run, see _get_run
+_run: tuple[str, float, int] | None = None
+
+
+def _get_run() -> tuple[str, float]:
+    """Identity of the run by this process, and when it started recording"""
+    global _run
+    if _run is None or _run[2] != os.getpid():
+        _run = (uuid.uuid4().hex, time.time(), os.getpid())
+    return _run[0], _run[1]
+
+
+def _dump_version(version: Any) -> str | None:
+    version = _encode_version(version)
+    return None if version is None else json.dumps(version)
+
+
+class SQLiteStore:
+    """SQLite database with citations made by many runs
+
+    Parameters
+    ----------
+    filename : str, optional
+      Database to use, which gets created if it does not exist
+    """
+
+    def __init__(self, filename: str = DUECREDIT_DB) -> None:
+        self.filename = filename
+        # concurrent runs wait for each other's transactions to finish
+        self._db = sqlite3.connect(filename, timeout=60)
+        try:
+            self._setup()
+        except BaseException:
+            self._db.close()
+            raise
+
+    def _setup(self) -> None:
+        db = self._db
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ValueError(
+                f"Unsupported version {version} of the schema of {self.filename}. "
+                f"Supported is {SCHEMA_VERSION}. Upgrade duecredit?"
+            )
+        # readers do not block the writer, and commits are cheap
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA foreign_keys=ON")
+        if version < SCHEMA_VERSION:
+            with db:
+                db.executescript(_SCHEMA)
+                db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> SQLiteStore:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def add(
+        self,
+        collector: DueCreditCollector,
+        run: str | None = None,
+        timestamp: float | None = None,
+    ) -> int:
+        """Add citations of the collector, as made by the run
+
+        All of it is done in a single transaction.
+
+        Parameters
+        ----------
+        run : str, optional
+          Identity of the run.  Counts get added up for the same run.  By
+          default, the run of the current process
+        timestamp : float, optional
+          When the run has started, if it is new.  By default, when the run
+          of the current process has first stored its citations
+
+        Returns
+        -------
+        int
+          Id of the run
+        """
+        if run is None:
+            run, timestamp = _get_run()
+        citations = list(collector.citations.values())
+        entries = {c.entry.key: c.entry for c in citations}
+        db = self._db
+        with db:
+            db.execute(
+                "INSERT OR IGNORE INTO runs (uuid, timestamp, pid, argv) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    run,
+                    time.time() if timestamp is None else timestamp,
+                    os.getpid(),
+                    json.dumps(sys.argv),
+                ),
+            )
+            (run_id,) = db.execute(
+                "SELECT id FROM runs WHERE uuid = ?", (run,)
+            ).fetchone()
+            db.executemany(
+                "INSERT OR IGNORE INTO entries (key, type, rawentry) VALUES (?, ?, ?)",
+                [
+                    (key, entry.__class__.__name__, entry.rawentry)
+                    for key, entry in entries.items()
+                ],
+            )
+            entry_ids = self._select_ids(
+                "SELECT key, id FROM entries WHERE key IN ({})",
+                [(key,) for key in entries],
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO citations "
+                "(path, entry_id, description, cite_module, package, module) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        c.path,
+                        entry_ids[c.entry.key],
+                        c.description,
+                        c.cite_module,
+                        c.package,
+                        c.module,
+                    )
+                    for c in citations
+                ],
+            )
+            ids = self._select_ids(
+                "SELECT path, entry_id, id FROM citations "
+                "WHERE (path, entry_id) IN (VALUES {})",
+                [(c.path, entry_ids[c.entry.key]) for c in citations],
+            )
+            citation_ids = [ids[c.path, entry_ids[c.entry.key]] for c in citations]
+            db.executemany(
+                "INSERT OR IGNORE INTO citation_tags (citation_id, tag) VALUES (?, ?)",
+                [
+                    (citation_id, tag)
+                    for citation_id, c in zip(citation_ids, citations)
+                    for tag in c.tags
+                ],
+            )
+            db.executemany(
+                "INSERT INTO counts (run_id, citation_id, version, count) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (run_id, citation_id) DO UPDATE SET "
+                "count = count + excluded.count, "
+                "version = coalesce(version, excluded.version)",
+                [
+                    (
+                        run_id,
+                        citation_id,
+                        _dump_version(c.version),
+                        c.count,
+                    )
+                    for citation_id, c in zip(citation_ids, citations)
+                ],
+            )
+        return run_id
+
+    def _select_ids(self, query: str, keys: list[tuple[Any, ...]]) -> dict[Any, int]:
+        """Ids of the rows by their keys, selected in chunks
+
+        `query` should select the columns of the key followed by the id, for
+        the keys substituted for {} (as a list of values, or of rows).
+        """
+        ids = {}
+        width = len(keys[0]) if keys else 1
+        placeholder = "?" if width == 1 else f"({', '.join('?' * width)})"
+        step = _CHUNK // width
+        for i in range(0, len(keys), step):
+            chunk = keys[i : i + step]
+            for *key, id_ in self._db.execute(
+                query.format(", ".join([placeholder] * len(chunk))),
+                [value for key in chunk for value in key],
+            ):
+                ids[key[0] if width == 1 else tuple(key)] = id_
+        return ids
+
+    @staticmethod
+    def _where(
+        since: datetime | float | None, tag: str | None
+    ) -> tuple[str, list[Any]]:
+        conditions: list[str] = []
+        params: list[Any] = []
+        if since is not None:
+            if isinstance(since, datetime):
+                since = since.timestamp()
+            conditions.append("r.timestamp >= ?")
+            params.append(since)
+        if tag is not None:
+            conditions.append("t.tag = ?")
+            params.append(tag)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    def aggregate(
+        self,
+        by: str = "package",
+        since: datetime | float | None = None,
+        tag: str | None = None,
+    ) -> list[tuple[str | None, int, int, float]]:
+        """Aggregate counts of the citations, computed by the database
+
+        Parameters
+        ----------
+        by : str, optional
+          What to aggregate by, one of AGGREGATES
+        since : datetime or float, optional
+          Consider only the runs started since then
+        tag : str, optional
+          Consider only the citations with this tag
+
+        Returns
+        -------
+        list of (name, number of runs, total count, timestamp of the last run)
+          Sorted by the total count, the highest first
+        """
+        try:
+            column = AGGREGATES[by]
+        except KeyError:
+            raise ValueError(
+                f"Unknown aggregate {by!r}. Use one of {', '.join(AGGREGATES)}"
+            ) from None
+        where, params = self._where(since, tag)
+        tags_join = (
+            " JOIN citation_tags t ON t.citation_id = c.id"
+            if by == "tag" or tag is not None
+            else ""
+        )
+        return self._db.execute(
+            f"SELECT {column} AS name, COUNT(DISTINCT k.run_id), SUM(k.count), "
+            "MAX(r.timestamp) "
+            "FROM counts k "
+            "JOIN runs r ON r.id = k.run_id "
+            "JOIN citations c ON c.id = k.citation_id "
+            f"JOIN entries e ON e.id = c.entry_id{tags_join}{where} "
+            "GROUP BY name ORDER BY SUM(k.count) DESC, name",
+            params,
+        ).fetchall()
+
+    def load(
+        self, since: datetime | float | None = None, tag: str | None = None
+    ) -> DueCreditCollector:
+        """Load a collector with the citations, counts of which are added up
+
+        See `aggregate` for the parameters.
+        """
+        from .collector import Citation, DueCreditCollector
+
+        where, params = self._where(since, tag)
+        tags_join = " JOIN citation_tags t ON t.citation_id = c.id" if tag else ""
+        rows = self._db.execute(
+            "SELECT e.type, e.key, e.rawentry, c.id, c.path, c.description, "
+            "c.cite_module, "
+            # as of the latest run it is known for
+            "(SELECT k2.version FROM counts k2 JOIN runs r2 ON r2.id = k2.run_id "
+            "WHERE k2.citation_id = c.id AND k2.version IS NOT NULL "
+            "ORDER BY r2.timestamp DESC LIMIT 1), "
+            "SUM(k.count), "
+            "(SELECT group_concat(tag, char(10)) FROM citation_tags "
+            "WHERE citation_id = c.id) "
+            "FROM counts k "
+            "JOIN runs r ON r.id = k.run_id "
+            "JOIN citations c ON c.id = k.citation_id "
+            f"JOIN entries e ON e.id = c.entry_id{tags_join}{where} "
+            "GROUP BY c.id",
+            params,
+        ).fetchall()
+        entries = {}
+        citations = {}
+        for row in rows:
+            type_, key, rawentry, _, path, description, cite_module = row[:7]
+            version, count, tags = row[7:]
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = _ENTRY_TYPES[type_](rawentry, key=key)
+            if version is not None:
+                version = json.loads(version)
+                if isinstance(version, list):
+                    version = tuple(version)
+            citation = Citation(
+                entry,
+                description=description,
+                path=path,
+                version=version,
+                cite_module=bool(cite_module),
+                tags=tags.split("\n") if tags else [],
+            )
+            citation.count = count
+            citations[citation.key] = citation
+        return DueCreditCollector(entries=entries, citations=citations)
+
+
+class SQLiteOutput:
+    """Records citations of the collector into `SQLiteStore`
+
+    Only the citations made since the collector was recorded last get
+    recorded, so it could be dumped repeatedly.
+    """
+
+    def __init__(
+        self, collector: DueCreditCollector, fn: str = DUECREDIT_DB
+    ) -> None:
+        self.collector = collector
+        self.fn = fn
+
+    def dump(self) -> None:
+        # versions could be known only while the packages are still around
+        self.collector._resolve_versions()
+        store_key = f"sqlite:{self.fn}"
+        unstored = self.collector._get_unstored(store_key)
+        if not unstored.citations:
+            return
+        with SQLiteStore(self.fn) as store:
+            run_id = store.add(unstored)
+        self.collector._mark_stored(store_key, unstored)
+        lgr.info(
+            "Recorded %d citations into %s as of run %d",
+            len(unstored.citations),
+            self.fn,
+            run_id,
+        )
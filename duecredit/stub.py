@@ -28,7 +28,7 @@ Copyright:  2015-2021  DueCredit developers
 License:    BSD-2
 """
 
-__version__ = "0.0.9"
+__version__ = "0.0.10"
 
 
 class InactiveDueCreditCollector:
@@ -63,6 +63,10 @@ try:
 
     if "due" in locals() and not hasattr(due, "cite"):
         raise RuntimeError("Imported due lacks .cite. DueCredit is now disabled")
+    for _entry_cls in (BibTeX, Doi, Text, Url):
+        if not hasattr(_entry_cls, "lazy"):
+            # duecredit is older than this stub -- create entries right away
+            _entry_cls.lazy = _entry_cls  # type: ignore[attr-defined]
 except Exception as e:
     if not isinstance(e, ImportError):
         import logging
@@ -71,6 +75,8 @@ except Exception as e:
     # Initiate due stub
     due = InactiveDueCreditCollector()  # type: ignore[assignment]
     BibTeX = Doi = Url = Text = _donothing_func  # type: ignore[assignment, misc]
+    # so BibTeX.lazy(...) etc also work
+    _donothing_func.lazy = _donothing_func  # type: ignore[attr-defined]
 
 # Emacs mode definitions
 # Local Variables:
@@ -0,0 +1,95 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+from __future__ import annotations
+
+from collections import Counter
+import threading
+from typing import TYPE_CHECKING, Any
+
+import pytest
+from pytest import MonkeyPatch
+
+import duecredit.io
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+
+class _DoiServer:
+    """Local stand-in for doi.org, see `doi_server` fixture"""
+
+    def __init__(self) -> None:
+        # responses per DOI: (status, headers, body), the last one repeated
+        self.responses: dict[str, list[tuple[int, dict[str, str], str]]] = {}
+        self.requests: Counter[str] = Counter()
+        self.connections: set[int] = set()
+        self.delay = 0.0
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    def add(self, doi: str, *responses: tuple[int, dict[str, str], str]) -> None:
+        self.responses[doi] = list(responses)
+
+    def respond(self, doi: str, port: int) -> tuple[int, dict[str, str], str]:
+        with self.lock:
+            self.requests[doi] += 1
+            self.connections.add(port)
+            self.active += 1
+            self.max_active = max(self.active, self.max_active)
+        threading.Event().wait(self.delay)
+        with self.lock:
+            self.active -= 1
+            responses = self.responses.get(doi) or [(404, {}, "DOI Not Found")]
+            return responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+@pytest.fixture
+def doi_server(monkeypatch: MonkeyPatch, tmp_path) -> Iterator[_DoiServer]:
+    """Serve BibTeX for DOIs, as doi.org would, and cache it under tmp_path"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import unquote
+
+    server = _DoiServer()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keeps connections alive
+
+        def do_GET(self) -> None:
+            status, headers, body = server.respond(
+                unquote(self.path[1:]), self.client_address[1]
+            )
+            data = body.encode()
+            self.send_response(status)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        duecredit.io, "DOI_RESOLVER_URL", f"http://127.0.0.1:{httpd.server_port}/"
+    )
+    monkeypatch.setattr(duecredit.io, "CACHE_DIR", str(tmp_path / "bibtex"))
+    monkeypatch.setattr(duecredit.io, "DOI_CACHE_FILE", str(tmp_path / "bibtex.db"))
+    try:
+        yield server
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _bibtex(key: str) -> str:
+    return f"@article{{{key}, title={{Title of {key}}}, year={{2020}}}}"
@@ -21,8 +21,9 @@ from typing import overload
 import pytest
 from pytest import MonkeyPatch
 
-from duecredit.collector import DueCreditCollector
+from duecredit.collector import CitationKey, DueCreditCollector
 from duecredit.entries import BibTeX, Doi
+from duecredit.io import PickleOutput
 from duecredit.stub import InactiveDueCreditCollector
 
 from ..utils import on_windows
@@ -112,15 +113,22 @@ def test_api(collector_class) -> None:
 
 
 @overload
-def run_python_command(cmd: str): ...
+def run_python_command(cmd: str, options: list[str] | None = None): ...
 
 
 @overload
-def run_python_command(cmd: None, script: str): ...
+def run_python_command(cmd: None, script: str, options: list[str] | None = None): ...
 
 
-def run_python_command(cmd: str | None = None, script: str | None = None):
-    """Just a tiny helper which runs command and returns exit code, stdout, stderr"""
+def run_python_command(
+    cmd: str | None = None,
+    script: str | None = None,
+    options: list[str] | None = None,
+):
+    """Just a tiny helper which runs command and returns exit code, stdout, stderr
+
+    `options` are passed to the python interpreter itself (e.g. ["-X", "importtime"])
+    """
     if script is None:
         assert cmd is not None
         args = ["-c", cmd]
@@ -131,7 +139,12 @@ def run_python_command(cmd: str | None = None, script: str | None = None):
         # run script from some temporary directory so we do not breed .duecredit.p
         # in current directory
         tmpdir = tempfile.mkdtemp()
-        python = Popen([sys.executable] + args, stdout=PIPE, stderr=PIPE, cwd=tmpdir)
+        python = Popen(
+            [sys.executable] + (options or []) + args,
+            stdout=PIPE,
+            stderr=PIPE,
+            cwd=tmpdir,
+        )
         stdout, stderr = python.communicate()  # wait()
         ret = python.poll()
     finally:
@@ -140,6 +153,45 @@ def run_python_command(cmd: str | None = None, script: str | None = None):
     return ret, stdout.decode(errors="ignore"), stderr.decode()
 
 
+def test_stub_with_old_duecredit(monkeypatch: MonkeyPatch, tmp_path) -> None:
+    # duecredit installed might predate the stub of the project, e.g. lacking
+    # .lazy of the entries
+    old = tmp_path / "duecredit"
+    old.mkdir()
+    (old / "__init__.py").write_text(
+        "class BibTeX:\n"
+        "    def __init__(self, *args, **kwargs): self.args = args\n"
+        "Doi = Text = Url = BibTeX\n"
+        "class due:\n"
+        "    cited = []\n"
+        "    @staticmethod\n"
+        "    def cite(entry, **kwargs): due.cited.append(entry)\n"
+        "    @staticmethod\n"
+        "    def dcite(entry, **kwargs):\n"
+        "        due.cite(entry)\n"
+        "        return lambda func: func\n"
+    )
+    shutil.copy(pathjoin(dirname(__file__), os.pardir, "stub.py"), tmp_path / "due.py")
+    script = tmp_path / "script.py"
+    script.write_text(
+        "from due import due, BibTeX, Doi\n"
+        "@due.dcite(BibTeX.lazy('@article{XXX0, title={...}}'), path='x')\n"
+        "def f():\n"
+        "    return 1\n"
+        "assert f() == 1\n"
+        "due.cite(Doi.lazy('10.1/x'), path='x')\n"
+        "print([(type(e).__name__, e.args) for e in due.cited])\n"
+    )
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path))
+    ret, out, err = run_python_command(script=str(script))
+    assert ret == 0, err
+    # still citing, with the entries created right away
+    assert out.strip() == (
+        "[('BibTeX', ('@article{XXX0, title={...}}',)), ('BibTeX', ('10.1/x',))]"
+    )
+    assert "Failed to import duecredit" not in err
+
+
 # Since duecredit and possibly lxml already loaded, let's just test
 # ability to import in absence of lxml via external call to python
 def test_noincorrect_import_if_no_lxml(monkeypatch: MonkeyPatch) -> None:
@@ -171,6 +223,7 @@ def test_noincorrect_import_if_no_lxml(monkeypatch: MonkeyPatch) -> None:
         {"DUECREDIT_ENABLE": "yes"},
         {"DUECREDIT_ENABLE": "yes", "DUECREDIT_REPORT_TAGS": "*"},
         {"DUECREDIT_TEST_EARLY_IMPORT_ERROR": "yes"},
+        {"DUECREDIT_ENABLE": "yes", "DUECREDIT_TEST_EARLY_IMPORT_ERROR": "yes"},
     ],
 )
 @pytest.mark.parametrize(
@@ -203,20 +256,25 @@ def test_noincorrect_import_if_no_lxml_numpy(
 
     ret, out, err = run_python_command(**kwargs)
     direct_duecredit_import = "import duecredit" in kwargs.get("cmd", "")
-    if direct_duecredit_import and env.get("DUECREDIT_TEST_EARLY_IMPORT_ERROR", ""):
-        # We do fail then upon regular import but stubbed script should be ok
-        # since should use the stub
-        assert "Both inactive and active collectors should be provided" in err
-        assert ret == 1
-    else:
-        # TODO: fixup.  Somehow with type annotation changes we "broke" some tests
-        # assert err == ""
-        assert ret == 0  # but we must not fail overall regardless
+    # TODO: fixup.  Somehow with type annotation changes we "broke" some tests
+    # assert err == ""
+    assert ret == 0  # but we must not fail overall regardless
 
     if (
         os.environ.get("DUECREDIT_ENABLE", None) and on_windows
     ):  # TODO this test fails on windows
         pytest.xfail("Fails for some reason on Windows")
+    elif os.environ.get("DUECREDIT_TEST_EARLY_IMPORT_ERROR"):
+        if os.environ.get("DUECREDIT_ENABLE", None):
+            # active collector failed to be created, so we stay inactive
+            assert "ImportError" in out + err
+            assert "DUECREDIT_TEST_EARLY_IMPORT_ERROR" in out + err
+            if direct_duecredit_import:
+                assert "Please report" in out + err
+        else:
+            # active collector is not even attempted to be created
+            assert "DUECREDIT_TEST_EARLY_IMPORT_ERROR" not in out + err
+        assert "done123" in out
     elif os.environ.get("DUECREDIT_ENABLE", None):  # we enabled duecredit
         if (
             os.environ.get("DUECREDIT_REPORT_TAGS", None) == "*"
@@ -230,17 +288,124 @@ def test_noincorrect_import_if_no_lxml_numpy(
             assert "For formatted output we need citeproc" not in out
             assert "0 packages cited" in out
         assert "done123" in out
-    elif os.environ.get("DUECREDIT_TEST_EARLY_IMPORT_ERROR"):
-        assert "ImportError" in out + err
-        assert "DUECREDIT_TEST_EARLY_IMPORT_ERROR" in out + err
-        if direct_duecredit_import:
-            assert "Please report" in out + err
-        else:
-            assert "done123" in out
     else:
         assert out in ("done123\n", "done123\r\n")
 
 
+_fork_script = """
+import multiprocessing
+import os
+import sys
+
+from duecredit import Text, due
+
+def cite(n):
+    for _ in range(n):
+        due.cite(Text("Forked", key="forked"), path="forking")
+
+cite(1)
+pids = []
+for i in range(3):
+    pid = os.fork()
+    if not pid:
+        cite(10)
+        sys.exit(0)  # exits running atexit handlers
+    pids.append(pid)
+for pid in pids:
+    os.waitpid(pid, 0)
+# multiprocessing exits without running atexit handlers
+proc = multiprocessing.get_context("fork").Process(target=cite, args=(100,))
+proc.start()
+proc.join()
+cite(1000)
+"""
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+@pytest.mark.parametrize("shared_counters", ["no", "yes"])
+def test_forked_processes_citations(
+    monkeypatch: MonkeyPatch, tmp_path, shared_counters: str
+) -> None:
+    duecredit_file = str(tmp_path / "duecredit.p")
+    monkeypatch.setenv("DUECREDIT_ENABLE", "yes")
+    monkeypatch.setenv("DUECREDIT_SHARED_COUNTERS", shared_counters)
+    monkeypatch.setenv("DUECREDIT_FILE", duecredit_file)
+    monkeypatch.setenv("DUECREDIT_OUTPUTS", "pickle")
+    script = tmp_path / "script.py"
+    script.write_text(_fork_script)
+    ret, out, err = run_python_command(None, script=str(script))
+    assert ret == 0, err
+    # all the citations got merged by the parent, and shards removed
+    due = PickleOutput.load(duecredit_file)
+    assert due.citations[CitationKey("forking", "forked")].count == 1131
+    assert not os.path.exists(duecredit_file + ".d")
+
+
+_crash_script = """
+import os
+import signal
+import time
+
+from duecredit import Text, due
+
+for _ in range(10):
+    due.cite(Text("Crashed", key="crashed"), path="crashing")
+time.sleep(0.5)  # for the counts to get journaled
+os.kill(os.getpid(), signal.SIGKILL)
+"""
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires POSIX")
+def test_killed_process_citations(monkeypatch: MonkeyPatch, tmp_path) -> None:
+    duecredit_file = str(tmp_path / "duecredit.p")
+    monkeypatch.setenv("DUECREDIT_ENABLE", "yes")
+    monkeypatch.setenv("DUECREDIT_JOURNAL", "0.05")
+    monkeypatch.setenv("DUECREDIT_FILE", duecredit_file)
+    monkeypatch.setenv("DUECREDIT_OUTPUTS", "pickle")
+    script = tmp_path / "script.py"
+    script.write_text(_crash_script)
+    for _ in range(2):
+        ret, out, err = run_python_command(None, script=str(script))
+        assert ret == -9, err
+    assert not os.path.exists(duecredit_file)
+    # journals of both get folded upon the dump by the next process
+    ret, out, err = run_python_command(
+        "from duecredit import Text, due; "
+        "due.cite(Text('Crashed', key='crashed'), path='crashing')"
+    )
+    assert ret == 0, err
+    due = PickleOutput.load(duecredit_file)
+    assert due.citations[CitationKey("crashing", "crashed")].count == 21
+    assert not os.path.exists(duecredit_file + ".d")
+
+
+def test_import_is_cheap_if_not_enabled(monkeypatch: MonkeyPatch) -> None:
+    # With DUECREDIT_ENABLE off, importing duecredit must not pull in the
+    # machinery of the active collector
+    monkeypatch.delenv("DUECREDIT_ENABLE", raising=False)
+    ret, out, err = run_python_command(
+        "import sys, duecredit; "
+        "print(' '.join(m for m in sys.modules "
+        "if m in ('pickle', 'citeproc', 'requests') "
+        "or m.startswith(('duecredit.collector', 'duecredit.io', "
+        "'duecredit.versions', 'duecredit.injections'))))"
+    )
+    assert ret == 0
+    assert out.strip() == ""
+
+    # and overall cost of the import stays within the budget (microseconds)
+    budget = int(os.environ.get("DUECREDIT_TEST_IMPORT_BUDGET_US", 500000))
+    ret, out, err = run_python_command("import duecredit", options=["-X", "importtime"])
+    assert ret == 0
+    times = {}
+    for line in err.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    assert times["duecredit"] < budget
+
+
 if __name__ == "__main__":
     from duecredit import due
 
@@ -0,0 +1,309 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import os
+import sqlite3
+from unittest.mock import ANY
+
+import pytest
+
+import duecredit.io
+
+from .. import cache as cache_mod
+from ..cache import Cached, DoiCache, _parse_duration
+from ..cmdline import main
+from ..collector import DueCreditCollector
+from ..entries import BibTeX, Doi
+from ..io import BibTeXOutput, PickleOutput
+from ..snapshot import get_injection_dois, get_snapshot
+from .conftest import _bibtex, _DoiServer
+
+
+def _legacy_cache(cache_dir: str, bibtexs: dict[str, str]) -> None:
+    for doi, bibtex in bibtexs.items():
+        path = os.path.join(cache_dir, doi)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(bibtex)
+
+
+def test_doi_cache(tmp_path) -> None:
+    db = str(tmp_path / "sub" / "bibtex.db")
+    legacy_dir = str(tmp_path / "bibtex")
+    legacy = {"10.1/a": "@article{a}", "10.1016/j.x/1.2": "@article{b}"}
+    _legacy_cache(legacy_dir, legacy)
+
+    with DoiCache(db, legacy_dir=legacy_dir) as cache:
+        # imported as the database got created
+        assert len(cache) == 2
+        assert cache.get_many(["10.1016/j.x/1.2", "10.1/a", "10.1/c"]) == {
+            "10.1/a": "@article{a}",
+            "10.1016/j.x/1.2": "@article{b}",
+        }
+        assert cache.get("10.1/c") is None
+        cache.set("10.1/a", "@article{new}")
+        # more than a query could take
+        many = {f"10.2/{i}": f"@article{{{i}}}" for i in range(1234)}
+        cache.set_many(many)
+        assert cache.get_many(list(many) + ["10.1/c"]) == many
+        assert cache.get("10.1/a") == "@article{new}"
+
+    # imported only once, but could be explicitly re-imported
+    _legacy_cache(legacy_dir, {"10.1/c": "@article{c}"})
+    with DoiCache(db, legacy_dir=legacy_dir) as cache:
+        assert cache.get("10.1/c") is None
+        assert cache.migrate(legacy_dir) == 3
+        # without overriding what was cached already
+        assert cache.get_many(["10.1/a", "10.1/c"]) == {
+            "10.1/a": "@article{new}",
+            "10.1/c": "@article{c}",
+        }
+
+    # newer schemas are not understood
+    with sqlite3.connect(db) as conn:
+        conn.execute(f"PRAGMA user_version={cache_mod.SCHEMA_VERSION + 1}")
+    conn.close()
+    with pytest.raises(ValueError, match="Upgrade duecredit"):
+        DoiCache(db)
+
+
+def test_doi_cache_concurrent(tmp_path) -> None:
+    db = str(tmp_path / "bibtex.db")
+    legacy_dir = str(tmp_path / "bibtex")
+    _legacy_cache(legacy_dir, {f"10.1/{i}": "@article{x}" for i in range(50)})
+
+    def write(worker: int) -> None:
+        # as many processes would, each with its own connection
+        with DoiCache(db, legacy_dir=legacy_dir) as cache:
+            for i in range(20):
+                cache.set_many({f"10.{worker}/{i}": "@article{y}"})
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(write, range(2, 10)))
+    with DoiCache(db) as cache:
+        assert len(cache) == 50 + 8 * 20
+
+
+def test_doi_cache_expiry(tmp_path, monkeypatch) -> None:
+    now = [1000.0]
+    monkeypatch.setattr(cache_mod.time, "time", lambda: now[0])
+    db = str(tmp_path / "bibtex.db")
+    with DoiCache(db, ttl=100, negative_ttl=10, max_size=3) as cache:
+        cache.set_many({"10.1/a": "@a", "10.1/b": "@b"})
+        cache.set_failed({"10.1/c": "404", "10.1/a": "500"})
+        assert cache.lookup(["10.1/a", "10.1/b", "10.1/c", "10.1/d"]) == {
+            "10.1/a": Cached("@a", "500", 1000, True),
+            "10.1/b": Cached("@b", None, 1000, True),
+            "10.1/c": Cached(None, "404", 1000, True),
+        }
+        # failures expire sooner
+        now[0] = 1010
+        found = cache.lookup(["10.1/a", "10.1/b", "10.1/c"])
+        assert [c.fresh for c in found.values()] == [False, True, False]
+        now[0] = 1100
+        assert not cache.lookup(["10.1/b"])["10.1/b"].fresh
+        now[0] = 1150
+        cache.lookup(["10.1/a"])
+        assert cache.stats() == {
+            "hits": 2,
+            "negative_hits": 2,
+            "stale_hits": 4,
+            "misses": 1,
+            "evicted": 0,
+            "size": 3,
+            "failed": 2,
+            "stale": 1,
+        }
+
+        # least recently used get evicted
+        now[0] = 1200
+        cache.lookup(["10.1/c"])
+        now[0] = 1300
+        cache.set("10.1/d", "@d")
+        assert sorted(cache.get_many(["10.1/a", "10.1/b", "10.1/d"])) == [
+            "10.1/a",
+            "10.1/d",
+        ]
+        entries = cache.entries()
+        assert [doi for doi, _, _ in entries] == ["10.1/d", "10.1/c", "10.1/a"]
+        assert cache.stats()["evicted"] == 1
+
+        # expired failures are pruned, the others only on request
+        assert cache.prune() == 1
+        assert sorted(cache.get_many(["10.1/a", "10.1/c", "10.1/d"])) == [
+            "10.1/a",
+            "10.1/d",
+        ]
+        assert cache.prune(failed=True) == 0
+        assert cache.lookup(["10.1/a"])["10.1/a"] == Cached("@a", None, 0, False)
+        assert cache.prune(stale=True) == 1
+        assert cache.prune(max_size=0) == 0
+        cache.set("10.1/e", "@e")
+        assert cache.prune(max_size=1) == 1
+        assert [doi for doi, _, _ in cache.entries()] == ["10.1/e"]
+        assert cache.prune(everything=True) == 1
+        cache.reset_stats()
+        assert cache.stats()["misses"] == 0
+
+
+def test_doi_cache_locked(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(cache_mod, "_BUSY_WAIT", 0)
+    db = str(tmp_path / "bibtex.db")
+    with DoiCache(db) as cache:
+        cache.set("10.1/a", "@a")
+        cache._db.execute("PRAGMA busy_timeout=0")
+        # another process is writing, so the database could be only read
+        other = sqlite3.connect(db, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        other.execute("DELETE FROM stats")
+        try:
+            assert cache.lookup(["10.1/a"]) == {"10.1/a": Cached("@a", None, ANY, True)}
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        # but those could not be counted
+        assert cache.stats()["hits"] == 0
+
+        # locked just for a moment
+        select = cache._select
+        calls = []
+
+        def locked_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return select(*args)
+
+        monkeypatch.setattr(cache, "_select", locked_once)
+        assert list(cache.lookup(["10.1/a"])) == ["10.1/a"]
+        assert len(calls) == 2
+        assert cache.stats()["hits"] == 1
+
+
+def test_cmd_cache(tmp_path, capsys) -> None:
+    db = str(tmp_path / "bibtex.db")
+    assert main.main(["cache", "-f", db]) is None
+    assert capsys.readouterr().out == f"Cache {db} does not exist\n"
+    with DoiCache(db, max_size=0) as cache:
+        cache.set_many({"10.1/a": "@article{a}", "10.1/b": "@article{b}"})
+        cache.set_failed({"10.1/c": "404"})
+        cache.lookup(["10.1/a", "10.1/b", "10.1/c", "10.1/d"])
+
+    main.main(["cache", "-f", db, "--reset"])
+    out = capsys.readouterr().out.splitlines()
+    assert out[1:] == [
+        "DOIs: 3 (1 failed, 0 stale)",
+        "Lookups: 4",
+        "  hits: 2 (50.0%)",
+        "  failures: 1",
+        "  stale: 0",
+        "  misses: 1",
+        "Evicted: 0",
+    ]
+    main.main(["cache", "-f", db])
+    assert "Lookups: 0" in capsys.readouterr().out.splitlines()
+
+    main.main(["cache", "show", "-f", db])
+    out = capsys.readouterr().out.splitlines()
+    assert sorted(line.split()[:2] for line in out) == [
+        ["10.1/a", "ok"],
+        ["10.1/b", "ok"],
+        ["10.1/c", "failed"],
+    ]
+    main.main(["cache", "show", "10.1/b", "10.1/c", "-f", db])
+    assert capsys.readouterr().out == "@article{b}\n% 10.1/c is not cached\n"
+
+    main.main(["cache", "prune", "--failed", "--max-size", "1", "-f", db])
+    assert capsys.readouterr().out == "Pruned 2 DOIs, 1 remain\n"
+
+
+def test_cmd_cache_warm(
+    doi_server: _DoiServer, tmp_path, monkeypatch, capsys
+) -> None:
+    monkeypatch.setattr(duecredit.io.time, "sleep", lambda _: None)
+    db = str(tmp_path / "bibtex.db")
+    fn = str(tmp_path / ".duecredit.p")
+    collector = DueCreditCollector()
+    for i in range(10):
+        collector.cite(Doi(f"10.1/{i}"), path="mod")
+    collector.cite(BibTeX("@article{x, doi={10.2/bib}}"), path="mod")
+    PickleOutput(collector, fn=fn).dump()
+    bib = tmp_path / "refs.bib"
+    bib.write_text(
+        '@article{a,\n  DOI = {10.2/a},\n}\n@book{b, doi = "10.1/3"}\n@misc{c}\n'
+    )
+    for doi in [f"10.1/{i}" for i in range(10)] + ["10.2/a"]:
+        doi_server.add(doi, (200, {}, _bibtex(doi)))
+    doi_server.add("10.1/9", (404, {}, ""))
+    doi_server.delay = 0.05
+    with DoiCache(db) as cache:
+        cache.set("10.1/0", _bibtex("10.1/0"))
+
+    main.main(["cache", "warm", fn, str(bib), "-f", db, "-j", "4", "--no-injections"])
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "11 DOIs: 0 in the snapshot, 1 cached, 10 to fetch"
+    assert out[1].startswith("Fetched BibTeX for 9 DOIs in ")
+    assert out[2].startswith("Failed to fetch BibTeX for 10.1/9: ")
+    assert doi_server.max_active == 4
+    with DoiCache(db) as cache:
+        assert cache.stats()["misses"] == 0
+    # all of them would be taken from the cache now, looked up once per report
+    doi_server.requests.clear()
+    collector = DueCreditCollector()
+    for i in range(10):
+        collector.cite(Doi(f"10.1/{i}"), path=f"mod{i}", cite_module=True)
+    out_bib = StringIO()
+    BibTeXOutput(out_bib, collector).dump(tags=["*"])
+    assert out_bib.getvalue().count("@article") == 9
+    assert not doi_server.requests
+    cache = duecredit.io._get_doi_cache()
+    assert cache is not None
+    stats = cache.stats()
+    assert (stats["hits"], stats["negative_hits"]) == (9, 1)
+
+    # and of the injections, unless they are in the snapshot
+    main.main(["cache", "warm", "-f", db])
+    out = capsys.readouterr().out.splitlines()
+    dois = get_injection_dois()
+    n_snapshot = len(set(dois) & set(get_snapshot()))
+    assert out[0] == (
+        f"{len(dois)} DOIs: {n_snapshot} in the snapshot, 0 cached, "
+        f"{len(dois) - n_snapshot} to fetch"
+    )
+
+
+def test_io_doi_cache(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(duecredit.io, "CACHE_DIR", str(tmp_path / "bibtex"))
+    monkeypatch.setattr(duecredit.io, "DOI_CACHE_FILE", str(tmp_path / "bibtex.db"))
+    assert duecredit.io._lookup_cached(["10.1/a"]) == {}
+    duecredit.io._cache_bibtexs({"10.1/a": "@article{a}"}, {"10.1/b": "404"}, {})
+    assert duecredit.io.import_doi("10.1/a") == "@article{a}"
+    assert duecredit.io.import_dois(["10.1/a", "10.1/b"]) == {
+        "10.1/a": "@article{a}"
+    }
+    # nothing but the database
+    assert os.listdir(tmp_path) == ["bibtex.db"]
+
+    # goes on uncached if the cache is not usable
+    monkeypatch.setattr(duecredit.io, "DOI_CACHE_FILE", str(tmp_path))
+    assert duecredit.io._get_doi_cache() is None
+    assert duecredit.io._lookup_cached(["10.1/a"]) == {}
+    duecredit.io._cache_bibtexs({"10.1/a": "@article{a}"}, {}, {})
+
+
+def test_parse_duration() -> None:
+    assert _parse_duration("30") == 30
+    assert _parse_duration("1.5h") == 5400
+    assert _parse_duration("90d") == 90 * 86400
+    for value in ("", "-1d", "1w"):
+        with pytest.raises(ValueError):
+            _parse_duration(value)
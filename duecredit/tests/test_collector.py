@@ -8,14 +8,25 @@
 # ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 import functools
 import operator
 import os
+import pickle
+import sys
+import threading
 from typing import TYPE_CHECKING, Any
+import weakref
 
 import pytest
 
-from ..collector import Citation, CitationKey, CollectorSummary, DueCreditCollector
+from ..collector import (
+    Citation,
+    CitationKey,
+    CollectorSummary,
+    DueCreditCollector,
+    _compile_conditions,
+)
 from ..dueswitch import DueSwitch
 from ..entries import BibTeX, Doi
 from ..io import PickleOutput
@@ -215,6 +226,72 @@ def test_args_match_conditions() -> None:
     )
 
 
+def test_compile_conditions_signature() -> None:
+    def func(data, meth="single", *, opt=None):
+        pass
+
+    def func_posonly(data, meth="single", /):
+        pass
+
+    conds = {(1, "method"): {"ward"}}
+    # the name in conditions does not match the one in the signature
+    match = _compile_conditions(conds, func)
+    assert match((None, "ward"), {})
+    assert match((None,), {"meth": "ward"})
+    assert match((None,), {"method": "ward"})
+    assert not match((None,), {"meth": "single"})
+    assert not match((None,), {})
+    # positional-only could not be passed by name
+    match = _compile_conditions(conds, func_posonly)
+    assert match((None, "ward"), {})
+    assert not match((None,), {"method": "ward"})
+    # without func we know only the name given in conditions
+    match = _compile_conditions(conds)
+    assert match((None,), {"method": "ward"})
+    assert not match((None,), {"meth": "ward"})
+
+
+def test_compile_conditions_unhashable() -> None:
+    match = _compile_conditions({(1, "method"): {"ward", "DC_DEFAULT"}})
+    assert not match((1, ["ward"]), {})
+    assert match(([1],), {"method": "ward"})
+    match = _compile_conditions(
+        {(1, "method"): {"ward", "DC_DEFAULT"}, (0, "data"): {1}}
+    )
+    assert not match((1, ["ward"]), {})
+    assert not match(([1],), {"method": "ward"})
+    assert match((1,), {})
+
+
+def test_compile_conditions_memoized() -> None:
+    class Obj:
+        def __init__(self, param) -> None:
+            self.param = param
+
+    match = _compile_conditions(
+        {(0, "self.param"): {"magic"}, (1, "method"): {"ward", "DC_DEFAULT"}}
+    )
+    obj = Obj("magic")
+    for _ in range(3):
+        assert match((obj,), {})
+        assert match((obj, "ward"), {})
+        assert not match((obj, "single"), {})
+    info = match.cache_info()
+    assert (info.misses, info.hits) == (3, 6)
+    # the state of the object is still considered
+    obj.param = "other"
+    assert not match((obj,), {})
+    # nor are values of other than primitive types, which are not kept alive
+    obj.param = ["magic"]
+    assert not match((obj,), {})
+    obj.param = Obj("magic")
+    assert not match((obj,), {})
+    param = weakref.ref(obj.param)
+    obj.param = "other"
+    assert param() is None
+    assert match.cache_info().misses == 4
+
+
 def _test_dcite_match_conditions(due, func, path: str) -> None:
     assert due.citations == {}
     assert len(due._entries) == 1
@@ -265,6 +342,46 @@ def test_dcite_match_conditions_function() -> None:
     _test_dcite_match_conditions(due, method, "callable")
 
 
+def test_dcite_conditions_compiled_once(monkeypatch) -> None:
+    from .. import collector as collector_mod
+
+    compiled = []
+
+    def compile_conditions(conditions, func=None):
+        compiled.append(func)
+        return _compile_conditions(conditions, func)
+
+    monkeypatch.setattr(collector_mod, "_compile_conditions", compile_conditions)
+    collector_mod._compile_frozen_conditions.cache_clear()
+    due = DueCreditCollector()
+    due.add(BibTeX(_sample_bibtex))
+    dcite = due.dcite("XXX0", path="callable", conditions={(0, "arg"): {"yes"}})
+
+    @dcite
+    def func(arg: str) -> str:
+        return arg
+
+    @dcite
+    def func2(arg: str) -> str:
+        return arg
+
+    # when decorated, and not upon the calls
+    assert compiled == [func.__duecredited__, func2.__duecredited__]
+    for f in (func, func2) * 10:
+        f("yes")
+        f("no")
+    assert len(compiled) == 2
+    # and the conditions apply to every function decorated
+    assert due.citations[("callable", "XXX0")].count == 20
+
+    # and matched without compiling the same conditions again
+    conds = {(1, "method"): {"purge", "DC_DEFAULT"}}
+    for _ in range(10):
+        assert DueCreditCollector._args_match_conditions(conds, None, "purge")
+    assert not DueCreditCollector._args_match_conditions(conds, None, "push")
+    assert len(compiled) == 3
+
+
 def test_dcite_match_conditions_method() -> None:
     due = DueCreditCollector()
     due.add(BibTeX(_sample_bibtex))
@@ -295,6 +412,221 @@ def test_dcite_match_conditions_method() -> None:
     # now test for self.param -
 
 
+@pytest.mark.parametrize(
+    "counting, ncalls, count",
+    [
+        ("exact", 7, 7),
+        ("first", 7, 1),
+        ("sampled:3", 7, 7),
+        ("sampled:3", 5, 4),
+        ("sampled:1", 5, 5),
+    ],
+)
+def test_dcite_counting(counting: str, ncalls: int, count: int) -> None:
+    due = DueCreditCollector(counting=counting)
+    due.add(BibTeX(_sample_bibtex))
+
+    @due.dcite("XXX0", path="method")
+    def method(arg: int) -> int:
+        return arg + 1
+
+    for i in range(ncalls):
+        assert method(i) == i + 1
+    assert due.citations[CitationKey("method", "XXX0")].count == count
+    assert method.__duecredit_retired__ == (counting == "first")
+
+
+def test_dcite_counting_first_conditions() -> None:
+    due = DueCreditCollector(counting="first")
+    due.add(BibTeX(_sample_bibtex))
+
+    @due.dcite("XXX0", path="method", conditions={(0, "arg"): {"cite"}})
+    def method(arg: str) -> str:
+        return arg
+
+    assert method("nocite") == "nocite"
+    assert not method.__duecredit_retired__
+    assert due.citations == {}
+    assert method(arg="cite") == "cite"
+    assert method.__duecredit_retired__
+    assert method("cite") == "cite"
+    assert due.citations[CitationKey("method", "XXX0")].count == 1
+
+
+def test_dcite_cached_citation() -> None:
+    due = DueCreditCollector()
+    due.add(BibTeX(_sample_bibtex))
+
+    @due.dcite("XXX0", path="method")
+    def method(arg: int) -> int:
+        return arg + 1
+
+    method(1)
+    citation = due.citations[CitationKey("method", "XXX0")]
+    method(2)
+    assert citation.count == 2
+    # citations were replaced (e.g. reset or loaded) -- cached one is not used
+    due.citations = {}
+    method(3)
+    assert citation.count == 2
+    assert due.citations[CitationKey("method", "XXX0")].count == 1
+    assert due.citations[CitationKey("method", "XXX0")] is not citation
+
+
+def test_lazy_entry() -> None:
+    due = DueCreditCollector()
+    factory = BibTeX.lazy(_sample_bibtex)
+
+    @due.dcite(factory, path="method")
+    def method(arg: int) -> int:
+        return arg + 1
+
+    # nothing is created until cited
+    assert factory._entry is None
+    assert not due._entries
+    assert method(1) == 2
+    assert list(due._entries) == ["XXX0"]
+    assert due._entries["XXX0"] is factory()
+    due.citations = {}
+    method(2)
+    assert due.citations[CitationKey("method", "XXX0")].count == 1
+
+    # plain callables are accepted as well
+    due.cite(lambda: Doi("1.2.3/x.y.z", key="XXX1"), path="module")
+    assert due.citations[CitationKey("module", "XXX1")].entry.doi == "1.2.3/x.y.z"
+    # but must return an entry
+    due.cite(lambda: None, path="module")
+    assert len(due.citations) == 2
+
+
+def test_counting_threads() -> None:
+    due = DueCreditCollector()
+    due.add(BibTeX(_sample_bibtex))
+
+    @due.dcite("XXX0", path="method")
+    def method(arg: int) -> int:
+        return arg + 1
+
+    nthreads, ncalls = 8, 2000
+
+    def work(_i: int) -> None:
+        for i in range(ncalls):
+            method(i)
+            due.cite("XXX0", path="module")
+
+    switchinterval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # provoke as many thread switches as possible
+    try:
+        with ThreadPoolExecutor(nthreads) as executor:
+            list(executor.map(work, range(nthreads)))
+    finally:
+        sys.setswitchinterval(switchinterval)
+
+    assert len(due.citations) == 2
+    for path in ("method", "module"):
+        assert due.citations[CitationKey(path, "XXX0")].count == nthreads * ncalls
+
+
+def test_citation_count_pickle() -> None:
+    citation = Citation(BibTeX(_sample_bibtex), path="module")
+    citation._increment()
+    citation._increment(2)
+    assert citation.count == 3
+    citation_ = pickle.loads(pickle.dumps(citation))
+    assert citation_.count == 3
+    assert citation_._shards == {}
+    citation_.count = 1
+    citation_._increment()
+    assert citation_.count == 2
+    # state pickled by older versions
+    state = citation.__getstate__()
+    state["count"] = state.pop("_count")
+    del state["_shards"]
+    citation_ = Citation.__new__(Citation)
+    citation_.__setstate__(state)
+    assert citation_.count == 3
+
+
+def test_dcite_fast_path(monkeypatch) -> None:
+    # calls of a dcite'd function after the first one must not go through the
+    # full cite(), but only increment the count of the citation
+    due = DueCreditCollector()
+    due.add(BibTeX(_sample_bibtex))
+    cited = []
+
+    def cite(*args: Any, **kwargs: Any) -> Citation | None:
+        cited.append(args)
+        return DueCreditCollector.cite(due, *args, **kwargs)
+
+    monkeypatch.setattr(due, "cite", cite)
+
+    @due.dcite("XXX0", path="duecredit.tests:func")
+    def func(arg: int) -> int:
+        return arg
+
+    assert [func(i) for i in range(100)] == list(range(100))
+    assert len(cited) == 1
+    citation = due.citations[CitationKey("duecredit.tests:func", "XXX0")]
+    assert list(citation._shards) == [threading.get_ident()]
+    # by every thread into its own shard
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(func, range(400)))
+    assert len(cited) == 1
+    assert citation.count == 500
+
+    # and straight into shared memory, skipping the shards, if counted there
+    due._enable_shared_counters(max_ids=8, max_rows=4)
+    try:
+        citation.count = 0
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(func, range(400)))
+        assert citation._shards == {}
+        assert citation.count == 400
+    finally:
+        due._release_shared_counters()
+    assert len(cited) == 1
+    assert citation.count == 400
+
+
+def test_resolve_versions(monkeypatch) -> None:
+    from .. import collector as collector_mod
+
+    queried: list[str] = []
+
+    class Versions:
+        def __getitem__(self, package: str) -> str:
+            queried.append(package)
+            return f"{package}-1.0"
+
+    monkeypatch.setattr(collector_mod, "external_versions", Versions())
+    due = DueCreditCollector()
+    due.add(BibTeX(_sample_bibtex))
+    due.cite("XXX0", path="pkg1.mod:func")
+    due.cite("XXX0", path="pkg1")
+    due.cite("XXX0", path="pkg2:func")
+    due.cite("XXX0", path="pkg3", version="0.1")
+    # nothing is resolved upon citation
+    assert queried == []
+    assert due.citations[CitationKey("pkg1", "XXX0")].version is None
+
+    due._resolve_versions()
+    assert queried == ["pkg1", "pkg2"]  # once per package
+    assert {k.path: c.version for k, c in due.citations.items()} == {
+        "pkg1.mod:func": "pkg1-1.0",
+        "pkg1": "pkg1-1.0",
+        "pkg2:func": "pkg2-1.0",
+        "pkg3": "0.1",
+    }
+    due._resolve_versions()
+    assert len(queried) == 2
+
+
+@pytest.mark.parametrize("counting", ["bogus", "sampled", "sampled:0", "first:2"])
+def test_counting_invalid(counting: str) -> None:
+    with pytest.raises(ValueError):
+        DueCreditCollector(counting=counting)
+
+
 def test_get_output_handler_method(tmpdir: py.path.local, monkeypatch) -> None:
     tempfile = str(tmpdir.mkdir("sub").join("tempfile.txt"))
     monkeypatch.setitem(os.environ, "DUECREDIT_OUTPUTS", "pickle")
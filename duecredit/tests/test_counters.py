@@ -0,0 +1,89 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+from __future__ import annotations
+
+import os
+import threading
+
+import pytest
+
+from ..collector import CitationKey, DueCreditCollector
+from ..counters import SharedCounters
+from ..entries import Text
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+
+
+def _in_forked(func, *args) -> None:
+    """Run func in a forked process, which then crashes"""
+    pid = os.fork()
+    if not pid:
+        try:
+            func(*args)
+        finally:
+            os._exit(0)  # without any cleanup, as if crashed
+    os.waitpid(pid, 0)
+
+
+def test_shared_counters() -> None:
+    counters = SharedCounters(max_ids=4, max_rows=3)
+    try:
+        assert counters.increment(1)
+        assert counters.increment(1, 2)
+        _in_forked(counters.increment, 1, 10)
+        assert counters.total(1) == 13
+        assert counters.total(0) == 0
+        # a thread gets a row of its own, and then rows are exhausted
+        results: list[bool] = []
+        for _ in range(2):
+            thread = threading.Thread(
+                target=lambda: results.append(counters.increment(0))
+            )
+            thread.start()
+            thread.join()
+        assert results == [True, False]
+        assert counters.total(0) == 1
+    finally:
+        counters.close()
+    assert not counters.increment(1)
+    assert counters.total(1) == 0
+
+
+def test_collector_shared_counters() -> None:
+    due = DueCreditCollector()
+    entry = Text("Shared", key="shared")
+    due.cite(entry, path="before")
+    due._enable_shared_counters(max_ids=8, max_rows=4)
+
+    @due.dcite(entry, path="method")
+    def method() -> None:
+        pass
+
+    def cite_in_child(n: int) -> None:
+        due._after_fork()
+        for _ in range(n):
+            method()
+            due.cite(entry, path="before")
+        # not known to the parent -- counted locally
+        due.cite(entry, path="child")
+
+    try:
+        method()
+        _in_forked(cite_in_child, 5)
+        _in_forked(cite_in_child, 7)
+        # live totals, including those of the "crashed" children
+        counts = {k.path: c.count for k, c in due.citations.items()}
+        assert counts == {"before": 13, "method": 13}
+    finally:
+        due._release_shared_counters()
+    citation = due.citations[CitationKey("method", "shared")]
+    assert citation._shared is None
+    assert citation.count == 13
+    method()
+    assert citation.count == 14
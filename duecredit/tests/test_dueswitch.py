@@ -9,6 +9,7 @@
 from __future__ import annotations
 
 import atexit
+import os
 from typing import Any
 
 import pytest
@@ -39,6 +40,7 @@ def test_dueswitch_activate(monkeypatch: MonkeyPatch) -> None:
         state["register_func"] = func
 
     monkeypatch.setattr(atexit, "register", register)
+    monkeypatch.setattr(os, "register_at_fork", lambda **_kw: None, raising=False)
 
     due.activate()
 
@@ -53,3 +55,59 @@ def test_a_bad_one() -> None:
     # see https://github.com/duecredit/duecredit/issues/142
     # So let's through ValueError right away
     pytest.raises(ValueError, DueSwitch, None, None, True)
+
+
+def test_active_factory(monkeypatch: MonkeyPatch) -> None:
+    from ..collector import DueCreditCollector
+    from ..entries import Text
+    from ..stub import InactiveDueCreditCollector
+
+    monkeypatch.setattr(DueCreditInjector, "activate", lambda *_a, **_kw: None)
+    monkeypatch.setattr(atexit, "register", lambda _func: None)
+    monkeypatch.setattr(os, "register_at_fork", lambda **_kw: None, raising=False)
+
+    created = []
+
+    def factory() -> DueCreditCollector:
+        created.append(DueCreditCollector())
+        return created[-1]
+
+    switch = DueSwitch(InactiveDueCreditCollector(), factory, False)
+    # nothing is created until activated
+    assert not created
+    switch.activate()
+    assert len(created) == 1
+    assert switch.active
+    switch.cite(Text("XXX0", key="XXX0"), path="test")
+    assert created[0].citations
+    # and only once
+    switch.activate(False)
+    switch.activate()
+    assert len(created) == 1
+
+    # failing factory leaves us inactive
+    switch = DueSwitch(InactiveDueCreditCollector(), lambda: None, False)
+    switch.activate()
+    assert not switch.active
+
+
+@pytest.mark.parametrize("activate_later", [False, True])
+def test_active_factory_fails(activate_later: bool) -> None:
+    from ..entries import Text
+    from ..stub import InactiveDueCreditCollector
+
+    def factory() -> None:
+        raise ImportError("no collector today")
+
+    switch = DueSwitch(InactiveDueCreditCollector(), factory, not activate_later)
+    if activate_later:
+        switch.activate()
+    assert not switch.active
+    # citing still works, doing nothing
+    switch.cite(Text("XXX0", key="XXX0"), path="test")
+
+    @switch.dcite(Text("XXX0", key="XXX0"), path="test")
+    def func(x: int) -> int:
+        return x + 1
+
+    assert func(1) == 2
@@ -6,7 +6,7 @@
 #
 # ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
-from ..entries import Doi, Text, Url
+from ..entries import BibTeX, Doi, Text, Url
 
 
 def test_comparison() -> None:
@@ -23,3 +23,22 @@ def test_comparison() -> None:
 def test_sugaring_api() -> None:
     assert Url("http://1.com").url == "http://1.com"
     assert Doi("1.com").doi == "1.com"
+
+
+def test_lazy(monkeypatch) -> None:
+    parsed = []
+    orig_process_rawentry = BibTeX._process_rawentry
+
+    def process_rawentry(self) -> None:
+        parsed.append(self._rawentry)
+        orig_process_rawentry(self)
+
+    monkeypatch.setattr(BibTeX, "_process_rawentry", process_rawentry)
+    factory = BibTeX.lazy("@article{XXX0, title={...}}")
+    assert not parsed
+    assert repr(factory) == "BibTeX.lazy('@article{XXX0, title={...}}')"
+    entry = factory()
+    assert entry == BibTeX("@article{XXX0, title={...}}")
+    assert entry.key == "XXX0"
+    assert factory() is entry
+    assert Doi.lazy("1.com", key="k")() == Doi("1.com", key="k")
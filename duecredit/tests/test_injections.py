@@ -12,6 +12,8 @@ import builtins as __builtin__
 import gc
 from logging import getLogger
 import sys
+import threading
+from types import ModuleType, SimpleNamespace
 from typing import Any
 
 import pytest
@@ -21,8 +23,11 @@ from duecredit.entries import Doi
 from duecredit.tests import mod
 
 from .. import __version__
+from ..injections import injector as injector_mod
 from ..injections.injector import (
     DueCreditInjector,
+    _DueCreditLoader,
+    _DueCreditMetaPathFinder,
     find_object,
     get_modules_for_injection,
 )
@@ -40,11 +45,13 @@ lgr = getLogger("duecredit.tests.injector")
 
 
 class TestActiveInjector:
+    engine = "import"
+
     def setup_method(self) -> None:
         lgr.log(5, "Setting up for a TestActiveInjector test")
         self._cleanup_modules()
         self.due = DueCreditCollector()
-        self.injector = DueCreditInjector(collector=self.due)
+        self.injector = DueCreditInjector(collector=self.due, engine=self.engine)
         self.injector.activate(retrospect=False)  # numpy might be already loaded...
 
     def teardown_method(self) -> None:
@@ -53,6 +60,9 @@ class TestActiveInjector:
         # so we will always deactivate explicitly
         self.injector.deactivate()
         assert __builtin__.__import__ is _orig__import__
+        assert not any(
+            isinstance(f, _DueCreditMetaPathFinder) for f in sys.meta_path
+        )
         self._cleanup_modules()
 
     def _cleanup_modules(self) -> None:
@@ -97,6 +107,9 @@ class TestActiveInjector:
         assert len(self.due.citations) == 1
 
         citation = next(iter(self.due.citations.values()))
+        # versions are resolved only when needed, e.g. before dumping
+        assert citation.version is None
+        self.due._resolve_versions()
         # TODO: ATM we don't allow versioning of the submodules -- we should
         # assert_equal(citation.version, '0.5')
         # ATM it will be the duecredit's version
@@ -153,6 +166,7 @@ class TestActiveInjector:
         assert len(self.due.citations) == 2
 
         citation = next(iter(self.due.citations.values()))
+        self.due._resolve_versions()
         # TODO: ATM we don't allow versioning of the submodules -- we should
         # assert_equal(citation.version, '0.5')
         # ATM it will be the duecredit's version
@@ -180,6 +194,23 @@ class TestActiveInjector:
     def test_double_injection(self, func, import_stmt, func_call) -> None:
         self._test_double_injection(func, import_stmt, func_call)
 
+    def test_counting_first_rebinds_original(self) -> None:
+        self.due._counting = ("first", 1)
+        self.injector.add("duecredit.tests.mod", "testfunc1", Doi("1.2.3.4"))
+        self.injector.add("duecredit.tests.mod", "testfunc1", Doi("1.2.3.5"))
+        exec("from duecredit.tests.mod import testfunc1", {}, {})
+        mod = sys.modules["duecredit.tests.mod"]
+        decorated = mod.testfunc1
+        orig = decorated.__duecredited__.__duecredited__
+        assert not hasattr(orig, "__duecredited__")
+
+        assert mod.testfunc1(1) == "testfunc1: 1, None"
+        assert len(self.due.citations) == 2
+        # both wrappers retired and the original function was bound back
+        assert mod.testfunc1 is orig
+        assert decorated(2) == "testfunc1: 2, None"
+        assert [c.count for c in self.due.citations.values()] == [1, 1]
+
     def test_delayed_entries(self) -> None:
         # verify that addition of delayed injections happened
         modules_for_injection = get_modules_for_injection()
@@ -220,6 +251,31 @@ class TestActiveInjector:
         self._test_incorrect_path(mod, obj)
 
 
+class TestActiveInjectorMetaPath(TestActiveInjector):
+    engine = "meta_path"
+
+    def test_loader_is_not_exposed(self) -> None:
+        self.injector.add("duecredit.tests.mod", "testfunc1", Doi("1.2.3.4"))
+        exec("from duecredit.tests.mod import testfunc1", {}, {})
+        mod = sys.modules["duecredit.tests.mod"]
+
+        assert mod.testfunc1.__duecredited__
+        assert not isinstance(mod.__loader__, _DueCreditLoader)
+        assert not isinstance(mod.__spec__.loader, _DueCreditLoader)
+
+    def test_unrelated_imports_are_not_hooked(self) -> None:
+        import duecredit.tests
+
+        finder = self.injector._finder
+        assert finder is not None
+        path = duecredit.tests.__path__
+        assert finder.find_spec("duecredit.tests.mod", path) is None
+        self.injector.add("duecredit.tests.mod", "testfunc1", Doi("1.2.3.4"))
+        spec = finder.find_spec("duecredit.tests.mod", path)
+        assert spec is not None
+        assert isinstance(spec.loader, _DueCreditLoader)
+
+
 def test_find_iobject() -> None:
     assert find_object(mod, "testfunc1") == (mod, "testfunc1", mod.testfunc1)
     assert find_object(mod, "TestClass1") == (mod, "TestClass1", mod.TestClass1)
@@ -239,7 +295,7 @@ def test_no_double_activation() -> None:
     orig__import__ = __builtin__.__import__
     try:
         due = DueCreditCollector()
-        injector = DueCreditInjector(collector=due)
+        injector = DueCreditInjector(collector=due, engine="import")
         injector.activate()
         assert __builtin__.__import__ is not orig__import__
         duecredited__import__ = __builtin__.__import__
@@ -253,6 +309,25 @@ def test_no_double_activation() -> None:
         __builtin__.__import__ = orig__import__
 
 
+def test_no_double_activation_meta_path() -> None:
+    orig_meta_path = sys.meta_path[:]
+    injector = DueCreditInjector(collector=DueCreditCollector(), engine="meta_path")
+    try:
+        injector.activate(retrospect=False)
+        assert __builtin__.__import__ is _orig__import__  # no longer wrapped
+        assert sys.meta_path[0] is injector._finder
+        injector.activate(retrospect=False)
+        assert len(sys.meta_path) == len(orig_meta_path) + 1
+    finally:
+        injector.deactivate()
+    assert sys.meta_path == orig_meta_path
+
+
+def test_unknown_engine() -> None:
+    with pytest.raises(ValueError):
+        DueCreditInjector(collector=DueCreditCollector(), engine="bogus")
+
+
 def test_get_modules_for_injection() -> None:
     # output order is sorted by name (not that it matters for functionality)
     assert get_modules_for_injection() == [
@@ -294,10 +369,10 @@ def test_injector_del() -> None:
     orig__import__ = __builtin__.__import__
     try:
         due = DueCreditCollector()
-        inj = DueCreditInjector(collector=due)
+        inj = DueCreditInjector(collector=due, engine="import")
         del inj  # delete inactive
         assert __builtin__.__import__ is orig__import__
-        inj = DueCreditInjector(collector=due)
+        inj = DueCreditInjector(collector=due, engine="import")
         inj.activate(retrospect=False)
         assert __builtin__.__import__ is not orig__import__
         assert inj._orig_import is not None
@@ -321,7 +396,7 @@ def test_injector_delayed_del() -> None:
     try:
         due = DueCreditCollector()
 
-        inj = DueCreditInjector(collector=due)
+        inj = DueCreditInjector(collector=due, engine="import")
         inj.activate(retrospect=False)
         assert __builtin__.__import__ is not orig__import__
         assert inj._orig_import is not None
@@ -330,7 +405,7 @@ def test_injector_delayed_del() -> None:
         assert inj._orig_import is None
 
         # create 2nd one
-        inj2 = DueCreditInjector(collector=due)
+        inj2 = DueCreditInjector(collector=due, engine="import")
         inj2.activate(retrospect=False)
         assert __builtin__.__import__ is not orig__import__
         assert inj2._orig_import is not None
@@ -346,3 +421,151 @@ def test_injector_delayed_del() -> None:
         import abc  # noqa: F401   # and new imports work just fine
     finally:
         __builtin__.__import__ = orig__import__
+
+
+@pytest.mark.parametrize("engine", ["import", "meta_path"])
+def test_concurrent_imports(tmp_path, monkeypatch, engine: str) -> None:
+    # modules imported concurrently by multiple threads must all get processed
+    nthreads = 8
+    names = [f"_duecredit_test_thread{i}" for i in range(nthreads)]
+    for i, name in enumerate(names):
+        pkg = tmp_path / name
+        pkg.mkdir()
+        # nested import, taking its time, so imports of the threads interleave
+        (pkg / "__init__.py").write_text(
+            "import time\n"
+            "time.sleep(0.05)\n"
+            f"from {name}.sub import func\n"
+        )
+        (pkg / "sub.py").write_text(f"def func():\n    return {i}\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    due = DueCreditCollector()
+    injector = DueCreditInjector(collector=due, engine=engine)
+    for name in names:
+        injector.add(f"{name}.sub", "func", Doi(f"1.2.3/{name}"))
+    injector.activate(retrospect=False)
+    errors: list[BaseException] = []
+
+    def import_and_call(name: str) -> None:
+        try:
+            # as an import statement would, so it is seen by the "import" engine
+            mod = __builtin__.__import__(f"{name}.sub", fromlist=["func"])
+            mod.func()
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=import_and_call, args=(n,)) for n in names]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        injector.deactivate()
+        for name in names:
+            sys.modules.pop(name, None)
+            sys.modules.pop(f"{name}.sub", None)
+    assert not errors
+    assert sorted(c.entry.key for c in due.citations.values()) == sorted(
+        f"1.2.3/{name}" for name in names
+    )
+
+
+class _CountingModules(dict):
+    """Stand-in for sys.modules, counting the names visited when iterated"""
+
+    visited = 0
+
+    def __iter__(self):
+        for name in super().__iter__():
+            self.visited += 1
+            yield name
+
+    def __reversed__(self):
+        for name in super().__reversed__():
+            self.visited += 1
+            yield name
+
+
+def _count_fresh_imports_visits(monkeypatch, loaded: int, imported: int) -> int:
+    """Names visited to detect modules imported one at a time"""
+    modules = _CountingModules(
+        (f"_duecredit_loaded_{i}", ModuleType("loaded")) for i in range(loaded)
+    )
+    monkeypatch.setattr(injector_mod, "sys", SimpleNamespace(modules=modules))
+    injector = DueCreditInjector(collector=DueCreditCollector(), engine="import")
+    injector._get_fresh_imports()  # initial full scan
+    modules.visited = 0
+    for i in range(imported):
+        name = f"_duecredit_imported_{i}"
+        modules[name] = ModuleType(name)
+        assert injector._get_fresh_imports() == [name]
+    return modules.visited
+
+
+def test_fresh_imports_scale_linearly(monkeypatch) -> None:
+    # Cost of detecting freshly imported modules should be linear in the
+    # number of imported modules, and not grow with the size of sys.modules
+    # as it would with a set difference on every import
+    visited = _count_fresh_imports_visits(monkeypatch, 100, 50)
+    # the fresh one and the last seen one before it, and then the fresh one
+    # again to remember it as the last seen
+    assert visited == 3 * 50
+    assert _count_fresh_imports_visits(monkeypatch, 10000, 50) == visited
+    assert _count_fresh_imports_visits(monkeypatch, 100, 200) == 4 * visited
+
+
+def test_fresh_imports_removed_modules() -> None:
+    injector = DueCreditInjector(collector=DueCreditCollector(), engine="import")
+    assert set(injector._get_fresh_imports()) == set(sys.modules)
+    assert injector._get_fresh_imports() == []
+    names = ["_duecredit_test_fresh1", "_duecredit_test_fresh2"]
+    try:
+        for name in names:
+            sys.modules[name] = ModuleType(name)
+        assert injector._get_fresh_imports() == names[::-1]
+        # removal of the last seen one followed by a new import
+        sys.modules.pop(names[1])
+        sys.modules[names[1] + "b"] = ModuleType(names[1] + "b")
+        assert injector._get_fresh_imports() == [names[1] + "b"]
+        # removal of another one
+        sys.modules.pop(names[0])
+        sys.modules[names[0] + "b"] = ModuleType(names[0] + "b")
+        assert injector._get_fresh_imports() == [names[0] + "b"]
+        # and it is imported again
+        sys.modules[names[0]] = ModuleType(names[0])
+        assert injector._get_fresh_imports() == [names[0]]
+    finally:
+        for name in names + [names[0] + "b", names[1] + "b"]:
+            sys.modules.pop(name, None)
+
+
+def test_fresh_imports_real(tmp_path, monkeypatch, caplog) -> None:
+    # importlib moves a package to the tail of sys.modules once it is imported,
+    # after its submodules, which could be imported bypassing __import__
+    pkg = tmp_path / "_duecredit_test_freshpkg"
+    pkg.mkdir()
+    (pkg / "__init__.py").write_text(
+        "import importlib\n"
+        "from . import a\n"
+        "importlib.import_module('_duecredit_test_freshpkg.b')\n"
+    )
+    (pkg / "a.py").write_text("")
+    (pkg / "b.py").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    names = [f"_duecredit_test_freshpkg{sub}" for sub in ("", ".a", ".b")]
+
+    injector = DueCreditInjector(collector=DueCreditCollector(), engine="import")
+    injector.activate(retrospect=False)
+    caplog.set_level(1, logger="duecredit")
+    try:
+        __builtin__.__import__("_duecredit_test_freshpkg")
+        import json.tool  # noqa: F401
+    finally:
+        injector.deactivate()
+        for name in names:
+            sys.modules.pop(name, None)
+    assert set(names) | {"json.tool"} <= injector._processed_modules
+    # all found in the tail of sys.modules
+    assert "diffing all modules" not in caplog.text
@@ -7,19 +7,27 @@
 # ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
+import json
 import os
 import pickle
 import random
 import re
+import subprocess
+import sys
+import time
 from typing import Any
+from unittest import mock
 
 import pytest
 from pytest import MonkeyPatch
 
 import duecredit.io
 
+from .conftest import _bibtex, _DoiServer
 from .test_collector import _sample_bibtex, _sample_bibtex2, _sample_doi
+from ..cache import Cached
 from ..collector import CitationKey, DueCreditCollector
 from ..entries import BibTeX, Doi, Text, Url
 from ..io import (
@@ -31,6 +39,7 @@ from ..io import (
     format_bibtex,
     get_text_rendering,
     import_doi,
+    import_dois,
 )
 
 try:
@@ -86,8 +95,7 @@ def test_pickleoutput(tmpdir) -> None:
         assert pickler.fn == tempfile
         assert pickler.dump() is None  # type: ignore[func-returns-value]
 
-        with open(tempfile, "rb") as f:
-            collector_loaded = pickle.load(f)
+        collector_loaded = PickleOutput.load(tempfile)
 
         assert collector.citations.keys() == collector_loaded.citations.keys()
         # TODO: implement comparison of citations
@@ -95,6 +103,300 @@ def test_pickleoutput(tmpdir) -> None:
         os.unlink(tempfile)
 
 
+def test_import_dois(doi_server: _DoiServer, monkeypatch: MonkeyPatch) -> None:
+    sleeps: list[float] = []
+    monkeypatch.setattr(duecredit.io.time, "sleep", sleeps.append)
+    dois = [f"10.1/{i}" for i in range(20)]
+    for doi in dois:
+        doi_server.add(doi, (200, {}, _bibtex(doi)))
+    doi_server.add(
+        "10.1/busy", (429, {"Retry-After": "7"}, ""), (200, {}, _bibtex("b"))
+    )
+    doi_server.add("10.1/flaky", (503, {}, ""), (502, {}, ""), (200, {}, _bibtex("f")))
+    doi_server.delay = 0.05
+
+    bibtexs = import_dois(dois + ["10.1/busy", "10.1/flaky", "10.1/bad"], max_workers=4)
+    assert list(bibtexs) == dois + ["10.1/busy", "10.1/flaky"]
+    assert bibtexs["10.1/3"] == _bibtex("10.1/3")
+    # concurrently, over the pooled connections
+    assert doi_server.max_active == 4
+    assert len(doi_server.connections) == 4
+    # Retry-After is honored, and otherwise waits double
+    assert sorted(sleeps) == [0.5, 1.0, 7.0]
+    # wrong DOI is not retried
+    assert doi_server.requests["10.1/bad"] == 1
+
+    # all cached now, and so is the failure for the wrong one
+    doi_server.requests.clear()
+    assert import_dois(dois + ["10.1/bad"]) == {doi: _bibtex(doi) for doi in dois}
+    assert import_doi("10.1/busy") == _bibtex("b")
+    with pytest.raises(ValueError, match="Response code 404. .cached"):
+        import_doi("10.1/bad")
+    assert not doi_server.requests
+
+    # gives up after so many retries
+    doi_server.add("10.1/down", (500, {}, ""))
+    sleeps.clear()
+    with pytest.raises(ValueError, match="Response code 500"):
+        import_doi("10.1/down", sleep=0.1, retries=4)
+    assert sleeps == [0.1, 0.2, 0.4]
+
+
+def test_import_dois_revalidate(
+    doi_server: _DoiServer, monkeypatch: MonkeyPatch
+) -> None:
+    monkeypatch.setattr(duecredit.io.time, "sleep", lambda _: None)
+    doi_server.add("10.1/a", (200, {}, _bibtex("a")), (200, {}, _bibtex("a2")))
+    doi_server.add("10.1/b", (200, {}, _bibtex("b")), (404, {}, ""))
+    assert import_dois(["10.1/a", "10.1/b", "10.1/c"]) == {
+        "10.1/a": _bibtex("a"),
+        "10.1/b": _bibtex("b"),
+    }
+    cache = duecredit.io._get_doi_cache()
+    assert cache is not None
+
+    # expired, so fetched again, but if it fails, still used
+    cache.ttl = cache.negative_ttl = 0
+    doi_server.requests.clear()
+    assert import_dois(["10.1/a", "10.1/b", "10.1/c"]) == {
+        "10.1/a": _bibtex("a2"),
+        "10.1/b": _bibtex("b"),
+    }
+    assert doi_server.requests == {"10.1/a": 1, "10.1/b": 1, "10.1/c": 1}
+    # and the failure is remembered for as long as the negative TTL
+    cache.negative_ttl = 3600
+    doi_server.requests.clear()
+    assert import_dois(["10.1/b", "10.1/c"]) == {"10.1/b": _bibtex("b")}
+    assert not doi_server.requests
+    assert cache.stats()["failed"] == 2
+
+    # while failures of the network are remembered only for the offline TTL,
+    # and BibTeX fetched before is still used then
+    monkeypatch.setattr(duecredit.io, "DOI_RESOLVER_URL", "http://127.0.0.1:9/")
+    cache.ttl = 0
+    cache.offline_ttl = 3600
+    with pytest.raises(ValueError, match="Max retries"):
+        import_doi("10.1/d")
+    assert import_doi("10.1/a") == _bibtex("a2")
+    assert cache.lookup(["10.1/a", "10.1/d"]) == {
+        "10.1/a": Cached(_bibtex("a2"), mock.ANY, mock.ANY, True),
+        "10.1/d": Cached(None, mock.ANY, mock.ANY, True),
+    }
+    cache.offline_ttl = 0
+    assert not cache.lookup(["10.1/d"])["10.1/d"].fresh
+    # and then are forgotten along with the other failures
+    assert cache.prune() == 1
+    assert "10.1/d" not in cache.lookup(["10.1/d"])
+
+
+def test_import_dois_unreachable(
+    doi_server: _DoiServer, monkeypatch: MonkeyPatch
+) -> None:
+    # fails right away, instead of retrying each DOI
+    monkeypatch.setattr(duecredit.io, "DOI_RESOLVER_URL", "http://127.0.0.1:9/")
+    dois = [f"10.1/{i}" for i in range(20)]
+    for max_workers in (1, 4):
+        start = time.monotonic()
+        assert import_dois(dois, max_workers=max_workers) == {}
+        assert time.monotonic() - start < 1
+        # the failures are cached, so the network is not waited for again
+        with pytest.raises(ValueError, match="could not be reached.* .cached"):
+            import_doi(dois[-1])
+        duecredit.io._get_doi_cache().prune(failed=True)  # type: ignore[union-attr]
+
+
+def test_fetch_doi_retry_budget(
+    doi_server: _DoiServer, monkeypatch: MonkeyPatch
+) -> None:
+    sleeps: list[float] = []
+    monkeypatch.setattr(duecredit.io.time, "sleep", sleeps.append)
+    monkeypatch.setattr(duecredit.io, "MAX_TOTAL_RETRY_WAIT", 10)
+    for doi in ("10.1/a", "10.1/b"):
+        doi_server.add(doi, (503, {"Retry-After": "6"}, ""), (200, {}, _bibtex(doi)))
+    # waits for all the DOIs fetched at once count against the same limit
+    bibtexs, errors = duecredit.io._import_dois(["10.1/a", "10.1/b"], 1, 0.5, 10)
+    assert bibtexs == {"10.1/a": _bibtex("10.1/a")}
+    assert "too long to wait 6.0 sec" in errors["10.1/b"]
+    assert sleeps == [6]
+
+
+def test_outputs_prefetch_dois(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("DUECREDIT_REPORT_TAGS", "*")
+    fetched = []
+    monkeypatch.setattr(
+        duecredit.io,
+        "import_dois",
+        lambda dois: fetched.append(sorted(dois)) or {"10.1/b": _bibtex("b")},
+    )
+
+    def import_doi(doi: str) -> str:
+        raise AssertionError(f"{doi} is looked up again")
+
+    monkeypatch.setattr(duecredit.io, "import_doi", import_doi)
+    monkeypatch.setattr(
+        duecredit.io, "format_bibtex", lambda entry, style: f"<{entry.key}>"
+    )
+    collector = DueCreditCollector()
+    collector.cite(Doi("10.1/a"), path="pkg")
+    collector.cite(Doi("10.1/b"), path="pkg.mod")
+    collector.cite(Text("text"), path="pkg.mod")
+    out = StringIO()
+    BibTeXOutput(out, collector).dump()
+    # all at once, and those which failed are skipped
+    assert fetched == [["10.1/a", "10.1/b"]]
+    assert out.getvalue() == _bibtex("b") + "\n"
+
+    fetched.clear()
+    out = StringIO()
+    TextOutput(out, collector).dump()
+    assert fetched == [["10.1/a", "10.1/b"]]
+    assert "DOI: 10.1/a" in out.getvalue()
+    assert "<b>" in out.getvalue()
+
+
+def test_fetch_dois_at_exit(doi_server: _DoiServer) -> None:
+    # threads can no longer be started by the time citations are dumped
+    doi_server.add("10.1/a", (200, {}, _bibtex("a")))
+    doi_server.add("10.1/b", (200, {}, _bibtex("b")))
+    script = (
+        "import atexit, duecredit.io\n"
+        f"duecredit.io.DOI_RESOLVER_URL = {duecredit.io.DOI_RESOLVER_URL!r}\n"
+        "atexit.register(lambda: print("
+        "sorted(duecredit.io._fetch_dois(['10.1/a', '10.1/b'], 4, 0, 1)[0])))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    assert out.stdout == "['10.1/a', '10.1/b']\n", out.stderr
+    assert doi_server.requests == {"10.1/a": 1, "10.1/b": 1}
+
+
+def test_pickleoutput_merge(tmp_path) -> None:
+    fn = str(tmp_path / "duecredit.p")
+    key_a, key_b = CitationKey("mod", "a"), CitationKey("mod", "b")
+
+    def counts() -> dict[CitationKey, int]:
+        return {k: c.count for k, c in PickleOutput.load(fn).citations.items()}
+
+    session = DueCreditCollector()
+    session.cite(Text("a", key="a"), path="mod")
+    session.cite(Text("a", key="a"), path="mod")
+    PickleOutput(session, fn=fn).dump()
+    assert counts() == {key_a: 2}
+    # dumped again -- only what was cited since then gets merged
+    PickleOutput(session, fn=fn).dump()
+    assert counts() == {key_a: 2}
+    session.cite(Text("a", key="a"), path="mod")
+    PickleOutput(session, fn=fn).dump()
+    assert counts() == {key_a: 3}
+
+    # next session starts afresh, and gets merged with the previous ones
+    session = DueCreditCollector()
+    session.cite(Text("a", key="a"), path="mod")
+    session.cite(Text("b", key="b"), path="mod")
+    PickleOutput(session, fn=fn).dump()
+    assert counts() == {key_a: 4, key_b: 1}
+    assert sorted(os.listdir(tmp_path)) == ["duecredit.p", "duecredit.p.lock"]
+
+    # concurrent sessions do not overwrite each other
+    def run_session(i: int) -> None:
+        session = DueCreditCollector()
+        session.cite(Text("a", key="a"), path="mod")
+        session.cite(Text(str(i), key=str(i)), path="mod")
+        PickleOutput(session, fn=fn).dump()
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(run_session, range(16)))
+    stored = counts()
+    assert stored[key_a] == 20
+    assert len(stored) == 18
+
+    # the stored file is never overwritten if it could not be loaded
+    with open(fn, "w") as f:
+        f.write("{}")
+    with pytest.raises(ValueError):
+        PickleOutput(session, fn=fn).dump()
+    with open(fn) as f:
+        assert f.read() == "{}"
+
+
+def test_citations_format(tmp_path) -> None:
+    fn = str(tmp_path / "duecredit.p")
+    collector = DueCreditCollector()
+    # never cited -- not stored
+    collector.add(Doi("10.1/never"))
+    bibtex = BibTeX(_sample_bibtex)
+    collector.cite(bibtex, path="package.module:func", version="1.0", tags=["edu"])
+    collector.cite(bibtex, path="package.module:func")
+    collector.cite(
+        Url("http://example.com", key="url"), path="other", version=("a", "b")
+    )
+    collector.cite(Text("Something", key="text"), path="text", cite_module=True)
+    PickleOutput(collector, fn=fn).dump()
+
+    with open(fn, encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["format"] == "duecredit-citations"
+    assert data["version"] == 1
+    assert len(data["entries"]) == 3
+    assert len(data["citations"]) == 3
+
+    loaded = PickleOutput.load(fn)
+    assert list(loaded._entries) == ["XXX0", "url", "text"]
+    assert loaded.citations.keys() == collector.citations.keys()
+    for key, citation in collector.citations.items():
+        loaded_citation = loaded.citations[key]
+        assert loaded_citation.entry == citation.entry
+        assert type(loaded_citation.entry) is type(citation.entry)
+        for attr in ("description", "cite_module", "tags", "version", "count"):
+            assert getattr(loaded_citation, attr) == getattr(citation, attr)
+
+    # newer versions of the format are not misinterpreted
+    with open(fn, "w", encoding="utf-8") as f:
+        json.dump({"format": "duecredit-citations", "version": 2}, f)
+    with pytest.raises(ValueError, match="Unsupported version 2"):
+        PickleOutput.load(fn)
+
+
+def test_citations_format_legacy_pickle(tmp_path) -> None:
+    fn = str(tmp_path / "duecredit.p")
+    collector = DueCreditCollector()
+    collector.cite(BibTeX(_sample_bibtex), path="module")
+    with open(fn, "wb") as f:
+        pickle.dump(collector, f)
+    loaded = PickleOutput.load(fn)
+    assert loaded.citations[CitationKey("module", "XXX0")].count == 1
+
+
+def test_pickleoutput_shards(tmp_path, monkeypatch: MonkeyPatch) -> None:
+    fn = str(tmp_path / "duecredit.p")
+    entry = BibTeX(_sample_bibtex)
+    # as dumped by two forked processes
+    for pid, n in ((1, 2), (2, 3)):
+        monkeypatch.setattr(os, "getpid", lambda pid=pid: pid)
+        collector = DueCreditCollector()
+        for _ in range(n):
+            collector.cite(entry, path="module")
+        collector.cite(entry, path=f"module{pid}")
+        PickleOutput(collector, fn=fn, shard=True).dump()
+    assert sorted(os.listdir(fn + ".d")) == ["1.p", "2.p"]
+    # something to be ignored
+    (tmp_path / "duecredit.p.d" / "3.p").write_text("garbage")
+
+    shards = PickleOutput.load_shards(fn)
+    assert [os.path.basename(shard_fn) for shard_fn, _ in shards] == ["1.p", "2.p"]
+    collector = DueCreditCollector()
+    collector.cite(entry, path="module")
+    for _, shard in shards:
+        collector._merge(shard)
+    assert {k.path: c.count for k, c in collector.citations.items()} == {
+        "module": 6,
+        "module1": 1,
+        "module2": 1,
+    }
+    assert PickleOutput.load_shards(str(tmp_path / "missing.p")) == []
+
+
 def test_output() -> None:
     entry = BibTeX(_sample_bibtex)
     entry2 = BibTeX(_sample_bibtex2)
@@ -0,0 +1,137 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+from __future__ import annotations
+
+import os
+import shutil
+
+import pytest
+
+from .. import journal as journal_mod
+from ..collector import CitationKey, CollectorSummary, DueCreditCollector
+from ..entries import Doi, Text
+from ..io import PickleOutput
+from ..journal import _get_host_id, _parse_journal, load_journal, load_journals
+
+KEY1 = CitationKey("mod", "key1")
+KEY2 = CitationKey("mod.f", "10.1/x")
+
+
+def _counts(collector: DueCreditCollector) -> dict[CitationKey, int]:
+    return {key: c.count for key, c in collector.citations.items()}
+
+
+def test_parse_journal() -> None:
+    assert _parse_journal("no") is None
+    assert _parse_journal("yes") == 0
+    assert _parse_journal("0.5") == 0.5
+    for value in ("maybe", "-1"):
+        with pytest.raises(ValueError):
+            _parse_journal(value)
+
+
+def test_journal(tmp_path) -> None:
+    fn = str(tmp_path / "duecredit.p")
+    collector = DueCreditCollector()
+    collector.cite(Text("before", key="key1"), path="mod")
+    collector._start_journal(fn)
+    journal = collector._journal
+    assert journal is not None
+    assert journal.fn == os.path.join(
+        fn + ".d", f"{os.getpid()}@{_get_host_id()}.journal"
+    )
+    # nothing new was cited yet
+    assert not os.path.exists(journal.fn)
+
+    collector.cite(Doi("10.1/x"), path="mod.f")
+    collector.cite(Doi("10.1/x"), path="mod.f")
+    collector.cite(Text("before", key="key1"), path="mod")
+    # only the first citation is recorded right away
+    assert _counts(load_journal(journal.fn)) == {KEY2: 1}
+    assert [fn_ for fn_, _ in load_journals(fn)] == [journal.fn]
+    # but not claimed, since we are alive
+    assert load_journals(fn, claim=True) == []
+
+    journal.record_counts()
+    journaled = load_journal(journal.fn)
+    assert _counts(journaled) == {KEY1: 1, KEY2: 2}
+    assert journaled._entries["10.1/x"].__class__ is Doi
+    collector.cite(Doi("10.1/x"), path="mod.f")
+    journal.record_counts()
+    assert _counts(load_journal(journal.fn)) == {KEY1: 1, KEY2: 3}
+
+    # merged from a shard, so accounted for there
+    shard = DueCreditCollector()
+    shard.cite(Doi("10.1/x"), path="mod.f")
+    shard.cite(Text("shard", key="key3"), path="mod")
+    collector._merge(shard, journal=False)
+    assert collector.citations[KEY2].count == 4
+    # merged from a worker, so to be journaled
+    worker = DueCreditCollector()
+    worker.cite(Doi("10.1/x"), path="mod.f")
+    worker.cite(Text("shard", key="key3"), path="mod")
+    collector._merge(worker)
+    journal.record_counts()
+    journal.close()
+    expected = {KEY1: 1, KEY2: 4, CitationKey("mod", "key3"): 1}
+    assert _counts(load_journal(journal.fn)) == expected
+
+    # a truncated record (e.g. if killed while writing it) is ignored
+    with open(journal.fn, "a") as f:
+        f.write('{"counts": [["mod.f", "10.1/x", 1')
+    assert _counts(load_journal(journal.fn)) == expected
+
+
+def test_journal_compact(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(journal_mod, "MAX_JOURNAL_SIZE", 1000)
+    collector = DueCreditCollector()
+    collector._start_journal(str(tmp_path / "duecredit.p"))
+    journal = collector._journal
+    for _ in range(100):
+        collector.cite(Doi("10.1/x"), path="mod.f")
+        journal.record_counts()
+    assert os.path.getsize(journal.fn) <= 1000
+    collector.cite(Text("other", key="key1"), path="mod")
+    journal.close()
+    assert _counts(load_journal(journal.fn)) == {KEY1: 1, KEY2: 100}
+
+
+def test_journal_dump(tmp_path, monkeypatch) -> None:
+    fn = str(tmp_path / "duecredit.p")
+    # journal left by a crashed process
+    crashed = DueCreditCollector()
+    crashed._start_journal(fn)
+    crashed.cite(Doi("10.1/x"), path="mod.f")
+    crashed._journal.close()
+    crashed_fn = os.path.join(fn + ".d", f"999999@{_get_host_id()}.journal")
+    os.rename(crashed._journal.fn, crashed_fn)
+    # and by a process on another host, which we cannot tell is gone
+    remote_fn = os.path.join(fn + ".d", "999998@elsewhere.journal")
+    shutil.copy(crashed_fn, remote_fn)
+    monkeypatch.setattr(journal_mod, "_pid_alive", lambda pid: pid == os.getpid())
+
+    collector = DueCreditCollector()
+    collector._start_journal(fn)
+    collector.cite(Doi("10.1/x"), path="mod.f")
+    collector.cite(Text("new", key="key1"), path="mod")
+    assert os.path.exists(collector._journal.fn)
+
+    CollectorSummary(collector, outputs="pickle", fn=fn).dump()
+    assert _counts(PickleOutput.load(fn)) == {KEY1: 1, KEY2: 2}
+    # all got dumped, so journals are gone, but for the one of the other host
+    assert os.listdir(fn + ".d") == ["999998@elsewhere.journal"]
+    os.unlink(remote_fn)
+
+    # and journaling goes on from there
+    collector.cite(Text("new", key="key1"), path="mod")
+    collector._journal.record_counts()
+    assert _counts(load_journal(collector._journal.fn)) == {KEY1: 1}
+    CollectorSummary(collector, outputs="pickle", fn=fn).dump()
+    assert _counts(PickleOutput.load(fn)) == {KEY1: 2, KEY2: 2}
+    assert not os.path.exists(fn + ".d")
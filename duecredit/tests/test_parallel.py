@@ -0,0 +1,55 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import pytest
+
+from ..collector import CitationKey, DueCreditCollector
+from ..dueswitch import DueSwitch, due
+from ..entries import Text
+from ..parallel import WorkersCitations
+from ..stub import InactiveDueCreditCollector
+
+
+def _cite_in_worker(i: int) -> int:
+    due.cite(Text("In worker", key="worker"), path="workers")
+    due.cite(Text(f"Task {i % 2}", key=f"task{i % 2}"), path="workers")
+    return i
+
+
+@pytest.mark.parametrize("start_method", ["spawn", "fork"])
+def test_workers_citations(start_method: str) -> None:
+    if start_method not in multiprocessing.get_all_start_methods():
+        pytest.skip(f"{start_method} is not available")
+    mp_context = multiprocessing.get_context(start_method)
+    collector = DueCreditCollector()
+    collector.cite(Text("In worker", key="worker"), path="workers")
+    with WorkersCitations(collector, mp_context=mp_context) as workers:
+        with ProcessPoolExecutor(
+            2,
+            mp_context=mp_context,
+            initializer=workers.initializer,
+            initargs=workers.initargs,
+        ) as executor:
+            assert list(executor.map(_cite_in_worker, range(10))) == list(range(10))
+    counts = {key.entry_key: c.count for key, c in collector.citations.items()}
+    assert counts == {"worker": 11, "task0": 5, "task1": 5}
+    assert collector.citations[CitationKey("workers", "task1")].entry == Text(
+        "Task 1", key="task1"
+    )
+
+
+def test_workers_citations_inactive() -> None:
+    switch = DueSwitch(InactiveDueCreditCollector(), DueCreditCollector, False)
+    with WorkersCitations(switch) as workers:
+        assert workers.initializer is None
+        assert workers.initargs == ()
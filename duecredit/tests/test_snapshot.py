@@ -0,0 +1,71 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+from __future__ import annotations
+
+import json
+import os
+
+from pytest import MonkeyPatch
+
+import duecredit.io
+import duecredit.snapshot
+
+from ..entries import Doi
+from ..io import get_bibtex_rendering, import_dois
+from ..snapshot import get_injection_dois, get_snapshot, main
+from .conftest import _bibtex, _DoiServer
+
+
+def test_update_snapshot(
+    doi_server: _DoiServer,
+    monkeypatch: MonkeyPatch,
+    tmp_path,
+) -> None:
+    monkeypatch.setattr(duecredit.io.time, "sleep", lambda _: None)
+    dois = get_injection_dois()
+    doi_server.delay = 0.05
+    fn = str(tmp_path / "bibtex.json")
+    # nothing to write without access to the resolver
+    assert main(["-o", fn, "-j", "4"]) == 1
+    assert not os.path.exists(fn)
+    for doi in dois[1:]:
+        doi_server.add(doi, (200, {}, _bibtex(doi)))
+    doi_server.requests.clear()
+    # concurrently, and regardless of the cache
+    duecredit.io._cache_bibtexs({dois[1]: "@misc{old}"}, {}, {})
+    assert main(["-o", fn, "-j", "4"]) == 1
+    assert doi_server.max_active == 4
+    assert doi_server.requests == dict.fromkeys(dois, 1)
+    with open(fn) as f:
+        assert json.load(f)["bibtex"] == {
+            doi: None if doi == dois[0] else _bibtex(doi) for doi in dois
+        }
+
+    # used before the cache and the network
+    monkeypatch.setattr(duecredit.snapshot, "SNAPSHOT_FILE", fn)
+    monkeypatch.setattr(duecredit.io, "DOI_RESOLVER_URL", "http://127.0.0.1:9/")
+    assert get_bibtex_rendering(Doi(dois[1])).rawentry == _bibtex(dois[1])
+    assert import_dois(dois, retries=1) == {doi: _bibtex(doi) for doi in dois[1:]}
+    cache = duecredit.io._get_doi_cache()
+    assert cache is not None
+    # only the one missing from the snapshot was looked up
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 1)
+
+
+def test_broken_snapshot(monkeypatch: MonkeyPatch, tmp_path) -> None:
+    # or missing
+    monkeypatch.setattr(
+        duecredit.snapshot, "SNAPSHOT_FILE", str(tmp_path / "missing.json")
+    )
+    assert get_snapshot() == {}
+    fn = tmp_path / "bibtex.json"
+    fn.write_text('{"bibtex": {}}')
+    monkeypatch.setattr(duecredit.snapshot, "SNAPSHOT_FILE", str(fn))
+    assert get_snapshot() == {}
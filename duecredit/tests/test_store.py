@@ -0,0 +1,120 @@
+# emacs: -*- mode: python; py-indent-offset: 4; tab-width: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 noet:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the duecredit package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+from __future__ import annotations
+
+from datetime import datetime
+import sqlite3
+
+import pytest
+
+from ..cmdline import main
+from ..collector import CitationKey, CollectorSummary, DueCreditCollector
+from ..entries import BibTeX, Doi, Text
+from ..store import SQLiteOutput, SQLiteStore
+from .test_collector import _sample_bibtex
+
+
+def _collector(n: int = 1, version: str = "1.0") -> DueCreditCollector:
+    collector = DueCreditCollector()
+    for _ in range(n):
+        collector.cite(BibTeX(_sample_bibtex), path="pkg.mod:func", version=version)
+    collector.cite(
+        Doi("10.1/x"), path="other", cite_module=True, tags=["implementation", "edu"]
+    )
+    return collector
+
+
+def test_store(tmp_path) -> None:
+    db = str(tmp_path / "duecredit.db")
+    with SQLiteStore(db) as store:
+        store.add(_collector(2), run="run1", timestamp=100)
+        store.add(_collector(3), run="run2", timestamp=200)
+        # counts get added up within the same run
+        store.add(_collector(1), run="run2")
+
+        assert store.aggregate("package") == [
+            ("pkg", 2, 6, 200),
+            ("other", 2, 3, 200),
+        ]
+        assert store.aggregate("tag", tag="edu") == [("edu", 2, 3, 200)]
+        assert store.aggregate("module", since=150) == [
+            ("pkg.mod", 1, 4, 200),
+            ("other", 1, 2, 200),
+        ]
+        assert store.aggregate("entry", since=datetime.fromtimestamp(300)) == []
+        with pytest.raises(ValueError):
+            store.aggregate("nothing")
+
+        due = store.load()
+        assert {k: c.count for k, c in due.citations.items()} == {
+            CitationKey("pkg.mod:func", "XXX0"): 6,
+            CitationKey("other", "10.1/x"): 3,
+        }
+        citation = due.citations[CitationKey("other", "10.1/x")]
+        assert citation.cite_module
+        assert sorted(citation.tags) == ["edu", "implementation"]
+        assert due.citations[CitationKey("pkg.mod:func", "XXX0")].version == "1.0"
+        assert isinstance(citation.entry, Doi)
+        assert list(store.load(tag="edu").citations) == [
+            CitationKey("other", "10.1/x")
+        ]
+
+        # version is the one of the latest run, not the greatest
+        store.add(_collector(1, version="0.9"), run="run3", timestamp=300)
+        store.add(_collector(1, version="10.0"), run="run0", timestamp=50)
+        due = store.load()
+        assert due.citations[CitationKey("pkg.mod:func", "XXX0")].version == "0.9"
+
+    # newer schemas are not understood
+    with sqlite3.connect(db) as conn:
+        conn.execute("PRAGMA user_version=2")
+    conn.close()
+    with pytest.raises(ValueError, match="Upgrade duecredit"):
+        SQLiteStore(db)
+
+
+def test_store_many(tmp_path) -> None:
+    # more than could be looked up by a single query
+    collector = DueCreditCollector()
+    for i in range(1200):
+        collector.cite(Text(f"text{i % 700}", key=f"key{i % 700}"), path=f"m{i}")
+    with SQLiteStore(str(tmp_path / "duecredit.db")) as store:
+        store.add(collector, run="run1", timestamp=100)
+        store.add(collector, run="run2", timestamp=200)
+        due = store.load()
+    assert len(due.citations) == 1200
+    assert {c.count for c in due.citations.values()} == {2}
+    assert len(due._entries) == 700
+
+
+def test_sqlite_output(tmp_path, monkeypatch, capsys) -> None:
+    db = str(tmp_path / "duecredit.db")
+    monkeypatch.delenv("DUECREDIT_OUTPUTS", raising=False)
+    collector = _collector(2)
+    (output,) = CollectorSummary(collector, outputs="sqlite")._outputs
+    assert isinstance(output, SQLiteOutput)
+
+    SQLiteOutput(collector, fn=db).dump()
+    # only the new citations get recorded, as of the same run
+    SQLiteOutput(collector, fn=db).dump()
+    collector.cite(Text("new", key="new"), path="pkg.sub")
+    SQLiteOutput(collector, fn=db).dump()
+    with SQLiteStore(db) as store:
+        assert [row[:3] for row in store.aggregate("package")] == [
+            ("pkg", 1, 3),
+            ("other", 1, 1),
+        ]
+
+    main.main(["summary", "--db", db, "--by", "package"])
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].split() == ["package", "runs", "count", "last", "run"]
+    assert [line.split()[:3] for line in out[1:]] == [
+        ["pkg", "1", "3"],
+        ["other", "1", "1"],
+    ]
@@ -8,12 +8,15 @@
 # ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 from __future__ import annotations
 
+import importlib
+import importlib.metadata
 from os import linesep
+import sys
 
 import pytest
 
 from .._version import __version__
-from ..versions import ExternalVersions, Version
+from ..versions import DistributionsIndex, ExternalVersions, Version
 
 
 # just to ease testing
@@ -105,3 +108,69 @@ def test_external_versions_popular_packages(modname: str) -> None:
     # more of a smoke test
     assert linesep not in ev.dumps()
     assert ev.dumps(indent=True).endswith(linesep)
+
+
+def test_distributions_index(tmp_path, monkeypatch) -> None:
+    cache_file = str(tmp_path / "sub" / "versions.json")
+    pytest_version = importlib.metadata.version("pytest")
+
+    index = DistributionsIndex(cache_file=cache_file)
+    # by a package name, different from the distribution name, and by either
+    assert index.get("_pytest") == pytest_version
+    assert index.get("pytest") == pytest_version
+    assert index.get("duecredit") == importlib.metadata.version("duecredit")
+    assert index.get("duecreditnonexisting") is None
+
+    # Another one should use the cache and not scan distributions again
+    def fail_scan():
+        raise AssertionError("must not be called")
+
+    with monkeypatch.context() as m:
+        m.setattr(importlib.metadata, "distributions", fail_scan)
+        index2 = DistributionsIndex(cache_file=cache_file)
+        assert index2.get("_pytest") == pytest_version
+        # but if anything changed in site-packages -- it must be rebuilt
+        m.setattr(
+            DistributionsIndex, "_get_fingerprint", staticmethod(lambda: [["/x", 1]])
+        )
+        index3 = DistributionsIndex(cache_file=cache_file)
+        with pytest.raises(AssertionError):
+            index3.get("_pytest")
+
+    assert index3.get("_pytest") == pytest_version
+
+    # installed into a directory added to sys.path
+    fingerprint = DistributionsIndex._get_fingerprint()
+    site = tmp_path / "site"
+    monkeypatch.syspath_prepend(str(site))
+    assert DistributionsIndex._get_fingerprint() == [[str(site), None]] + fingerprint
+    dist_info = site / "duecredit_test_dist-1.2.dist-info"
+    dist_info.mkdir(parents=True)
+    (dist_info / "METADATA").write_text(
+        "Metadata-Version: 2.1\nName: duecredit-test-dist\nVersion: 1.2\n"
+    )
+    assert DistributionsIndex._get_fingerprint()[0][1] is not None
+    assert DistributionsIndex(cache_file=cache_file).get("duecredit-test-dist") == "1.2"
+    # and even if it is not noticed, it is found in the metadata
+    assert index3.get("duecredit-test-dist") == "1.2"
+
+
+def test_external_versions_metadata_only(tmp_path, monkeypatch) -> None:
+    (tmp_path / "duecredit_test_noimport.py").write_text(
+        "raise AssertionError('must not be imported')\n__version__ = '1.0'\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    ev = ExternalVersions(metadata_only=True)
+    # not installed as a distribution, so we do not know
+    assert ev["duecredit_test_noimport"] is ev.UNKNOWN
+    assert "duecredit_test_noimport" not in sys.modules
+    # but we know versions of installed ones
+    assert ev["pytest"] == Version(importlib.metadata.version("pytest"))
+    # and still use loaded modules
+    mod = importlib.import_module("duecredit.tests.mod")
+    assert ev["duecredit.tests.mod"] == Version(mod.__version__)
+
+    # while regular one would import
+    with pytest.raises(AssertionError, match="must not be imported"):
+        ExternalVersions()["duecredit_test_noimport"]
@@ -11,15 +11,24 @@ from __future__ import annotations
 """Module to help maintain a registry of versions for external modules etc
 """
 from collections.abc import KeysView
-from importlib.metadata import version as metadata_version
+import importlib.metadata
+import json
+import logging
+import os
 from os import linesep
+import re
 import sys
+import tempfile
 from types import ModuleType
 from typing import Any
 
 from looseversion import LooseVersion
 from packaging.version import Version
 
+from .config import VERSIONS_CACHE_FILE
+
+lgr = logging.getLogger("duecredit.versions")
+
 
 # To depict an unknown version, which can't be compared by mistake etc
 class UnknownVersion:
@@ -34,6 +43,158 @@ class UnknownVersion:
         raise TypeError("UNKNOWN version is not comparable")
 
 
+def _normalize_dist_name(name: str) -> str:
+    """Normalize distribution name as in PEP 503"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _packages_distributions() -> dict[str, list[str]]:
+    """Map top-level importable packages to the distributions providing them"""
+    if hasattr(importlib.metadata, "packages_distributions"):
+        return importlib.metadata.packages_distributions()
+    # Python 3.9 -- the same logic as of later stdlib, but only top_level.txt
+    # or top-level .py files/directories listed in RECORD
+    pkg_to_dist: dict[str, list[str]] = {}
+    for dist in importlib.metadata.distributions():
+        top_level = (dist.read_text("top_level.txt") or "").split()
+        if not top_level:
+            top_level = [
+                f.parts[0][:-3] if f.parts[0].endswith(".py") else f.parts[0]
+                for f in dist.files or []
+                if f.parts and (len(f.parts) > 1 or f.suffix == ".py")
+            ]
+        for pkg in top_level:
+            pkg_to_dist.setdefault(pkg, []).append(dist.metadata["Name"])
+    return pkg_to_dist
+
+
+class DistributionsIndex:
+    """Versions of all installed distributions, collected in a single scan
+
+    Versions are indexed by distribution names and by names of the top-level
+    packages they provide (e.g. "citeproc" for "citeproc-py").  The index is
+    cached in `cache_file` and rebuilt whenever any of the directories on
+    sys.path gets modified, i.e. when anything gets (un)installed.  Names
+    missing from the index are still looked up in the metadata, in case they
+    were installed where it could not be told (e.g. the current directory).
+    """
+
+    CACHE_FORMAT = 1
+
+    def __init__(self, cache_file: str | None = VERSIONS_CACHE_FILE) -> None:
+        self._cache_file = cache_file
+        self._index: dict[str, dict[str, str]] | None = None
+
+    @staticmethod
+    def _get_fingerprint() -> list[list[Any]]:
+        """Modification times of the directories distributions are installed into
+
+        Those are all on sys.path (site-packages, but also e.g. PYTHONPATH or
+        user site), but for the current directory, which gets modified by
+        anything written there (e.g. by us).  Missing ones are included too,
+        so their creation is noticed.
+        """
+        cwd = os.getcwd()
+        fingerprint = []
+        for path in sys.path:
+            if not path or os.path.abspath(path) == cwd:
+                continue
+            try:
+                mtime: int | None = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            fingerprint.append([path, mtime])
+        return fingerprint
+
+    @staticmethod
+    def _build() -> dict[str, dict[str, str]]:
+        distributions: dict[str, str] = {}
+        for dist in importlib.metadata.distributions():
+            name = dist.metadata["Name"]
+            if name and dist.version:
+                # the first one found on sys.path is the one which is used
+                distributions.setdefault(_normalize_dist_name(name), dist.version)
+        packages = {}
+        for pkg, dist_names in _packages_distributions().items():
+            for dist_name in dist_names:
+                version = distributions.get(_normalize_dist_name(dist_name))
+                if version:
+                    packages[pkg] = version
+                    break
+        return {"packages": packages, "distributions": distributions}
+
+    def _load_cache(self, fingerprint: list[list[Any]]) -> dict | None:
+        if not self._cache_file or not os.path.exists(self._cache_file):
+            return None
+        try:
+            with open(self._cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            lgr.debug("Failed to load versions cache %s: %s", self._cache_file, e)
+            return None
+        if (
+            cache.get("format") != self.CACHE_FORMAT
+            or cache.get("executable") != sys.executable
+            or cache.get("fingerprint") != fingerprint
+        ):
+            lgr.debug("Versions cache %s is outdated", self._cache_file)
+            return None
+        return cache.get("index")
+
+    def _save_cache(self, fingerprint: list[list[Any]], index: dict) -> None:
+        if not self._cache_file:
+            return
+        cache = {
+            "format": self.CACHE_FORMAT,
+            "executable": sys.executable,
+            "fingerprint": fingerprint,
+            "index": index,
+        }
+        cache_dir = os.path.dirname(self._cache_file)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write to a temporary file first so concurrent readers never
+            # see it incomplete
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=".versions-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp, self._cache_file)
+        except OSError as e:
+            lgr.debug("Failed to save versions cache %s: %s", self._cache_file, e)
+
+    @property
+    def index(self) -> dict[str, dict[str, str]]:
+        if self._index is None:
+            fingerprint = self._get_fingerprint()
+            index = self._load_cache(fingerprint)
+            if index is None:
+                lgr.debug("Building index of versions of installed distributions")
+                index = self._build()
+                self._save_cache(fingerprint, index)
+            self._index = index
+        return self._index
+
+    def get(self, name: str) -> str | None:
+        """Return version for a top-level package or a distribution name"""
+        index = self.index
+        version = index["packages"].get(name) or index["distributions"].get(
+            _normalize_dist_name(name)
+        )
+        if version is None:
+            try:
+                version = importlib.metadata.version(name)
+            except (importlib.metadata.PackageNotFoundError, ValueError):
+                pass
+        return version
+
+    def reset(self) -> None:
+        """Forget the index so it is reconsidered upon next use"""
+        self._index = None
+
+
+distributions_index = DistributionsIndex()
+
+
 class ExternalVersions:
     """Helper to figure out/use versions of the external modules.
 
@@ -41,40 +202,27 @@ class ExternalVersions:
     comparisons easy.  If a version string doesn't conform to Version,
     LooseVersion will be used.  If a version can't be deduced for a module,
     'None' is assigned
+
+    Parameters
+    ----------
+    metadata_only : bool, optional
+      Never import modules which are not yet loaded, but consult only the
+      metadata of the installed distributions.  If the version is not known
+      there, UNKNOWN is assigned
     """
 
     UNKNOWN = UnknownVersion()
 
-    def __init__(self) -> None:
+    def __init__(self, metadata_only: bool = False) -> None:
         self._versions: dict[str, Version | LooseVersion | UnknownVersion] = {}
+        self._metadata_only = metadata_only
 
     @classmethod
-    def _deduce_version(
-        klass, module: ModuleType
-    ) -> Version | LooseVersion | UnknownVersion:
-        version = None
-        for attr in ("__version__", "version"):
-            if hasattr(module, attr):
-                version = getattr(module, attr)
-                break
-
+    def _make_version(klass, version: Any) -> Version | LooseVersion | UnknownVersion:
         if isinstance(version, (tuple, list)):
             #  Generate string representation
             version = ".".join(str(x) for x in version)
 
-        if not version:
-            # Try importlib.metadata
-            # module name might be different, and I found no way to
-            # deduce it for citeproc which comes from "citeproc-py"
-            # distribution
-            modname = module.__name__
-            try:
-                version = metadata_version(
-                    {"citeproc": "citeproc-py"}.get(modname, modname)
-                )
-            except Exception:
-                pass  # oh well - no luck either
-
         if version:
             try:
                 return Version(version)
@@ -84,6 +232,30 @@ class ExternalVersions:
         else:
             return klass.UNKNOWN
 
+    @staticmethod
+    def _get_metadata_version(modname: str) -> str | None:
+        """Get version from the metadata of the installed distributions"""
+        try:
+            return distributions_index.get(modname)
+        except Exception as e:
+            lgr.debug("Failed to get version of %s: %s", modname, e)
+            return None
+
+    @classmethod
+    def _deduce_version(
+        klass, module: ModuleType
+    ) -> Version | LooseVersion | UnknownVersion:
+        version = None
+        for attr in ("__version__", "version"):
+            if hasattr(module, attr):
+                version = getattr(module, attr)
+                break
+
+        if not version:
+            version = klass._get_metadata_version(module.__name__)
+
+        return klass._make_version(version)
+
     def __getitem__(
         self, module: Any
     ) -> Version | LooseVersion | UnknownVersion | None:
@@ -97,13 +269,19 @@ class ExternalVersions:
 
         if modname not in self._versions:
             if module is None:
-                if modname not in sys.modules:
+                if modname in sys.modules:
+                    module = sys.modules[modname]
+                elif self._metadata_only:
+                    # do not import it just to learn its version
+                    self._versions[modname] = self._make_version(
+                        self._get_metadata_version(modname)
+                    )
+                    return self._versions[modname]
+                else:
                     try:
                         module = __import__(modname)
                     except ImportError:
                         return None
-                else:
-                    module = sys.modules[modname]
 
             self._versions[modname] = self._deduce_version(module)
 
@@ -143,3 +321,6 @@ class ExternalVersions:
 
 
 external_versions = ExternalVersions()
+# to be used whenever importing modules is not desired, e.g. while reporting
+# on previously collected citations
+metadata_versions = ExternalVersions(metadata_only=True)